@@ -1,208 +1,1039 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
-from sqlalchemy.exc import SQLAlchemyError
+from flask import Flask, g, request, jsonify
+from flask.cli import AppGroup
+from flask.json.provider import DefaultJSONProvider
+import click
 
+from array import array
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import bisect
+import contextlib
+import copy
+import csv
 import datetime
+import functools
+import gzip
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import math
+import mmap
 import os
+import queue
+import re
 import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # not on Windows: archive writes are then only serialized per process
+    fcntl = None
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+# Optional (br / zstd are only offered when installed): loaded by load_compressors() on
+# the first compressible response, so CLI commands never import them
+brotli = None
+zstandard = None
+
+# Optional and slow to import (~70ms): loaded by load_psycopg() in PostgreSQL mode only
+psycopg = None
+
+# SQLAlchemy and the models in models.py (~180ms to import): loaded by load_orm() the first
+# time a query goes through the ORM, so CLI commands and prepared-statement requests skip it
+orm = None
+
+# Vectorizes the similar-books search (in requirements.txt); loaded by load_numpy() on first
+# use, with a slow pure-Python fallback if it is missing
+numpy = None
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}}, supports_credentials=True)
+
+def enable_cors_on_first_request(wsgi_app):
+    """Set up flask_cors just before the first request, so only serving processes
+    import it (Flask accepts new hooks until a request has been handled)"""
+    lock = threading.Lock()
+    enabled = threading.Event()
+    
+    def middleware(environ, start_response):
+        if not enabled.is_set():
+            with lock:
+                if not enabled.is_set():
+                    from flask_cors import CORS
+                    CORS(app, resources={r"/*": {"origins": "http://localhost:3000"}},
+                         supports_credentials=True)
+                    enabled.set()
+        return wsgi_app(environ, start_response)
+    return middleware
+
+app.wsgi_app = enable_cors_on_first_request(app.wsgi_app)
 
 # Configure SQLAlchemy
 base_dir = os.path.abspath(os.path.dirname(__file__))
-app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{os.path.join(base_dir, "tbrlist.db")}'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['DATABASE_PATH'] = os.environ.get('TBR_DATABASE_PATH', os.path.join(base_dir, "tbrlist.db"))
+app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{app.config["DATABASE_PATH"]}'
+
+# A postgresql:// URL switches storage from tbrlist.db to a PostgreSQL server
+app.config['DATABASE_URL'] = os.environ.get('TBR_DATABASE_URL')
+app.config['DATABASE_POOL_SIZE'] = int(os.environ.get('TBR_DATABASE_POOL_SIZE', '10'))
+app.config['PG_DUMP'] = os.environ.get('TBR_PG_DUMP', 'pg_dump')
+if app.config['DATABASE_URL']:
+    app.config['SQLALCHEMY_DATABASE_URI'] = re.sub(
+        r'^postgres(ql)?://', 'postgresql+psycopg://', app.config['DATABASE_URL'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': app.config['DATABASE_POOL_SIZE'],
+        'pool_pre_ping': True,
+    }
+
+# Serve read-mostly endpoints from an in-memory columnar snapshot (off by default)
+app.config['LIBRARY_SNAPSHOT'] = os.environ.get('TBR_LIBRARY_SNAPSHOT', '0') == '1'
+app.config['LIBRARY_SNAPSHOT_USERS'] = int(os.environ.get('TBR_LIBRARY_SNAPSHOT_USERS', '128'))
+
+# Per-user shard files live in SHARD_DIR; unset keeps everyone in tbrlist.db
+app.config['SHARD_DIR'] = os.environ.get('TBR_SHARD_DIR')
+app.config['SHARD_COUNT'] = int(os.environ.get('TBR_SHARD_COUNT', '16'))
+app.config['SHARD_CONNECTIONS'] = int(os.environ.get('TBR_SHARD_CONNECTIONS', '32'))
+
+# Admin endpoints require this in an X-Admin-Token header; unset, they're CLI-only
+app.config['ADMIN_TOKEN'] = os.environ.get('TBR_ADMIN_TOKEN')
+
+# Boot-time change log compaction runs at most this often (tracked in SchemaInfo)
+app.config['COMPACT_INTERVAL_HOURS'] = float(os.environ.get('TBR_COMPACT_INTERVAL_HOURS', '24'))
 
-# Initialize SQLAlchemy
-db = SQLAlchemy(app)
+# Count SQL statements per request (X-SQL-Statements header); the same statement more
+# than QUERY_REPEAT_LIMIT times is logged as an N+1 pattern, or fails the request if strict
+app.config['QUERY_COUNTING'] = os.environ.get('TBR_QUERY_COUNTING', '0') == '1'
+app.config['QUERY_STRICT'] = os.environ.get('TBR_QUERY_STRICT', '0') == '1'
+app.config['QUERY_REPEAT_LIMIT'] = int(os.environ.get('TBR_QUERY_REPEAT_LIMIT', '5'))
+
+# 'orjson' (used when installed) or 'stdlib'
+app.config['JSON_ENCODER'] = os.environ.get('TBR_JSON_ENCODER', 'orjson')
+
+# Compress responses (zstd/br/gzip by Accept-Encoding) at or above this many bytes
+app.config['COMPRESSION'] = os.environ.get('TBR_COMPRESSION', '1') == '1'
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('TBR_COMPRESS_MIN_SIZE', '1024'))
+
+# Fill in missing book metadata from a provider in METADATA_PROVIDERS; the default local
+# catalog (a SQLite file or .json/.jsonl/.csv) stays off until TBR_CATALOG_PATH is set
+app.config['ENRICHMENT_PROVIDER'] = os.environ.get('TBR_ENRICHMENT_PROVIDER', 'catalog')
+app.config['CATALOG_PATH'] = os.environ.get('TBR_CATALOG_PATH')
+app.config['ENRICHMENT_WORKERS'] = int(os.environ.get('TBR_ENRICHMENT_WORKERS', '4'))
+app.config['ENRICHMENT_RATE'] = float(os.environ.get('TBR_ENRICHMENT_RATE', '10'))  # lookups/second
+app.config['ENRICHMENT_CACHE_SIZE'] = int(os.environ.get('TBR_ENRICHMENT_CACHE_SIZE', '4096'))
+app.config['ENRICHMENT_CACHE_PATH'] = os.environ.get(
+    'TBR_ENRICHMENT_CACHE_PATH', os.path.join(base_dir, 'enrichment_cache.db'))
+app.config['ENRICHMENT_CACHE_DAYS'] = float(os.environ.get('TBR_ENRICHMENT_CACHE_DAYS', '30'))
+
+# Similar-books index: hashed feature vectors per database, memory-mapped from this directory
+app.config['SIMILAR_INDEX_DIR'] = os.environ.get(
+    'TBR_SIMILAR_INDEX_DIR', os.path.join(base_dir, 'similar_index'))
+app.config['SIMILAR_DIMENSIONS'] = int(os.environ.get('TBR_SIMILAR_DIMENSIONS', '128'))
+
+# Completed and DNF entries older than this move from TBRlist to the columnar archive
+app.config['ARCHIVE_DIR'] = os.environ.get('TBR_ARCHIVE_DIR', os.path.join(base_dir, 'archive'))
+app.config['ARCHIVE_AFTER_MONTHS'] = int(os.environ.get('TBR_ARCHIVE_AFTER_MONTHS', '12'))
+
+# Per-route token buckets per client address: "route=requests/seconds,..." ('' disables)
+app.config['RATE_LIMITS'] = os.environ.get(
+    'TBR_RATE_LIMITS',
+    '/api/backup=5/60,/api/export=10/60,/api/recommendations=60/60,/api/stats=120/60')
+app.config['RATE_LIMIT_CLIENTS'] = int(os.environ.get('TBR_RATE_LIMIT_CLIENTS', '10000'))
+
+# Concurrent identical GETs to expensive routes share one computation
+app.config['COALESCE_REQUESTS'] = os.environ.get('TBR_COALESCE_REQUESTS', '1') == '1'
+
+# /api/backup hands out the previous backup while it is this recent (seconds)
+app.config['BACKUP_DEBOUNCE_SECONDS'] = float(os.environ.get('TBR_BACKUP_DEBOUNCE_SECONDS', '30'))
 
 # ================ ORM Models (SQLAlchemy) ================
 
-class Author(db.Model):
-    __tablename__ = 'Authors'
-    author_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    name = db.Column(db.String(255), nullable=False)
-    books = db.relationship('Book', backref='author', lazy=True)
-
-class Genre(db.Model):
-    __tablename__ = 'Genres'
-    genre_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    genre = db.Column(db.String(100), nullable=False)
-    category = db.Column(db.String(100))
-    books = db.relationship('Book', backref='genre_rel', lazy=True)
-
-class ReadingStatus(db.Model):
-    __tablename__ = 'Reading Status'
-    status_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    status = db.Column(db.String(50), nullable=False)
-    tbr_items = db.relationship('TBRList', backref='status', lazy=True)
-
-class Book(db.Model):
-    __tablename__ = 'Books'
-    book_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    title = db.Column(db.String(255), nullable=False)
-    author_id = db.Column(db.Integer, db.ForeignKey('Authors.author_id'), nullable=False)
-    genre_id = db.Column(db.Integer, db.ForeignKey('Genres.genre_id'), nullable=False)
-    page_count = db.Column(db.Integer)
-    publication_year = db.Column(db.Integer)
-    rating = db.Column(db.Integer)
-    tbr_items = db.relationship('TBRList', backref='book', lazy=True, cascade="all, delete-orphan")
-
-class TBRList(db.Model):
-    __tablename__ = 'TBRlist'
-    tbr_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    book_id = db.Column(db.Integer, db.ForeignKey('Books.book_id'), nullable=False)
-    status_id = db.Column(db.Integer, db.ForeignKey('Reading Status.status_id'), nullable=False)
-    priority = db.Column(db.Integer, default=5)
-    date_added = db.Column(db.String(20))
-    date_completed = db.Column(db.String(20))
-
-class UserSettings(db.Model):
-    __tablename__ = 'UserSettings'
-    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    theme = db.Column(db.String(20), default='light')
-    card_layout = db.Column(db.String(20), default='grid')
-    show_priority = db.Column(db.Integer, default=1)  # SQLite boolean as integer
-    default_sort = db.Column(db.String(20), default='priority')
-    notifications = db.Column(db.Integer, default=1)
-    auto_backup = db.Column(db.Integer, default=0)
-
-class ReadingGoal(db.Model):
-    __tablename__ = 'ReadingGoals'
-    goal_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
-    user_id = db.Column(db.Integer, default=1)
-    goal_type = db.Column(db.String(50), nullable=False)
-    target_value = db.Column(db.Integer)
-    target_book_id = db.Column(db.Integer, db.ForeignKey('Books.book_id'))
-    target_genre_id = db.Column(db.Integer, db.ForeignKey('Genres.genre_id'))
-    start_date = db.Column(db.String(20), nullable=False)
-    end_date = db.Column(db.String(20), nullable=False)
-    completed = db.Column(db.Integer, default=0)
-    progress = db.Column(db.Integer, default=0)
+_orm_lock = threading.Lock()
+
+def load_orm():
+    """Import SQLAlchemy and the models (models.py) on first use"""
+    global orm
+    if orm is None:
+        with _orm_lock:
+            if orm is None:
+                import models
+                models.event.listen(models.Engine, 'before_cursor_execute',
+                                    _count_engine_statement)
+                orm = models
+    return orm
+
+# ================ Query Counting ================
+
+class QueryCounter:
+    """Counts the SQL statements run while it is active.
+    
+    The same statement text running many times in one request is the signature of an
+    N+1 pattern (one query per row instead of one query for all rows).
+    """
+    
+    def __init__(self):
+        self.statements = Counter()
+    
+    def record(self, sql):
+        self.statements[' '.join(sql.split())] += 1
+    
+    @property
+    def total(self):
+        return sum(self.statements.values())
+    
+    def repeated(self, limit):
+        """Statements that ran more than limit times"""
+        return {sql: count for sql, count in self.statements.items() if count > limit}
+
+_query_counters = threading.local()
+
+def active_query_counter():
+    return getattr(_query_counters, 'active', None)
+
+@contextlib.contextmanager
+def count_queries():
+    """Count every statement run on this thread (ORM engines and connect_db handles)"""
+    previous = active_query_counter()
+    counter = _query_counters.active = QueryCounter()
+    try:
+        yield counter
+    finally:
+        _query_counters.active = previous
+
+# Listens on every SQLAlchemy engine once load_orm() has run
+def _count_engine_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = active_query_counter()
+    if counter is not None:
+        counter.record(statement)
+
+class CountingCursor:
+    """sqlite3 cursor that reports its statements to a QueryCounter"""
+    
+    def __init__(self, cursor, counter):
+        self._cursor = cursor
+        self._counter = counter
+    
+    def execute(self, sql, params=()):
+        self._counter.record(sql)
+        self._cursor.execute(sql, params)
+        return self
+    
+    def executemany(self, sql, seq_of_params):
+        self._counter.record(sql)
+        self._cursor.executemany(sql, seq_of_params)
+        return self
+    
+    def __iter__(self):
+        return iter(self._cursor)
+    
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+@app.before_request
+def start_query_counting():
+    if ((app.config['QUERY_COUNTING'] or app.config['QUERY_STRICT'])
+            and active_query_counter() is None):
+        _query_counters.active = g.query_counter = QueryCounter()
+
+@app.after_request
+def check_query_counts(response):
+    counter = active_query_counter()
+    if counter is None:
+        return response
+    
+    response.headers['X-SQL-Statements'] = str(counter.total)
+    repeated = counter.repeated(app.config['QUERY_REPEAT_LIMIT'])
+    if repeated:
+        print(f"N+1 query pattern in {request.method} {request.path}: {repeated}")
+        if app.config['QUERY_STRICT']:
+            failed = jsonify({"error": "N+1 query pattern", "statements": repeated})
+            failed.status_code = 500
+            failed.headers['X-SQL-Statements'] = str(counter.total)
+            return failed
+    return response
+
+@app.teardown_request
+def stop_query_counting(exception=None):
+    # Only drop the counter this request started, not an enclosing count_queries()
+    if g.pop('query_counter', None) is not None:
+        _query_counters.active = None
+
+# GET endpoints with side effects the audit must not trigger
+QUERY_AUDIT_SKIP = {'/api/backup'}
+
+def audit_query_counts(user_id=1, repeat_limit=None):
+    """Call every parameterless GET endpoint for a user and count its SQL statements.
+    
+    Returns one result per endpoint; any with `repeated` statements has an N+1 pattern.
+    """
+    repeat_limit = app.config['QUERY_REPEAT_LIMIT'] if repeat_limit is None else repeat_limit
+    client = app.test_client()
+    headers = {'X-User-Id': str(user_id)}
+    if app.config['ADMIN_TOKEN']:
+        headers['X-Admin-Token'] = app.config['ADMIN_TOKEN']
+    results = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+        if ('GET' not in rule.methods or rule.arguments
+                or not rule.rule.startswith('/api/') or rule.rule in QUERY_AUDIT_SKIP):
+            continue
+        with count_queries() as counter:
+            # Search needs a query string; the other endpoints ignore it
+            response = client.get(rule.rule, headers=headers, query_string={'q': 'the'})
+        results.append({
+            "endpoint": rule.rule,
+            "status": response.status_code,
+            "statements": counter.total,
+            "repeated": counter.repeated(repeat_limit)
+        })
+    return results
+
+@app.cli.command('audit-queries')
+@click.option('--user-id', default=1, help='User whose data the endpoints read.')
+@click.option('--repeat-limit', type=int, default=None,
+              help='Times one statement may run per request (default QUERY_REPEAT_LIMIT).')
+def audit_queries_command(user_id, repeat_limit):
+    """Count SQL statements per GET endpoint; exit 1 if any shows an N+1 pattern."""
+    failures = 0
+    for result in audit_query_counts(user_id, repeat_limit):
+        flag = 'N+1' if result['repeated'] else 'ok'
+        click.echo(f"{flag:4} {result['status']} {result['statements']:4d}  {result['endpoint']}")
+        for sql, count in result['repeated'].items():
+            click.echo(f"       {count}x {sql[:120]}")
+        failures += bool(result['repeated'])
+    if failures:
+        raise SystemExit(1)
+
+# ================ Storage Backends ================
+
+# Tables are created with mixed-case names, which PostgreSQL only preserves when quoted
+QUOTED_TABLES = ('TBRlist', 'Books', 'Authors', 'Genres', 'ReadingGoals', 'UserSettings',
+                 'ChangeLog', 'UserDataVersion', 'ShardMap', 'SyncState', 'SchemaInfo')
+
+# Primary keys returned from INSERTs so cursor.lastrowid works like it does on SQLite
+INSERT_RETURNING = {
+    'TBRlist': 'tbr_id',
+    'Books': 'book_id',
+    'Authors': 'author_id',
+    'Genres': 'genre_id',
+    'ReadingGoals': 'goal_id',
+    'UserSettings': 'id',
+    'ChangeLog': 'change_id',
+}
+
+_TABLE_NAME_RE = re.compile(r"(?<![\"'\w])(%s)(?![\"'\w])" % '|'.join(QUOTED_TABLES))
+_INSERT_TABLE_RE = re.compile(r'^\s*INSERT\s+(?:OR\s+IGNORE\s+)?INTO\s+"?(\w+)"?', re.IGNORECASE)
+
+@functools.lru_cache(maxsize=1024)
+def translate_sql_postgres(sql):
+    """Rewrite one of this app's SQLite-flavoured statements for PostgreSQL"""
+    if sql.strip().upper() == 'BEGIN':
+        # SQLite's BEGIN here means "give me one consistent read"
+        return "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"
+    
+    insert = _INSERT_TABLE_RE.match(sql)
+    ignore = re.search(r'\bINSERT\s+OR\s+IGNORE\b', sql, re.IGNORECASE)
+    
+    sql = sql.replace('%', '%%').replace('?', '%s')
+    sql = _TABLE_NAME_RE.sub(r'"\1"', sql)
+    sql = re.sub(r'\bLIKE\b', 'ILIKE', sql)  # SQLite's LIKE is case-insensitive
+    
+    if ignore:
+        sql = re.sub(r'\bINSERT\s+OR\s+IGNORE\b', 'INSERT', sql, flags=re.IGNORECASE)
+        sql = sql.rstrip().rstrip(';') + " ON CONFLICT DO NOTHING"
+    if insert and insert.group(1) in INSERT_RETURNING and 'RETURNING' not in sql.upper():
+        sql = sql.rstrip().rstrip(';') + f" RETURNING {INSERT_RETURNING[insert.group(1)]}"
+    return sql
+
+class PostgresRow(tuple):
+    """Result row readable by position or column name, like sqlite3.Row"""
+    
+    def __new__(cls, values, columns):
+        row = super().__new__(cls, values)
+        row._columns = columns
+        return row
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            key = self._columns[key]
+        return super().__getitem__(key)
+    
+    def keys(self):
+        return list(self._columns)
+
+def _postgres_row_factory(cursor):
+    columns = {column.name: i for i, column in enumerate(cursor.description or ())}
+    return lambda values: PostgresRow(values, columns)
+
+class PostgresCursor:
+    """psycopg cursor that accepts the same SQL and parameters as a sqlite3 cursor"""
+    
+    dialect = 'postgresql'
+    
+    def __init__(self, connection):
+        self.connection = connection
+        self._cursor = connection.raw.cursor(row_factory=_postgres_row_factory)
+        self.lastrowid = None
+    
+    def execute(self, sql, params=()):
+        counter = active_query_counter()
+        if counter is not None:
+            counter.record(sql)
+        translated = translate_sql_postgres(sql)
+        if translated.startswith('SET TRANSACTION') and self.connection.in_transaction:
+            # sqlite3 never has a transaction open for plain reads; end ours the same way
+            self.connection.commit()
+        self._cursor.execute(translated, tuple(params))  # always bind so %% unescapes
+        self.lastrowid = None
+        if self._cursor.description is not None and translated.lstrip()[:6].upper() == 'INSERT':
+            row = self._cursor.fetchone()
+            self.lastrowid = row[0] if row else None
+        return self
+    
+    def executemany(self, sql, seq_of_params):
+        counter = active_query_counter()
+        if counter is not None:
+            counter.record(sql)
+        translated = translate_sql_postgres(sql)
+        self._cursor.executemany(translated, [tuple(params) for params in seq_of_params])
+        return self
+    
+    def copy(self, statement):
+        """COPY ... FROM STDIN for bulk loads"""
+        return self._cursor.copy(statement)
+    
+    def fetchone(self):
+        return self._cursor.fetchone()
+    
+    def fetchall(self):
+        return self._cursor.fetchall()
+    
+    def __iter__(self):
+        return iter(self._cursor)
+    
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+    
+    @property
+    def description(self):
+        return self._cursor.description
+
+class PostgresConnection:
+    """Pooled psycopg connection with the slice of the sqlite3 API the app uses"""
+    
+    dialect = 'postgresql'
+    row_factory = None  # rows always allow access by name; kept for sqlite3 compatibility
+    
+    def __init__(self, raw, pool):
+        self.raw = raw
+        self._pool = pool
+    
+    def cursor(self):
+        return PostgresCursor(self)
+    
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+    
+    @property
+    def in_transaction(self):
+        return self.raw.info.transaction_status != psycopg.pq.TransactionStatus.IDLE
+    
+    def commit(self):
+        self.raw.commit()
+    
+    def rollback(self):
+        self.raw.rollback()
+    
+    def close(self):
+        self._pool.release(self.raw)
+
+def load_psycopg():
+    """Import psycopg on first use so SQLite deployments never pay for it"""
+    global psycopg
+    if psycopg is None:
+        try:
+            import psycopg as module
+        except ImportError:
+            raise RuntimeError("PostgreSQL mode requires the psycopg package")
+        psycopg = module
+    return psycopg
+
+class PostgresPool:
+    """LIFO pool of psycopg connections to the PostgreSQL server"""
+    
+    def __init__(self, url, size):
+        load_psycopg()
+        self.url = url
+        self.size = size
+        self._idle = queue.LifoQueue()
+    
+    def connect(self):
+        while True:
+            try:
+                raw = self._idle.get_nowait()
+            except queue.Empty:
+                raw = psycopg.connect(self.url)
+            if not raw.closed:
+                return PostgresConnection(raw, self)
+    
+    def release(self, raw):
+        if raw.closed:
+            return
+        try:
+            if raw.info.transaction_status != psycopg.pq.TransactionStatus.IDLE:
+                raw.rollback()
+        except psycopg.Error:
+            raw.close()
+            return
+        if self._idle.qsize() < self.size:
+            self._idle.put(raw)
+        else:
+            raw.close()
+
+def database_errors():
+    """Exception types SQL errors from connect_db() handles can raise"""
+    return (sqlite3.Error,) if psycopg is None else (sqlite3.Error, psycopg.Error)
+
+def get_dialect(conn_or_cursor):
+    """'postgresql' or 'sqlite' for a connection or cursor from connect_db()"""
+    return getattr(conn_or_cursor, 'dialect', 'sqlite')
+
+# ================ Storage Routing (Shards) ================
+
+class PooledConnection:
+    """sqlite3 connection handle whose close() hands it back to the router's pool"""
+    
+    def __init__(self, conn, path, router):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_path', path)
+        object.__setattr__(self, '_router', router)
+    
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+    
+    def cursor(self):
+        counter = active_query_counter()
+        cursor = self._conn.cursor()
+        return cursor if counter is None else CountingCursor(cursor, counter)
+    
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+    
+    def close(self):
+        self._router.release(self._path, self._conn)
+
+class ShardRouter:
+    """Maps each user to the SQLite file holding their data.
+    
+    Unsharded (no SHARD_DIR), every user lives in the main database. Sharded, a user
+    lives in the shard named in the main database's ShardMap, or by default in
+    shard_<user_id % SHARD_COUNT>. Idle connections and ORM engines are kept in LRUs
+    so hot shards stay open and cold ones get closed. With a DATABASE_URL everyone
+    lives on the PostgreSQL server and connections come from its pool instead.
+    
+    Assignments are cached per process; every ShardMap change replaces a version file
+    in SHARD_DIR, and a process drops its cache when that file's identity changes.
+    """
+    
+    MAIN = 'main'
+    MAP_VERSION_FILE = 'ShardMap.version'
+    
+    def __init__(self, config):
+        self.config = config
+        self._idle = OrderedDict()      # path -> idle sqlite3 connections, LRU order
+        self._idle_count = 0
+        self._engines = OrderedDict()   # path -> (engine, scoped session registry)
+        self._initialized = set()       # paths whose schema has been checked
+        self._assignments = {}          # user_id -> shard name (cache of ShardMap)
+        self._assignments_version = None
+        self._postgres_pool = None
+        self._lock = threading.RLock()
+    
+    @property
+    def postgres(self):
+        return bool(self.config.get('DATABASE_URL'))
+    
+    @property
+    def sharded(self):
+        # A server database outgrows a single file on its own; shards are SQLite-only
+        return bool(self.config.get('SHARD_DIR')) and not self.postgres
+    
+    def main_path(self):
+        if self.postgres:
+            return self.config['DATABASE_URL']
+        return self.config['DATABASE_PATH']
+    
+    def shard_path(self, shard):
+        if shard == self.MAIN:
+            return self.main_path()
+        return os.path.join(self.config['SHARD_DIR'], f"{shard}.db")
+    
+    def default_shard(self, user_id):
+        return f"shard_{user_id % self.config['SHARD_COUNT']:03d}"
+    
+    def assigned_shard(self, user_id):
+        """The user's explicit ShardMap entry, or None"""
+        conn = self.connect_path(self.main_path())
+        try:
+            row = conn.execute(
+                "SELECT shard FROM ShardMap WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row else None
+    
+    def _map_version(self):
+        """Identity of the ShardMap version file (a stat, no query), or None"""
+        try:
+            stat = os.stat(os.path.join(self.config['SHARD_DIR'], self.MAP_VERSION_FILE))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+    
+    def _bump_map_version(self):
+        """Tell every process that ShardMap changed"""
+        os.makedirs(self.config['SHARD_DIR'], exist_ok=True)
+        path = os.path.join(self.config['SHARD_DIR'], self.MAP_VERSION_FILE)
+        temp = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp, 'w') as f:
+            f.write(str(time.time_ns()))
+        # A new file (new inode) even when the clock hasn't ticked
+        os.replace(temp, path)
+    
+    def shard_for(self, user_id):
+        """Name of the shard holding a user's data"""
+        if not self.sharded:
+            return self.MAIN
+        version = self._map_version()
+        if version != self._assignments_version:
+            with self._lock:
+                if version != self._assignments_version:
+                    self._assignments = {}
+                    self._assignments_version = version
+        shard = self._assignments.get(user_id)
+        if shard is None:
+            shard = self.assigned_shard(user_id) or self.default_shard(user_id)
+            self._assignments[user_id] = shard
+        return shard
+    
+    def path_for(self, user_id):
+        return self.shard_path(self.shard_for(user_id))
+    
+    def assign(self, user_id, shard):
+        """Point a user at a shard in ShardMap"""
+        conn = self.connect_path(self.main_path())
+        try:
+            conn.execute("INSERT OR REPLACE INTO ShardMap (user_id, shard) VALUES (?, ?)",
+                         (user_id, shard))
+            conn.commit()
+        finally:
+            conn.close()
+        self._bump_map_version()
+        self._assignments[user_id] = shard
+    
+    def database_label(self, path):
+        """Display name for a database file or server URL (never includes credentials)"""
+        if self.postgres and path == self.main_path():
+            return urllib.parse.urlsplit(path).path.lstrip('/')
+        return os.path.basename(path)
+    
+    def database_paths(self):
+        """Main database plus every shard file that exists"""
+        paths = [self.main_path()]
+        if self.sharded and os.path.isdir(self.config['SHARD_DIR']):
+            paths += sorted(os.path.join(self.config['SHARD_DIR'], name)
+                            for name in os.listdir(self.config['SHARD_DIR'])
+                            if name.endswith('.db'))
+        return paths
+    
+    def ensure_schema(self, path):
+        """Initialize a database the first time this process touches it"""
+        if path in self._initialized:
+            return
+        with self._lock:
+            if path in self._initialized:
+                return
+            # Mark first: schema setup itself opens connections to this path
+            self._initialized.add(path)
+            try:
+                if path == self.main_path():
+                    initialize_main_database()
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    initialize_schema(path)
+            except Exception:
+                self._initialized.discard(path)
+                raise
+    
+    def connect_path(self, path):
+        """Check out a connection to a database file; close() returns it to the pool"""
+        self.ensure_schema(path)
+        if self.postgres:
+            with self._lock:
+                if self._postgres_pool is None:
+                    self._postgres_pool = PostgresPool(self.config['DATABASE_URL'],
+                                                       self.config['DATABASE_POOL_SIZE'])
+            return self._postgres_pool.connect()
+        with self._lock:
+            idle = self._idle.get(path)
+            conn = idle.pop() if idle else None
+            if conn is not None:
+                self._idle_count -= 1
+                if not idle:
+                    del self._idle[path]
+        if conn is None:
+            # Handles are only ever used by one checkout at a time
+            conn = sqlite3.connect(path, check_same_thread=False)
+        return PooledConnection(conn, path, self)
+    
+    def connect(self, user_id):
+        return self.connect_path(self.path_for(user_id))
+    
+    def release(self, path, conn):
+        # Leave the handle as a fresh connect() would
+        if conn.in_transaction:
+            conn.rollback()
+        conn.row_factory = None
+        with self._lock:
+            self._idle.setdefault(path, []).append(conn)
+            self._idle.move_to_end(path)
+            self._idle_count += 1
+            while self._idle_count > self.config['SHARD_CONNECTIONS']:
+                evicted_path, conns = next(iter(self._idle.items()))
+                conns.pop(0).close()
+                self._idle_count -= 1
+                if not conns:
+                    del self._idle[evicted_path]
+    
+    def _engine(self, path):
+        load_orm()
+        with self._lock:
+            entry = self._engines.get(path)
+            if entry is None:
+                if path == self.main_path():
+                    engine = orm.create_engine(self.config['SQLALCHEMY_DATABASE_URI'],
+                                               **self.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+                else:
+                    engine = orm.create_engine(f"sqlite:///{path}")
+                entry = (engine, orm.scoped_session(orm.sessionmaker(bind=engine)))
+                self._engines[path] = entry
+            self._engines.move_to_end(path)
+            while len(self._engines) > self.config['SHARD_CONNECTIONS']:
+                _, (old_engine, old_sessions) = self._engines.popitem(last=False)
+                old_sessions.remove()
+                old_engine.dispose()
+            return entry
+    
+    def engine_for(self, user_id):
+        path = self.path_for(user_id)
+        self.ensure_schema(path)
+        return self._engine(path)[0]
+    
+    def engine_for_path(self, path):
+        """SQLAlchemy engine for a database file (or the PostgreSQL server)"""
+        return self._engine(path)[0]
+    
+    def session_for(self, user_id):
+        path = self.path_for(user_id)
+        self.ensure_schema(path)
+        return self._engine(path)[1]()
+    
+    def remove_sessions(self):
+        with self._lock:
+            registries = [sessions for _, sessions in self._engines.values()]
+        for sessions in registries:
+            sessions.remove()
+    
+    def forget(self, user_id):
+        self._assignments.pop(user_id, None)
+
+shard_router = ShardRouter(app.config)
+
+def connect_db(user_id=1):
+    """Connection to the database holding a user's data"""
+    return shard_router.connect(user_id)
+
+def connect_path(path):
+    """Connection to a specific database file (main database or a shard)"""
+    return shard_router.connect_path(path)
+
+def get_session(user_id=1):
+    """ORM session for the database holding a user's data"""
+    return shard_router.session_for(user_id)
+
+@app.teardown_appcontext
+def remove_shard_sessions(exception=None):
+    shard_router.remove_sessions()
 
 # ================ ORM Data Access Functions ================
 
+@functools.lru_cache(maxsize=None)
+def tbr_item_loading():
+    """Loading strategies for TBR entries: every many-to-one hop comes back in the same
+    JOINed SELECT, and anything not listed raises rather than querying per row"""
+    # Backref attributes (TBRList.book, ...) only exist once mappers are configured,
+    # which is deferred to first use to keep it off the import path
+    orm.configure_mappers()
+    return (
+        orm.joinedload(orm.TBRList.book, innerjoin=True)
+        .joinedload(orm.Book.author, innerjoin=True),
+        orm.joinedload(orm.TBRList.book, innerjoin=True)
+        .joinedload(orm.Book.genre_rel, innerjoin=True),
+        orm.joinedload(orm.TBRList.status, innerjoin=True),
+        orm.raiseload('*'),
+    )
+
+def serialize_tbr_item(item):
+    """TBR entry loaded with tbr_item_loading(), shaped like a TBR_SELECT_SQL row"""
+    book = item.book
+    return {
+        "tbr_id": item.tbr_id,
+        "book_id": book.book_id,
+        "title": book.title,
+        "author": book.author.name,
+        "genre": book.genre_rel.genre,
+        "category": book.genre_rel.category,
+        "status": item.status.status,
+        "priority": item.priority,
+        "date_added": item.date_added,
+        "date_completed": item.date_completed,
+        "page_count": book.page_count,
+        "publication_year": book.publication_year,
+        "rating": book.rating,
+        "isbn": book.isbn
+    }
+
 def add_book_orm(title, author_name, genre_name, category=None, page_count=None, 
-              publication_year=None, priority=5, status_id=3):
+              publication_year=None, priority=5, status_id=3, user_id=1, isbn=None):
     """Add a book using SQLAlchemy ORM"""
     print(f"Adding book via ORM: {title} by {author_name}, genre: {genre_name}")
+    session = get_session(user_id)
     
     try:
         # Get or create author
-        author = Author.query.filter_by(name=author_name).first()
-        if not author:
-            author = Author(name=author_name)
-            db.session.add(author)
-            db.session.flush()  # Get the ID without committing
-        
-        # Get or create genre
-        genre = Genre.query.filter_by(genre=genre_name).first()
-        if genre:
-            if category:
-                genre.category = category
-        else:
-            genre = Genre(genre=genre_name, category=category)
-            db.session.add(genre)
-            db.session.flush()
+        author_id = session.scalar(
+            orm.select(orm.Author.author_id).filter_by(name=author_name).limit(1))
+        if author_id is None:
+            author_id = session.execute(
+                orm.insert(orm.Author).values(name=author_name)).inserted_primary_key[0]
+        
+        # Get or create genre; genres are shared, so a new category gets its own row
+        genre_query = orm.select(orm.func.min(orm.Genre.genre_id)).filter_by(genre=genre_name)
+        if category:
+            genre_query = genre_query.filter_by(category=category)
+        genre_id = session.scalar(genre_query)
+        if genre_id is None:
+            genre_id = session.execute(
+                orm.insert(orm.Genre).values(genre=genre_name, category=category)
+            ).inserted_primary_key[0]
         
-        # Create new book
-        book = Book(
+        # Create the book and its TBR entry with plain INSERTs (no unit-of-work flush)
+        book_id = session.execute(orm.insert(orm.Book).values(
             title=title,
-            author_id=author.author_id,
-            genre_id=genre.genre_id if genre else None,
+            author_id=author_id,
+            genre_id=genre_id,
             page_count=page_count,
-            publication_year=publication_year
-        )
-        db.session.add(book)
-        db.session.flush()
+            publication_year=publication_year,
+            isbn=normalize_isbn(isbn),
+            user_id=user_id
+        )).inserted_primary_key[0]
         
-        # Add to TBR list
         today = datetime.datetime.now().strftime("%Y-%m-%d")
-        tbr_item = TBRList(
-            book_id=book.book_id,
+        session.execute(orm.insert(orm.TBRList).values(
+            user_id=user_id,
+            book_id=book_id,
             status_id=status_id,
             priority=priority,
             date_added=today
-        )
-        db.session.add(tbr_item)
+        ))
         
-        db.session.commit()
-        return book.book_id
+        session.commit()
+        return book_id
         
-    except SQLAlchemyError as e:
-        db.session.rollback()
+    except orm.SQLAlchemyError as e:
+        session.rollback()
         print(f"Error adding book via ORM: {str(e)}")
         raise e
 
-def get_authors_orm():
-    """Get all authors using ORM"""
-    authors = Author.query.order_by(Author.name).all()
-    return [{"author_id": a.author_id, "name": a.name} for a in authors]
+def get_tbr_items_orm(user_id=1, status_id=None):
+    """Get a user's TBR entries with book, author, genre and status in one query"""
+    session = get_session(user_id)
+    query = (session.query(orm.TBRList)
+             .options(*tbr_item_loading())
+             .filter(orm.TBRList.user_id == user_id))
+    if status_id is not None:
+        query = query.filter(orm.TBRList.status_id == status_id)
+    items = query.order_by(orm.TBRList.priority.desc(), orm.TBRList.date_added.desc()).all()
+    return [serialize_tbr_item(item) for item in items]
+
+def iter_tbr_items_orm(user_id=1, batch_size=500):
+    """Stream a user's TBR entries grouped by status, batch_size rows per fetch"""
+    session = get_session(user_id)
+    query = (session.query(orm.TBRList)
+             .options(*tbr_item_loading())
+             .filter(orm.TBRList.user_id == user_id)
+             .order_by(orm.TBRList.status_id, orm.TBRList.priority.desc(),
+                       orm.TBRList.date_added.desc())
+             .yield_per(batch_size))
+    for item in query:
+        yield serialize_tbr_item(item)
 
-def get_genres_orm():
-    """Get all genres using ORM"""
-    genres = Genre.query.order_by(Genre.genre).all()
+def get_status_counts_orm(user_id=1):
+    """(status, entry count) pairs for a user's TBR list, in status order"""
+    session = get_session(user_id)
+    return session.execute(
+        orm.select(orm.ReadingStatus.status, orm.func.count())
+        .join(orm.TBRList, orm.TBRList.status_id == orm.ReadingStatus.status_id)
+        .where(orm.TBRList.user_id == user_id)
+        .group_by(orm.ReadingStatus.status_id, orm.ReadingStatus.status)
+        .order_by(orm.ReadingStatus.status_id)).all()
+
+def clear_tbr_core(user_id=1):
+    """Delete a user's TBR list and books, plus authors and genres nothing uses anymore"""
+    with shard_router.engine_for(user_id).connect() as connection:
+        connection.execute(orm.delete(orm.TBRList).where(orm.TBRList.user_id == user_id))
+        connection.execute(orm.update(orm.ReadingGoal)
+                           .where(orm.ReadingGoal.target_book_id.in_(
+                               orm.select(orm.Book.book_id).where(orm.Book.user_id == user_id)))
+                           .values(target_book_id=None))
+        connection.execute(orm.delete(orm.Book).where(orm.Book.user_id == user_id))
+        # Authors and genres are shared, so only drop the ones nothing uses anymore
+        connection.execute(orm.delete(orm.Author).where(
+            orm.Author.author_id.not_in(orm.select(orm.Book.author_id))))
+        connection.execute(orm.delete(orm.Genre).where(
+            orm.Genre.genre_id.not_in(orm.select(orm.Book.genre_id)),
+            orm.Genre.genre_id.not_in(orm.select(orm.ReadingGoal.target_genre_id)
+                                      .where(orm.ReadingGoal.target_genre_id.is_not(None)))))
+        connection.commit()
+    # Cleared history must not come back through stats or export
+    reading_archive.clear_user(user_id)
+
+def get_authors_orm(user_id=1, include_books=False):
+    """Get all authors of a user's books using ORM, optionally with those books"""
+    session = get_session(user_id)
+    query = (session.query(orm.Author)
+             .join(orm.Book, orm.Book.author_id == orm.Author.author_id)
+             .filter(orm.Book.user_id == user_id)
+             .distinct()
+             .order_by(orm.Author.name))
+    if include_books:
+        # One extra SELECT ... WHERE author_id IN (...) for all authors' books together
+        query = query.options(orm.selectinload(orm.Author.books.and_(orm.Book.user_id == user_id)))
+    authors = query.all()
+    if not include_books:
+        return [{"author_id": a.author_id, "name": a.name} for a in authors]
+    return [{"author_id": a.author_id, "name": a.name,
+             "books": [{"book_id": b.book_id, "title": b.title}
+                       for b in sorted(a.books, key=lambda b: b.title)]}
+            for a in authors]
+
+def get_genres_orm(user_id=1):
+    """Get all genres of a user's books using ORM"""
+    session = get_session(user_id)
+    genres = (session.query(orm.Genre)
+              .join(orm.Book, orm.Book.genre_id == orm.Genre.genre_id)
+              .filter(orm.Book.user_id == user_id)
+              .distinct()
+              .order_by(orm.Genre.genre)
+              .all())
     return [{"genre_id": g.genre_id, "genre": g.genre} for g in genres]
 
-def get_statuses_orm():
+def get_statuses_orm(user_id=1):
     """Get all reading statuses using ORM"""
-    statuses = ReadingStatus.query.all()
+    session = get_session(user_id)
+    statuses = session.query(orm.ReadingStatus).all()
     return [{"status_id": s.status_id, "status": s.status} for s in statuses]
 
-def update_status_orm(tbr_id, status_id):
-    """Update book reading status using ORM"""
+def update_status_orm(tbr_id, status_id, user_id=1):
+    """Update book reading status using a single ORM UPDATE"""
+    session = get_session(user_id)
     try:
-        tbr_item = TBRList.query.get(tbr_id)
-        if not tbr_item:
-            raise Exception(f"No TBR item found with id {tbr_id}")
-        
-        tbr_item.status_id = status_id
-        
         # If status is "Completed", add completion date
         if status_id == 1:  # Assuming 1 is "Completed"
-            tbr_item.date_completed = datetime.datetime.now().strftime("%Y-%m-%d")
+            date_completed = datetime.datetime.now().strftime("%Y-%m-%d")
         else:
-            tbr_item.date_completed = None
+            date_completed = None
+        
+        result = session.execute(
+            orm.update(orm.TBRList)
+            .where(orm.TBRList.tbr_id == tbr_id, orm.TBRList.user_id == user_id)
+            .values(status_id=status_id, date_completed=date_completed)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            session.rollback()
+            raise Exception(f"No TBR item found with id {tbr_id}")
             
-        db.session.commit()
+        session.commit()
         return True
         
-    except SQLAlchemyError as e:
-        db.session.rollback()
+    except orm.SQLAlchemyError as e:
+        session.rollback()
         print(f"Error updating status via ORM: {str(e)}")
         raise e
 
-def update_rating_orm(tbr_id, rating):
-    """Update book rating using ORM"""
+def update_rating_orm(tbr_id, rating, user_id=1):
+    """Update book rating using a single ORM UPDATE"""
+    session = get_session(user_id)
     try:
-        tbr_item = TBRList.query.get(tbr_id)
-        if not tbr_item:
+        # The book is found through the TBR entry in a subquery, not a separate lookup
+        book_id = (orm.select(orm.TBRList.book_id)
+                   .where(orm.TBRList.tbr_id == tbr_id, orm.TBRList.user_id == user_id)
+                   .scalar_subquery())
+        result = session.execute(
+            orm.update(orm.Book)
+            .where(orm.Book.book_id == book_id, orm.Book.user_id == user_id)
+            .values(rating=rating)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 0:
+            session.rollback()
             raise Exception(f"No TBR item found with id {tbr_id}")
             
-        book = Book.query.get(tbr_item.book_id)
-        if not book:
-            raise Exception(f"No book found with id {tbr_item.book_id}")
-            
-        book.rating = rating
-        db.session.commit()
+        session.commit()
         return True
         
-    except SQLAlchemyError as e:
-        db.session.rollback()
+    except orm.SQLAlchemyError as e:
+        session.rollback()
         print(f"Error updating rating via ORM: {str(e)}")
         raise e
 
-def get_user_settings_orm():
+def upsert_user_settings(session, user_id, values=None):
+    """INSERT a user's settings row, or on conflict apply `values` (if any) to the existing one.
+    
+    idx_settings_user is unique, so concurrent first requests can't create two rows.
+    """
+    dialect = session.get_bind().dialect.name
+    insert = orm.postgresql_insert if dialect == 'postgresql' else orm.sqlite_insert
+    statement = insert(orm.UserSettings).values(user_id=user_id, **(values or {}))
+    if values:
+        statement = statement.on_conflict_do_update(index_elements=['user_id'], set_=values)
+    else:
+        statement = statement.on_conflict_do_nothing(index_elements=['user_id'])
+    session.execute(statement)
+
+def get_user_settings_orm(user_id=1):
     """Get user settings using ORM"""
-    settings = UserSettings.query.first()
+    session = get_session(user_id)
+    settings = session.query(orm.UserSettings).filter_by(user_id=user_id).first()
     if not settings:
-        # Create default settings
-        settings = UserSettings()
-        db.session.add(settings)
-        db.session.commit()
+        # Create default settings (a concurrent request may already have)
+        upsert_user_settings(session, user_id)
+        session.commit()
+        settings = session.query(orm.UserSettings).filter_by(user_id=user_id).one()
     
     # Convert SQLite integers to Python booleans for JSON response
     return {
@@ -215,82 +1046,225 @@ def get_user_settings_orm():
         "auto_backup": bool(settings.auto_backup)
     }
 
-def update_user_settings_orm(settings_data):
-    """Update user settings using ORM"""
+def update_user_settings_orm(settings_data, user_id=1):
+    """Update user settings using a single upsert (INSERT for a new user)"""
+    session = get_session(user_id)
     try:
-        settings = UserSettings.query.first()
-        if not settings:
-            settings = UserSettings()
-            db.session.add(settings)
-        
-        # Update settings from dictionary
+        # Collect changed columns from dictionary
+        values = {}
         if 'theme' in settings_data:
-            settings.theme = settings_data['theme']
+            values['theme'] = settings_data['theme']
         # Check for both cardLayout (frontend) and card_layout (backend) keys
         if 'cardLayout' in settings_data:
-            settings.card_layout = settings_data['cardLayout']
+            values['card_layout'] = settings_data['cardLayout']
         elif 'card_layout' in settings_data:
-            settings.card_layout = settings_data['card_layout']
+            values['card_layout'] = settings_data['card_layout']
         if 'show_priority' in settings_data:
-            settings.show_priority = 1 if settings_data['show_priority'] else 0
+            values['show_priority'] = 1 if settings_data['show_priority'] else 0
         if 'default_sort' in settings_data:
-            settings.default_sort = settings_data['default_sort']
+            values['default_sort'] = settings_data['default_sort']
         if 'notifications' in settings_data:
-            settings.notifications = 1 if settings_data['notifications'] else 0
+            values['notifications'] = 1 if settings_data['notifications'] else 0
         if 'auto_backup' in settings_data:
-            settings.auto_backup = 1 if settings_data['auto_backup'] else 0
-            
-        db.session.commit()
+            values['auto_backup'] = 1 if settings_data['auto_backup'] else 0
+        
+        upsert_user_settings(session, user_id, values)
+        session.commit()
         return True
         
-    except SQLAlchemyError as e:
-        db.session.rollback()
+    except orm.SQLAlchemyError as e:
+        session.rollback()
         print(f"Error updating settings via ORM: {str(e)}")
         raise e
 
 # ================ PREPARED STATEMENTS Functions ================
 
-def get_tbr_list_prepared():
+# Shared SELECTs so the full list and the delta endpoint return identically shaped rows
+TBR_SELECT_SQL = """
+    SELECT t.tbr_id, b.book_id, b.title, a.name as author, g.genre as genre, 
+    g.category as category, rs.status, t.priority, t.date_added, t.date_completed,
+    b.page_count, b.publication_year, b.rating, b.isbn
+    FROM TBRlist t
+    JOIN Books b ON t.book_id = b.book_id
+    JOIN Authors a ON b.author_id = a.author_id
+    JOIN Genres g ON b.genre_id = g.genre_id
+    JOIN "Reading Status" rs ON t.status_id = rs.status_id
+"""
+
+# Whole-day date arithmetic per backend, used to compute goal metrics in the query
+GOAL_DATE_SQL = {
+    'sqlite': {
+        'days': "CAST(julianday({to}) - julianday({since}) AS INTEGER)",
+        'add_days': "date(julianday({date}) + {days})",
+    },
+    'postgresql': {
+        'days': "(CAST({to} AS date) - CAST({since} AS date))",
+        'add_days': "CAST(CAST({date} AS date) + CAST({days} AS integer) AS text)",
+    },
+}
+
+@functools.lru_cache(maxsize=None)
+def goal_select_sql(dialect='sqlite'):
+    """Goal SELECT with the dashboard metrics computed by the database.
+    
+    The first bound parameter is today's date (YYYY-MM-DD). Besides days_remaining
+    and percentage, each row gets a pace projection: on_track (progress at least
+    proportional to the time elapsed, NULL without a numeric target) and
+    projected_finish_date (when the target is reached at the current pace).
+    """
+    dates = GOAL_DATE_SQL[dialect]
+    remaining = dates['days'].format(since='d.today', to='g.end_date')
+    elapsed = dates['days'].format(since='g.start_date', to='d.today')
+    total = dates['days'].format(since='g.start_date', to='g.end_date')
+    progress = "COALESCE(g.progress, 0)"
+    finish = dates['add_days'].format(
+        date='g.start_date', days=f"({elapsed}) * g.target_value / {progress}")
+    return f"""
+    SELECT 
+        g.goal_id, g.goal_type, g.target_value, g.target_book_id, 
+        g.target_genre_id, g.start_date, g.end_date,
+        g.completed, g.progress,
+        b.title as book_title, a.name as author_name,
+        ge.genre as genre_name,
+        COALESCE({remaining}, 0) as days_remaining,
+        CASE
+            WHEN g.target_value > 0 THEN
+                CASE WHEN {progress} * 100 / g.target_value > 100 THEN 100
+                     ELSE {progress} * 100 / g.target_value END
+            WHEN g.completed = 0 THEN 0
+            ELSE 100
+        END as percentage,
+        CASE
+            WHEN g.completed = 1 OR (g.target_value > 0 AND {progress} >= g.target_value) THEN 1
+            WHEN g.target_value > 0 AND {total} > 0 THEN
+                CASE WHEN {progress} * {total} >= g.target_value * {elapsed} THEN 1 ELSE 0 END
+        END as on_track,
+        CASE
+            WHEN g.target_value > 0 AND {progress} > 0 AND {progress} < g.target_value
+                 AND {elapsed} > 0
+            THEN {finish}
+        END as projected_finish_date
+    FROM ReadingGoals g
+    LEFT JOIN Books b ON g.target_book_id = b.book_id AND b.user_id = g.user_id
+    LEFT JOIN Authors a ON b.author_id = a.author_id
+    LEFT JOIN Genres ge ON g.target_genre_id = ge.genre_id
+    CROSS JOIN (SELECT ? as today) d
+    """
+
+def select_goals(cursor, where, params=(), today=None):
+    """Run the goal SELECT (metrics included) with a WHERE/ORDER BY tail"""
+    today = today or datetime.date.today().isoformat()
+    cursor.execute(goal_select_sql(get_dialect(cursor)) + where, (today, *params))
+    return cursor
+
+GOAL_STATUSES = ('all', 'active', 'expired')
+
+def goal_page_query(user_id, status='all', after=None, limit=None, today=None):
+    """WHERE/ORDER BY tail and parameters for one page of a user's goals.
+    
+    Goals are ordered by (end_date, goal_id), which idx_goals_user_end_date_goal covers,
+    and `after` is the "end_date:goal_id" keyset cursor of the previous page's last goal.
+    """
+    status = status or 'all'
+    if status not in GOAL_STATUSES:
+        raise ValueError(f"Unknown goal status {status!r} (expected one of {', '.join(GOAL_STATUSES)})")
+    today = today or datetime.date.today().isoformat()
+    
+    where = " WHERE g.user_id = ?"
+    params = [user_id]
+    # ISO dates compare correctly as strings, so these stay index range scans
+    if status == 'active':
+        where += " AND g.end_date >= ?"
+        params.append(today)
+    elif status == 'expired':
+        where += " AND g.end_date < ?"
+        params.append(today)
+    if after:
+        after_end_date, after_goal_id = after.rsplit(':', 1)
+        where += " AND (g.end_date > ? OR (g.end_date = ? AND g.goal_id > ?))"
+        params += [after_end_date, after_end_date, int(after_goal_id)]
+    where += " ORDER BY g.end_date ASC, g.goal_id ASC"
+    if limit is not None:
+        where += " LIMIT ?"
+        params.append(int(limit))
+    return where, params
+
+def parse_goal_page_args(args):
+    """(status, after, limit) from /api/goals query args; ValueError names a bad one"""
+    status = args.get('status') or 'all'
+    if status not in GOAL_STATUSES:
+        raise ValueError(f"Unknown goal status {status!r} (expected one of {', '.join(GOAL_STATUSES)})")
+    after = args.get('after') or None
+    if after is not None:
+        end_date, _, goal_id = after.rpartition(':')
+        if not end_date or not goal_id.isdigit():
+            raise ValueError(f"Invalid cursor {after!r} (expected end_date:goal_id)")
+    limit = args.get('limit')
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            raise ValueError(f"Invalid limit {limit!r} (expected a positive integer)")
+        limit = int(limit)
+    return status, after, limit
+
+def goal_page_cursor(last_goal, count, limit):
+    """Keyset cursor for the page after one ending in last_goal, or None on the last page"""
+    if limit is None or last_goal is None or count < int(limit):
+        return None
+    return f"{last_goal['end_date']}:{last_goal['goal_id']}"
+
+def get_or_create_genre_id(cursor, genre_name, category=None):
+    """Genre row for a name and category; shared rows are never edited in place"""
+    if category:
+        cursor.execute("SELECT MIN(genre_id) FROM Genres WHERE genre = ? AND category = ?",
+                       (genre_name, category))
+    else:
+        cursor.execute("SELECT MIN(genre_id) FROM Genres WHERE genre = ?", (genre_name,))
+    row = cursor.fetchone()
+    if row and row[0] is not None:
+        return row[0]
+    cursor.execute("INSERT INTO Genres (genre, category) VALUES (?, ?)", (genre_name, category))
+    return cursor.lastrowid
+
+def get_tbr_list_prepared(user_id=1):
     """Get TBR list using prepared statements"""
-    conn = sqlite3.connect('tbrlist.db')
+    conn = connect_db(user_id)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
     # SQL with parameters (prepared statement)
-    sql = """
-        SELECT t.tbr_id, b.book_id, b.title, a.name as author, g.genre as genre, 
-        g.category as category, rs.status, t.priority, t.date_added, t.date_completed,
-        b.page_count, b.publication_year, b.rating
-        FROM TBRlist t
-        JOIN Books b ON t.book_id = b.book_id
-        JOIN Authors a ON b.author_id = a.author_id
-        JOIN Genres g ON b.genre_id = g.genre_id
-        JOIN [Reading Status] rs ON t.status_id = rs.status_id
-        ORDER BY t.priority DESC, t.date_added DESC
-    """
+    sql = TBR_SELECT_SQL + " WHERE t.user_id = ? ORDER BY t.priority DESC, t.date_added DESC"
     
-    cursor.execute(sql)
+    cursor.execute(sql, (user_id,))
     books = [dict(row) for row in cursor.fetchall()]
     conn.close()
     return books
 
-def delete_book_prepared(book_id):
+# Authors and genres are shared, so only drop the ones nothing references anymore
+ORPHAN_AUTHORS_DELETE_SQL = "DELETE FROM Authors WHERE author_id NOT IN (SELECT author_id FROM Books)"
+ORPHAN_GENRES_DELETE_SQL = """
+    DELETE FROM Genres
+    WHERE genre_id NOT IN (SELECT genre_id FROM Books)
+    AND genre_id NOT IN (SELECT target_genre_id FROM ReadingGoals WHERE target_genre_id IS NOT NULL)
+"""
+
+def delete_book_prepared(book_id, user_id=1):
     """Delete a book using prepared statements"""
-    conn = sqlite3.connect('tbrlist.db')
+    conn = connect_db(user_id)
     cursor = conn.cursor()
     
     try:
-        # Delete from TBRlist first (foreign key constraints)
-        cursor.execute("DELETE FROM TBRlist WHERE book_id = ?", (book_id,))
+        # Delete from TBRlist first and unlink every goal on the book (foreign key constraints)
+        cursor.execute("DELETE FROM TBRlist WHERE book_id = ? AND user_id = ?", (book_id, user_id))
+        cursor.execute("UPDATE ReadingGoals SET target_book_id = NULL WHERE target_book_id IN "
+                       "(SELECT book_id FROM Books WHERE book_id = ? AND user_id = ?)",
+                       (book_id, user_id))
         
         # Delete the book
-        cursor.execute("DELETE FROM Books WHERE book_id = ?", (book_id,))
+        cursor.execute("DELETE FROM Books WHERE book_id = ? AND user_id = ?", (book_id, user_id))
         
-        # Cleanup orphaned authors
-        cursor.execute("DELETE FROM Authors WHERE author_id NOT IN (SELECT author_id FROM Books)")
-        
-        # Cleanup orphaned genres
-        cursor.execute("DELETE FROM Genres WHERE genre_id NOT IN (SELECT genre_id FROM Books)")
+        # Cleanup orphaned authors and genres
+        cursor.execute(ORPHAN_AUTHORS_DELETE_SQL)
+        cursor.execute(ORPHAN_GENRES_DELETE_SQL)
         
         conn.commit()
         return True
@@ -302,9 +1276,9 @@ def delete_book_prepared(book_id):
         conn.close()
 
 def update_book_prepared(book_id, title, author_name, genre_name, category=None, 
-                         page_count=None, publication_year=None, priority=None):
+                         page_count=None, publication_year=None, priority=None, user_id=1):
     """Update a book using prepared statements"""
-    conn = sqlite3.connect('tbrlist.db')
+    conn = connect_db(user_id)
     cursor = conn.cursor()
     
     try:
@@ -318,33 +1292,22 @@ def update_book_prepared(book_id, title, author_name, genre_name, category=None,
             author_id = cursor.lastrowid
         
         # Next, ensure the genre exists or add a new one
-        cursor.execute("SELECT genre_id FROM Genres WHERE genre = ?", (genre_name,))
-        genre_row = cursor.fetchone()
-        if genre_row:
-            genre_id = genre_row[0]
-            # Update category if provided
-            if category:
-                cursor.execute("UPDATE Genres SET category = ? WHERE genre_id = ?", 
-                              (category, genre_id))
-        else:
-            cursor.execute("INSERT INTO Genres (genre, category) VALUES (?, ?)", 
-                          (genre_name, category))
-            genre_id = cursor.lastrowid
+        genre_id = get_or_create_genre_id(cursor, genre_name, category)
         
         # Update the book data
         cursor.execute("""
         UPDATE Books    
         SET title = ?, author_id = ?, genre_id = ?, page_count = ?, publication_year = ?
-        WHERE book_id = ?
-        """, (title, author_id, genre_id, page_count, publication_year, book_id))
+        WHERE book_id = ? AND user_id = ?
+        """, (title, author_id, genre_id, page_count, publication_year, book_id, user_id))
         
         # Update the priority in the TBR list if provided
         if priority is not None:
             cursor.execute("""
             UPDATE TBRlist 
             SET priority = ? 
-            WHERE book_id = ?
-            """, (priority, book_id))
+            WHERE book_id = ? AND user_id = ?
+            """, (priority, book_id, user_id))
         
         conn.commit()
         return True
@@ -356,9 +1319,9 @@ def update_book_prepared(book_id, title, author_name, genre_name, category=None,
         conn.close()
 
 def create_reading_goal_prepared(goal_type, target_value=None, target_book_id=None, 
-                                target_genre_id=None, start_date=None, end_date=None):
+                                target_genre_id=None, start_date=None, end_date=None, user_id=1):
     """Create a reading goal using prepared statements"""
-    conn = sqlite3.connect('tbrlist.db')
+    conn = connect_db(user_id)
     cursor = conn.cursor()
     
     try:
@@ -370,12 +1333,19 @@ def create_reading_goal_prepared(goal_type, target_value=None, target_book_id=No
         if not end_date:
             end_date = datetime.datetime(datetime.datetime.now().year, 12, 31).strftime("%Y-%m-%d")
         
+        # A goal may only target one of the user's own books
+        if target_book_id is not None:
+            cursor.execute("SELECT 1 FROM Books WHERE book_id = ? AND user_id = ?",
+                           (target_book_id, user_id))
+            if cursor.fetchone() is None:
+                raise ValueError(f"Book {target_book_id} not found")
+        
         cursor.execute("""
         INSERT INTO ReadingGoals (
-            goal_type, target_value, target_book_id, target_genre_id,
-            start_date, end_date, progress
-        ) VALUES (?, ?, ?, ?, ?, ?, 0)
-        """, (goal_type, target_value, target_book_id, target_genre_id, 
+            user_id, goal_type, target_value, target_book_id, target_genre_id,
+            start_date, end_date, progress, completed
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, 0, 0)
+        """, (user_id, goal_type, target_value, target_book_id, target_genre_id, 
               start_date, end_date))
         
         goal_id = cursor.lastrowid
@@ -389,48 +1359,80 @@ def create_reading_goal_prepared(goal_type, target_value=None, target_book_id=No
     finally:
         conn.close()
 
-def get_reading_goals_prepared():
-    """Get all reading goals with detailed information using prepared statements"""
-    conn = sqlite3.connect('tbrlist.db')
+def get_stats_prepared(user_id=1):
+    """Library statistics for one user"""
+    conn = connect_db(user_id)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    
+    stats = {}
+    
+    # Total books count
+    cursor.execute("SELECT COUNT(*) as total FROM Books WHERE user_id = ?", (user_id,))
+    stats['total_books'] = cursor.fetchone()[0]
+    
+    # Books by status
+    cursor.execute("""
+        SELECT rs.status, COUNT(*) as count 
+        FROM TBRlist t
+        JOIN "Reading Status" rs ON t.status_id = rs.status_id
+        WHERE t.user_id = ?
+        GROUP BY rs.status
+    """, (user_id,))
+    stats['books_by_status'] = {row['status']: row['count'] for row in cursor.fetchall()}
+    
+    # Books by genre
+    cursor.execute("""
+        SELECT g.genre, COUNT(*) as count 
+        FROM Books b
+        JOIN Genres g ON b.genre_id = g.genre_id
+        WHERE b.user_id = ?
+        GROUP BY g.genre
+        ORDER BY count DESC
+        LIMIT 5
+    """, (user_id,))
+    stats['top_genres'] = {row['genre']: row['count'] for row in cursor.fetchall()}
+    
+    # Average rating
+    cursor.execute("""
+        SELECT AVG(rating) as avg_rating 
+        FROM Books 
+        WHERE user_id = ? AND rating IS NOT NULL
+    """, (user_id,))
+    stats['average_rating'] = round(float(cursor.fetchone()[0] or 0), 1)
+    
+    # Reading progress
+    cursor.execute("""
+        SELECT COUNT(*) as completed_this_year
+        FROM TBRlist
+        WHERE user_id = ? AND date_completed LIKE ? AND status_id = 1
+    """, (user_id, f"{datetime.datetime.now().year}%"))
+    stats['completed_this_year'] = cursor.fetchone()[0]
+    
+    # Pages read (for books with page counts)
+    cursor.execute("""
+        SELECT SUM(b.page_count) as pages_read
+        FROM TBRlist t
+        JOIN Books b ON t.book_id = b.book_id
+        WHERE t.user_id = ? AND t.status_id = 1 AND b.page_count IS NOT NULL
+    """, (user_id,))
+    stats['total_pages_read'] = cursor.fetchone()[0] or 0
+    
+    conn.close()
+    return add_archived_stats(stats, user_id)
+
+def get_reading_goals_prepared(user_id=1, status='all', after=None, limit=None):
+    """Get reading goals with detailed information and metrics using prepared statements"""
+    conn = connect_db(user_id)
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
     try:
-        cursor.execute("""
-        SELECT 
-            g.goal_id, g.goal_type, g.target_value, g.target_book_id, 
-            g.target_genre_id, g.start_date, g.end_date,
-            g.completed, g.progress,
-            b.title as book_title, a.name as author_name,
-            ge.genre as genre_name
-        FROM ReadingGoals g
-        LEFT JOIN Books b ON g.target_book_id = b.book_id
-        LEFT JOIN Authors a ON b.author_id = a.author_id
-        LEFT JOIN Genres ge ON g.target_genre_id = ge.genre_id
-        ORDER BY g.end_date ASC
-        """)
-        
-        goals = [dict(row) for row in cursor.fetchall()]
-        
-        # Calculate days remaining for each goal
-        for goal in goals:
-            try:
-                end_date = datetime.datetime.strptime(goal['end_date'], "%Y-%m-%d")
-                today = datetime.datetime.now()
-                goal['days_remaining'] = (end_date - today).days
-                
-                # Calculate percentage completion
-                if goal['target_value'] and goal['target_value'] > 0:
-                    goal['percentage'] = min(100, int((goal['progress'] / goal['target_value']) * 100))
-                else:
-                    goal['percentage'] = 0 if goal['completed'] == 0 else 100
-                    
-            except Exception as e:
-                print(f"Error calculating goal metrics: {str(e)}")
-                goal['days_remaining'] = 0
-                goal['percentage'] = 0
+        today = datetime.date.today().isoformat()
+        where, params = goal_page_query(user_id, status, after, limit, today)
         
-        return goals
+        # days_remaining, percentage and pace are computed by the query itself
+        return [dict(row) for row in select_goals(cursor, where, params, today).fetchall()]
     
     except Exception as e:
         print(f"Error retrieving reading goals with prepared statement: {str(e)}")
@@ -438,9 +1440,9 @@ def get_reading_goals_prepared():
     finally:
         conn.close()
 
-def update_goal_progress_prepared(goal_id, progress=None, completed=None):
+def update_goal_progress_prepared(goal_id, progress=None, completed=None, user_id=1):
     """Update a goal's progress or completion status using prepared statements"""
-    conn = sqlite3.connect('tbrlist.db')
+    conn = connect_db(user_id)
     cursor = conn.cursor()
     
     try:
@@ -452,8 +1454,8 @@ def update_goal_progress_prepared(goal_id, progress=None, completed=None):
         # to check if completion status should change automatically
         if progress is not None and completed is None:
             cursor.execute(
-                "SELECT goal_type, target_value FROM ReadingGoals WHERE goal_id = ?", 
-                (goal_id,)
+                "SELECT goal_type, target_value FROM ReadingGoals WHERE goal_id = ? AND user_id = ?", 
+                (goal_id, user_id)
             )
             goal_info = cursor.fetchone()
             
@@ -469,50 +1471,2445 @@ def update_goal_progress_prepared(goal_id, progress=None, completed=None):
             update_parts.append("progress = ?")
             params.append(progress)
             
-        # Explicit completion status takes precedence over automatic
-        if completed is not None:
-            update_parts.append("completed = ?")
-            params.append(1 if completed else 0)
+        # Explicit completion status takes precedence over automatic
+        if completed is not None:
+            update_parts.append("completed = ?")
+            params.append(1 if completed else 0)
+            
+        if not update_parts:
+            return False  # Nothing to update
+            
+        # Add the goal_id and owner to the parameters
+        params.extend([goal_id, user_id])
+        
+        cursor.execute(
+            f"UPDATE ReadingGoals SET {', '.join(update_parts)} WHERE goal_id = ? AND user_id = ?", 
+            params
+        )
+        
+        conn.commit()
+        return True
+        
+    except Exception as e:
+        conn.rollback()
+        print(f"Error updating goal progress with prepared statement: {str(e)}")
+        raise e
+    finally:
+        conn.close()
+
+def delete_reading_goal_prepared(goal_id, user_id=1):
+    """Delete a reading goal using prepared statements"""
+    conn = connect_db(user_id)
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute("DELETE FROM ReadingGoals WHERE goal_id = ? AND user_id = ?", (goal_id, user_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Error deleting reading goal with prepared statement: {str(e)}")
+        raise e
+    finally:
+        conn.close()
+
+IMPORT_COLUMNS = ('seq', 'title', 'author', 'genre', 'category', 'page_count',
+                  'publication_year', 'rating', 'priority', 'status_id',
+                  'date_added', 'date_completed', 'isbn')
+
+# One id per author name / genre and category, matching the get-or-create lookups
+IMPORT_LOOKUP_JOINS = """
+    JOIN (SELECT name, MIN(author_id) AS author_id FROM Authors GROUP BY name) a
+        ON a.name = s.author
+    JOIN (SELECT genre, MIN(genre_id) AS genre_id FROM Genres GROUP BY genre) gn
+        ON gn.genre = s.genre
+    LEFT JOIN (SELECT genre, category, MIN(genre_id) AS genre_id
+               FROM Genres GROUP BY genre, category) gc
+        ON gc.genre = s.genre AND gc.category = s.category
+"""
+IMPORT_GENRE_ID = "COALESCE(gc.genre_id, gn.genre_id)"
+
+def import_books_prepared(books, user_id=1, enrich=False):
+    """Bulk-add books to a user's TBR list using set-based statements.
+    
+    Rows are loaded into a temporary staging table (COPY on PostgreSQL, executemany on
+    SQLite), then authors, genres, books and TBR entries are each inserted with a
+    single INSERT ... SELECT. New books are paired back to their staging rows by
+    title, author, genre id and position, so duplicates within an import stay distinct.
+    With enrich, new books missing metadata are queued for the metadata enricher.
+    """
+    today = datetime.datetime.now().strftime("%Y-%m-%d")
+    rows = []
+    for seq, book in enumerate(books):
+        if not book.get('title') or not book.get('author_name') or not book.get('genre'):
+            raise ValueError(f"Book {seq} needs a title, author_name and genre")
+        rows.append((seq, book['title'], book['author_name'], book['genre'],
+                     book.get('category'), book.get('page_count'),
+                     book.get('publication_year'), book.get('rating'),
+                     book.get('priority', 5), book.get('status_id', 3),
+                     # A book finished before today was on the list by then
+                     book.get('date_added') or min(today, book.get('date_completed') or today),
+                     book.get('date_completed'), normalize_isbn(book.get('isbn'))))
+    if not rows:
+        return 0
+    
+    conn = connect_db(user_id)
+    cursor = conn.cursor()
+    postgres = get_dialect(conn) == 'postgresql'
+    
+    try:
+        cursor.execute("DROP TABLE IF EXISTS import_staging")
+        cursor.execute(f"""
+            CREATE TEMP TABLE import_staging (
+                seq INTEGER, title TEXT, author TEXT, genre TEXT, category TEXT,
+                page_count INTEGER, publication_year INTEGER, rating INTEGER,
+                priority INTEGER, status_id INTEGER, date_added TEXT, date_completed TEXT,
+                isbn TEXT
+            ){' ON COMMIT DROP' if postgres else ''}
+        """)
+        if postgres:
+            # New books are found by id below, so keep other writers out until commit
+            cursor.execute("LOCK TABLE Books IN SHARE ROW EXCLUSIVE MODE")
+            with cursor.copy(f"COPY import_staging ({', '.join(IMPORT_COLUMNS)}) "
+                             "FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.executemany(
+                f"INSERT INTO import_staging VALUES ({','.join('?' for _ in IMPORT_COLUMNS)})",
+                rows)
+        
+        cursor.execute("SELECT COALESCE(MAX(book_id), 0) FROM Books")
+        last_book_id = cursor.fetchone()[0]
+        
+        cursor.execute("""
+            INSERT INTO Authors (name)
+            SELECT DISTINCT s.author FROM import_staging s
+            WHERE NOT EXISTS (SELECT 1 FROM Authors a WHERE a.name = s.author)
+        """)
+        # Genres are shared: a new category gets its own row, a missing one reuses any
+        cursor.execute("""
+            INSERT INTO Genres (genre, category)
+            SELECT DISTINCT s.genre, s.category FROM import_staging s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM Genres g
+                WHERE g.genre = s.genre AND (s.category IS NULL OR g.category = s.category)
+            ) AND (s.category IS NOT NULL OR NOT EXISTS (
+                SELECT 1 FROM import_staging o
+                WHERE o.genre = s.genre AND o.category IS NOT NULL
+            ))
+        """)
+        cursor.execute(f"""
+            INSERT INTO Books (title, author_id, genre_id, page_count, publication_year,
+                               rating, isbn, user_id)
+            SELECT s.title, a.author_id, {IMPORT_GENRE_ID}, s.page_count,
+                   s.publication_year, s.rating, s.isbn, ?
+            FROM import_staging s
+            {IMPORT_LOOKUP_JOINS}
+            ORDER BY s.seq
+        """, (user_id,))
+        cursor.execute(f"""
+            INSERT INTO TBRlist (user_id, book_id, status_id, priority, date_added,
+                                 date_completed)
+            SELECT ?, nb.book_id, s.status_id, s.priority, s.date_added, s.date_completed
+            FROM (
+                SELECT s.*, a.author_id, {IMPORT_GENRE_ID} AS genre_id, ROW_NUMBER() OVER (
+                    PARTITION BY s.title, a.author_id, {IMPORT_GENRE_ID} ORDER BY s.seq
+                ) AS k
+                FROM import_staging s
+                {IMPORT_LOOKUP_JOINS}
+            ) s
+            JOIN (
+                SELECT book_id, title, author_id, genre_id, ROW_NUMBER() OVER (
+                    PARTITION BY title, author_id, genre_id ORDER BY book_id
+                ) AS k
+                FROM Books WHERE user_id = ? AND book_id > ?
+            ) nb ON nb.title = s.title AND nb.author_id = s.author_id
+                AND nb.genre_id = s.genre_id AND nb.k = s.k
+        """, (user_id, user_id, last_book_id))
+        imported = cursor.rowcount
+        
+        conn.commit()
+        if not postgres:
+            cursor.execute("DROP TABLE import_staging")
+    except Exception as e:
+        conn.rollback()
+        print(f"Error importing books with prepared statement: {str(e)}")
+        raise e
+    finally:
+        conn.close()
+    
+    if enrich and metadata_enricher.provider is not None:
+        metadata_enricher.submit(metadata_enricher.missing_book_ids(user_id, last_book_id),
+                                 user_id)
+    return imported
+
+# ================ Change Tracking (Delta Sync) ================
+
+# Tables whose rows are versioned in the ChangeLog, mapped to their primary key
+TRACKED_TABLES = {
+    'TBRlist': 'tbr_id',
+    'Books': 'book_id',
+    'ReadingGoals': 'goal_id',
+}
+
+# Lookup tables only affect existing rows when a name or category is edited in place
+LOOKUP_TABLES = {
+    'Authors': 'author_id',
+    'Genres': 'genre_id',
+}
+
+# Lookup tables are shared, so their changes count against this pseudo-user
+SHARED_USER_ID = 0
+
+# Held shared by every PostgreSQL change to a user's rows and exclusively by every change
+# to a shared lookup row (pg_advisory_xact_lock key)
+CHANGE_LOG_LOCK_KEY = 0x7462726c
+
+# PostgreSQL triggers share one function; TG_ARGV carries the primary key column and
+# whether the table is a shared lookup table. Unlike SQLite's single writer, concurrent
+# transactions could commit change ids out of order, and a delta read that saw the later
+# id would skip the earlier one for good. So a change id is only taken while holding
+# the locks every other change a reader of this user sees must also take (the user's
+# UserDataVersion row, and the advisory lock shared rows take exclusively): any smaller
+# id a reader could need has committed by the time a larger one is allocated.
+POSTGRES_CHANGE_FUNCTION = """
+CREATE OR REPLACE FUNCTION tbr_log_change() RETURNS trigger AS $$
+DECLARE
+    rec jsonb;
+    owner integer;
+    new_change_id integer;
+BEGIN
+    IF TG_OP = 'DELETE' THEN rec := to_jsonb(OLD); ELSE rec := to_jsonb(NEW); END IF;
+    IF TG_ARGV[1] = 'shared' THEN
+        owner := NULL;
+        PERFORM pg_advisory_xact_lock(%(lock_key)d);
+    ELSE
+        owner := (rec ->> 'user_id')::integer;
+        PERFORM pg_advisory_xact_lock_shared(%(lock_key)d);
+    END IF;
+    INSERT INTO "UserDataVersion" (user_id, version)
+    VALUES (COALESCE(owner, %(shared_user)d), 0)
+    ON CONFLICT (user_id) DO UPDATE SET version = "UserDataVersion".version;
+    INSERT INTO "ChangeLog" (table_name, row_id, op, changed_at, user_id)
+    VALUES (TG_TABLE_NAME, (rec ->> TG_ARGV[0])::integer,
+            CASE WHEN TG_OP = 'DELETE' THEN 'delete' ELSE 'upsert' END,
+            to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS'), owner)
+    RETURNING change_id INTO new_change_id;
+    UPDATE "UserDataVersion" SET version = GREATEST(version, new_change_id)
+    WHERE user_id = COALESCE(owner, %(shared_user)d);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+def change_tracking_triggers(dialect='sqlite'):
+    """Build the trigger DDL that records every write to a tracked table in ChangeLog
+    and bumps the owning user's data version"""
+    if dialect == 'postgresql':
+        return postgres_change_tracking_triggers()
+    
+    events = [(table, pk, (('INSERT', 'NEW', 'upsert'),
+                           ('UPDATE', 'NEW', 'upsert'),
+                           ('DELETE', 'OLD', 'delete')))
+              for table, pk in TRACKED_TABLES.items()]
+    events += [(table, pk, (('UPDATE', 'NEW', 'upsert'),))
+               for table, pk in LOOKUP_TABLES.items()]
+    
+    statements = []
+    for table, pk, table_events in events:
+        for event, ref, op in table_events:
+            name = f"trg_{table.lower()}_{event.lower()}"
+            user = 'NULL' if table in LOOKUP_TABLES else f"{ref}.user_id"
+            version_user = SHARED_USER_ID if table in LOOKUP_TABLES else f"{ref}.user_id"
+            # Recreate rather than IF NOT EXISTS so trigger changes reach existing databases
+            statements.append(f"DROP TRIGGER IF EXISTS {name}")
+            statements.append(f"""
+            CREATE TRIGGER {name}
+            AFTER {event} ON {table}
+            BEGIN
+                INSERT INTO ChangeLog (table_name, row_id, op, changed_at, user_id)
+                VALUES ('{table}', {ref}.{pk}, '{op}', datetime('now'), {user});
+                INSERT OR REPLACE INTO UserDataVersion (user_id, version)
+                VALUES ({version_user}, last_insert_rowid());
+            END
+            """)
+    return statements
+
+def postgres_change_tracking_triggers():
+    statements = [POSTGRES_CHANGE_FUNCTION % {'lock_key': CHANGE_LOG_LOCK_KEY,
+                                              'shared_user': SHARED_USER_ID}]
+    for table, pk in {**TRACKED_TABLES, **LOOKUP_TABLES}.items():
+        name = f"trg_{table.lower()}_change"
+        events = 'UPDATE' if table in LOOKUP_TABLES else 'INSERT OR UPDATE OR DELETE'
+        kind = 'shared' if table in LOOKUP_TABLES else 'user'
+        statements.append(f'DROP TRIGGER IF EXISTS {name} ON "{table}"')
+        statements.append(f"""
+            CREATE TRIGGER {name}
+            AFTER {events} ON "{table}"
+            FOR EACH ROW EXECUTE FUNCTION tbr_log_change('{pk}', '{kind}')
+        """)
+    return statements
+
+def get_data_version(cursor):
+    """Current data version: the id of the latest change ever logged"""
+    if get_dialect(cursor) == 'postgresql':
+        # The id sequence keeps the high-water mark even after old entries are compacted
+        cursor.execute('SELECT last_value, is_called FROM "ChangeLog_change_id_seq"')
+        last_value, is_called = cursor.fetchone()
+        return last_value if is_called else 0
+    
+    # sqlite_sequence keeps the high-water mark even after old entries are compacted
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'ChangeLog'")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def get_user_data_version(cursor, user_id):
+    """A user's data version: the latest change to their rows or to shared lookup rows"""
+    cursor.execute(
+        "SELECT MAX(version) FROM UserDataVersion WHERE user_id IN (?, ?)",
+        (user_id, SHARED_USER_ID)
+    )
+    row = cursor.fetchone()
+    return row[0] or 0
+
+def chunked(items, size=500):
+    """Split a list into chunks that stay under SQLite's bound-parameter limit"""
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def get_changes_since_prepared(since, user_id=1):
+    """Get a user's TBR and goal rows changed after their data version, plus tombstones"""
+    conn = connect_db(user_id)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    
+    try:
+        # Read everything inside one transaction so rows match the reported version
+        cursor.execute("BEGIN")
+        version = get_user_data_version(cursor, user_id)
+        
+        cursor.execute("SELECT compacted_through FROM SyncState WHERE id = 1")
+        state = cursor.fetchone()
+        compacted_through = state[0] if state else 0
+        
+        # A new client, or one the log no longer covers, gets everything
+        if since <= 0 or since < compacted_through:
+            cursor.execute(TBR_SELECT_SQL + " WHERE t.user_id = ? "
+                           "ORDER BY t.priority DESC, t.date_added DESC", (user_id,))
+            tbr = [dict(row) for row in cursor.fetchall()]
+            where, params = goal_page_query(user_id)
+            goals = [dict(row) for row in select_goals(cursor, where, params).fetchall()]
+            return {
+                "version": version,
+                "full_resync": True,
+                "tbr": tbr,
+                "goals": goals,
+                "deleted": {"tbr": [], "books": [], "goals": []}
+            }
+        
+        # Only the latest operation per row matters
+        cursor.execute("""
+            SELECT table_name, row_id, op
+            FROM ChangeLog
+            WHERE change_id > ? AND change_id <= ? AND (user_id = ? OR user_id IS NULL)
+            ORDER BY change_id ASC
+        """, (since, version, user_id))
+        latest = {}
+        for row in cursor.fetchall():
+            latest[(row['table_name'], row['row_id'])] = row['op']
+        
+        upserts = {table: set() for table in {**TRACKED_TABLES, **LOOKUP_TABLES}}
+        deleted = {table: set() for table in {**TRACKED_TABLES, **LOOKUP_TABLES}}
+        for (table, row_id), op in latest.items():
+            (upserts if op == 'upsert' else deleted)[table].add(row_id)
+        
+        # A book, author or genre edit changes every row that joins to it
+        tbr_by_id = {}
+        for column, table in (('t.tbr_id', 'TBRlist'), ('t.book_id', 'Books'),
+                              ('b.author_id', 'Authors'), ('b.genre_id', 'Genres')):
+            for ids in chunked(upserts[table]):
+                placeholders = ','.join('?' for _ in ids)
+                cursor.execute(TBR_SELECT_SQL + f" WHERE t.user_id = ? AND {column} IN ({placeholders})",
+                               [user_id, *ids])
+                tbr_by_id.update((row['tbr_id'], dict(row)) for row in cursor.fetchall())
+        
+        goals_by_id = {}
+        for column, table in (('g.goal_id', 'ReadingGoals'), ('g.target_book_id', 'Books'),
+                              ('b.author_id', 'Authors'), ('g.target_genre_id', 'Genres')):
+            for ids in chunked(upserts[table]):
+                placeholders = ','.join('?' for _ in ids)
+                select_goals(cursor, f" WHERE g.user_id = ? AND {column} IN ({placeholders})",
+                             [user_id, *ids])
+                goals_by_id.update((row['goal_id'], dict(row)) for row in cursor.fetchall())
+        
+        # Upserted rows that no longer join (e.g. missing book) are gone for the client
+        deleted['TBRlist'] |= upserts['TBRlist'] - set(tbr_by_id)
+        deleted['ReadingGoals'] |= upserts['ReadingGoals'] - set(goals_by_id)
+        
+        tbr = sorted(tbr_by_id.values(),
+                     key=lambda b: (b['priority'] or 0, b['date_added'] or ''), reverse=True)
+        goals = sorted(goals_by_id.values(), key=lambda g: (g['end_date'], g['goal_id']))
+        
+        return {
+            "version": version,
+            "full_resync": False,
+            "tbr": tbr,
+            "goals": goals,
+            "deleted": {
+                "tbr": sorted(deleted['TBRlist']),
+                "books": sorted(deleted['Books']),
+                "goals": sorted(deleted['ReadingGoals'])
+            }
+        }
+    
+    except Exception as e:
+        print(f"Error retrieving changes with prepared statement: {str(e)}")
+        raise e
+    finally:
+        conn.close()
+
+# Portable "insert if missing" for the single SyncState row
+SYNC_STATE_INSERT_SQL = """
+    INSERT INTO SyncState (id, compacted_through)
+    SELECT 1, 0 WHERE NOT EXISTS (SELECT 1 FROM SyncState WHERE id = 1)
+"""
+
+def compact_change_log_prepared(retention_days=30, db_path=None):
+    """Drop superseded change log entries and anything older than the retention window"""
+    conn = connect_path(db_path or shard_router.main_path())
+    cursor = conn.cursor()
+    
+    try:
+        # Keep only the newest entry for each row
+        cursor.execute("""
+            DELETE FROM ChangeLog
+            WHERE change_id NOT IN (
+                SELECT MAX(change_id) FROM ChangeLog GROUP BY table_name, row_id
+            )
+        """)
+        superseded = cursor.rowcount
+        
+        # Expire old entries; clients older than the watermark must do a full resync
+        cutoff = (datetime.datetime.now(datetime.timezone.utc)
+                  - datetime.timedelta(days=int(retention_days))).strftime("%Y-%m-%d %H:%M:%S")
+        cursor.execute("SELECT MAX(change_id) FROM ChangeLog WHERE changed_at < ?", (cutoff,))
+        watermark = cursor.fetchone()[0]
+        expired = 0
+        if watermark is not None:
+            cursor.execute("DELETE FROM ChangeLog WHERE change_id <= ?", (watermark,))
+            expired = cursor.rowcount
+            cursor.execute(SYNC_STATE_INSERT_SQL)
+            cursor.execute("""
+                UPDATE SyncState SET compacted_through = ?
+                WHERE id = 1 AND compacted_through < ?
+            """, (watermark, watermark))
+        
+        conn.commit()
+        return {"superseded_removed": superseded, "expired_removed": expired}
+    except Exception as e:
+        conn.rollback()
+        print(f"Error compacting change log with prepared statement: {str(e)}")
+        raise e
+    finally:
+        conn.close()
+
+# ================ In-Memory Library Snapshot ================
+
+class DictColumn:
+    """Dictionary-encoded string column: each distinct value is stored (interned) once"""
+    
+    def __init__(self):
+        self.values = []
+        self.codes = array('I')
+        self._index = {}
+    
+    def append(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = len(self.values)
+            self._index[value] = code
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+        self.codes.append(code)
+    
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+    
+    def codes_where(self, predicate):
+        """Codes of the distinct values matching predicate (evaluated once per value)"""
+        return {code for code, value in enumerate(self.values) if predicate(value)}
+    
+    def nbytes(self):
+        return (self.codes.itemsize * len(self.codes)
+                + sum(sys.getsizeof(v) for v in self.values)
+                + sys.getsizeof(self.values))
+
+class LibrarySnapshot:
+    """Read-only columnar copy of the joined library, kept in list order
+    (priority DESC, date_added DESC) so /api/tbr needs no sorting"""
+    
+    NULL = -2 ** 31  # stands in for SQL NULL in integer columns
+    INT_COLUMNS = ('tbr_id', 'book_id', 'status_id', 'priority',
+                   'page_count', 'publication_year', 'rating')
+    STR_COLUMNS = ('author', 'genre', 'category', 'status', 'date_added', 'date_completed',
+                   'isbn')
+    
+    SQL = """
+        SELECT t.tbr_id, b.book_id, b.title, a.name as author, g.genre as genre,
+        g.category as category, t.status_id, rs.status, t.priority, t.date_added,
+        t.date_completed, b.page_count, b.publication_year, b.rating, b.isbn
+        FROM TBRlist t
+        JOIN Books b ON t.book_id = b.book_id
+        JOIN Authors a ON b.author_id = a.author_id
+        JOIN Genres g ON b.genre_id = g.genre_id
+        JOIN "Reading Status" rs ON t.status_id = rs.status_id
+        WHERE t.user_id = ?
+        ORDER BY t.priority DESC, t.date_added DESC
+    """
+    
+    def __init__(self, cursor, version, user_id):
+        self.version = version
+        self.user_id = user_id
+        self.ints = {name: array('i') for name in self.INT_COLUMNS}
+        self.strs = {name: DictColumn() for name in self.STR_COLUMNS}
+        titles = []
+        self._title_offsets = array('I', [0])
+        
+        cursor.execute(self.SQL, (user_id,))
+        for row in cursor:
+            for name in self.INT_COLUMNS:
+                value = row[name]
+                self.ints[name].append(self.NULL if value is None else value)
+            for name in self.STR_COLUMNS:
+                self.strs[name].append(row[name])
+            title = row['title'] or ''
+            titles.append(title)
+            self._title_offsets.append(self._title_offsets[-1] + len(title))
+        
+        # All titles packed into one string avoids a str object per book
+        self._titles = ''.join(titles)
+        lowered = self._titles.lower()
+        # Offsets only line up when lowercasing keeps every character's length
+        self._titles_lower = lowered if len(lowered) == len(self._titles) else None
+        self.size = len(titles)
+    
+    def _int(self, name, i):
+        value = self.ints[name][i]
+        return None if value == self.NULL else value
+    
+    def title(self, i):
+        return self._titles[self._title_offsets[i]:self._title_offsets[i + 1]]
+    
+    def row(self, i):
+        """Row i shaped exactly like get_tbr_list_prepared() output"""
+        return {
+            "tbr_id": self.ints['tbr_id'][i],
+            "book_id": self.ints['book_id'][i],
+            "title": self.title(i),
+            "author": self.strs['author'][i],
+            "genre": self.strs['genre'][i],
+            "category": self.strs['category'][i],
+            "status": self.strs['status'][i],
+            "priority": self._int('priority', i),
+            "date_added": self.strs['date_added'][i],
+            "date_completed": self.strs['date_completed'][i],
+            "page_count": self._int('page_count', i),
+            "publication_year": self._int('publication_year', i),
+            "rating": self._int('rating', i),
+            "isbn": self.strs['isbn'][i]
+        }
+    
+    def rows(self):
+        return [self.row(i) for i in range(self.size)]
+    
+    def _title_matches(self, needle):
+        """Row indexes whose title contains needle (already lowercased)"""
+        if self._titles_lower is None:
+            return {i for i in range(self.size) if needle in self.title(i).lower()}
+        matches = set()
+        offsets = self._title_offsets
+        pos = self._titles_lower.find(needle)
+        while pos != -1:
+            i = bisect.bisect_right(offsets, pos) - 1
+            # Skip hits that straddle two packed titles
+            if pos + len(needle) <= offsets[i + 1]:
+                matches.add(i)
+            pos = self._titles_lower.find(needle, pos + 1)
+        return matches
+    
+    def search(self, query, limit=10):
+        """Same results as the /api/search LIKE query"""
+        needle = query.lower()
+        author_codes = self.strs['author'].codes_where(lambda v: v and needle in v.lower())
+        genre_codes = self.strs['genre'].codes_where(lambda v: v and needle in v.lower())
+        author = self.strs['author'].codes
+        genre = self.strs['genre'].codes
+        
+        hits = self._title_matches(needle)
+        hits.update(i for i in range(self.size)
+                    if author[i] in author_codes or genre[i] in genre_codes)
+        
+        return [{
+            "tbr_id": self.ints['tbr_id'][i],
+            "book_id": self.ints['book_id'][i],
+            "title": self.title(i),
+            "author": self.strs['author'][i],
+            "genre": self.strs['genre'][i],
+            "status": self.strs['status'][i]
+        } for i in sorted(hits)[:limit]]
+    
+    def _distinct_books(self):
+        """First row index for each book, since book-level stats count books not TBR rows"""
+        seen = {}
+        for i, book_id in enumerate(self.ints['book_id']):
+            seen.setdefault(book_id, i)
+        return seen.values()
+    
+    def stats(self):
+        """Same figures as the /api/stats queries"""
+        books = list(self._distinct_books())
+        status_id = self.ints['status_id']
+        page_count = self.ints['page_count']
+        rating = self.ints['rating']
+        
+        by_status = Counter(self.strs['status'].codes)
+        status_values = self.strs['status'].values
+        genre_counts = Counter(self.strs['genre'].codes[i] for i in books)
+        genre_values = self.strs['genre'].values
+        ratings = [rating[i] for i in books if rating[i] != self.NULL]
+        
+        year = str(datetime.datetime.now().year)
+        date_completed = self.strs['date_completed']
+        completed = [i for i in range(self.size) if status_id[i] == 1]
+        
+        return {
+            "total_books": len(books),
+            "books_by_status": {status_values[code]: count for code, count in by_status.items()},
+            "top_genres": {genre_values[code]: count for code, count in genre_counts.most_common(5)},
+            "average_rating": round(sum(ratings) / len(ratings), 1) if ratings else 0,
+            "completed_this_year": sum(1 for i in completed
+                                       if (date_completed[i] or '').startswith(year)),
+            "total_pages_read": sum(page_count[i] for i in completed if page_count[i] != self.NULL)
+        }
+    
+    def _favorites(self, column):
+        """Top 3 values of a column by average rating over books rated above 3"""
+        codes = self.strs[column].codes
+        rating = self.ints['rating']
+        totals = defaultdict(lambda: [0, 0])
+        for i in self._distinct_books():
+            if rating[i] != self.NULL and rating[i] > 3:
+                totals[codes[i]][0] += rating[i]
+                totals[codes[i]][1] += 1
+        ranked = sorted(((total / count, code) for code, (total, count) in totals.items()
+                         if count > 1), reverse=True)
+        return [code for _, code in ranked[:3]]
+    
+    def _to_read_matching(self, column, codes, limit=5):
+        column_codes = self.strs[column].codes
+        status_id = self.ints['status_id']
+        return [{
+            "book_id": self.ints['book_id'][i],
+            "title": self.title(i),
+            "author": self.strs['author'][i],
+            "genre": self.strs['genre'][i],
+            "priority": self._int('priority', i),
+            "tbr_id": self.ints['tbr_id'][i]
+        } for i in [i for i in range(self.size)
+                    if status_id[i] == 3 and column_codes[i] in codes][:limit]]
+    
+    def recommendations(self):
+        """Same payload as the /api/recommendations queries"""
+        genre_codes = self._favorites('genre')
+        author_codes = self._favorites('author')
+        return {
+            "favorite_genres": [self.strs['genre'].values[c] for c in genre_codes],
+            "favorite_authors": [self.strs['author'].values[c] for c in author_codes],
+            "genre_recommendations": self._to_read_matching('genre', set(genre_codes)),
+            "author_recommendations": self._to_read_matching('author', set(author_codes))
+        }
+    
+    def nbytes(self):
+        """Approximate memory held by the snapshot"""
+        return (sum(col.itemsize * len(col) for col in self.ints.values())
+                + sum(col.nbytes() for col in self.strs.values())
+                + sys.getsizeof(self._titles)
+                + (sys.getsizeof(self._titles_lower) if self._titles_lower is not None else 0)
+                + self._title_offsets.itemsize * len(self._title_offsets))
+
+def dict_rows_nbytes(rows):
+    """Approximate memory of the dict-per-row representation, for comparison"""
+    return sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values())
+               for row in rows)
+
+# Per-user snapshots, least recently used first
+_library_snapshots = OrderedDict()
+_library_snapshot_lock = threading.Lock()
+
+def get_library_snapshot(user_id=1):
+    """Return an up-to-date snapshot of a user's library, or None when snapshots are disabled.
+    
+    Writers never touch a published snapshot: when the user's data version moves on,
+    a new one is built and swapped in, so readers holding the old one are unaffected.
+    """
+    if not app.config['LIBRARY_SNAPSHOT']:
+        return None
+    
+    conn = connect_db(user_id)
+    conn.row_factory = sqlite3.Row
+    try:
+        cursor = conn.cursor()
+        version = get_user_data_version(cursor, user_id)
+        snapshot = _library_snapshots.get(user_id)
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        
+        with _library_snapshot_lock:
+            # Another thread may have rebuilt it while we waited
+            snapshot = _library_snapshots.get(user_id)
+            if snapshot is None or snapshot.version != version:
+                cursor.execute("BEGIN")
+                snapshot = LibrarySnapshot(cursor, get_user_data_version(cursor, user_id), user_id)
+                conn.rollback()
+                _library_snapshots[user_id] = snapshot
+            _library_snapshots.move_to_end(user_id)
+            while len(_library_snapshots) > app.config['LIBRARY_SNAPSHOT_USERS']:
+                _library_snapshots.popitem(last=False)
+            return snapshot
+    finally:
+        conn.close()
+
+# ================ JSON Encoding ================
+
+def encode_json(obj):
+    """Encode obj to compact JSON bytes with sorted keys, matching jsonify's key order"""
+    if orjson is not None and app.config['JSON_ENCODER'] == 'orjson':
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that routes jsonify() through encode_json()"""
+    
+    def dumps(self, obj, **kwargs):
+        # Pretty-printing and custom encoder hooks still go through the stdlib path
+        if kwargs.get('indent') or kwargs.get('cls') or kwargs.get('default'):
+            return super().dumps(obj, **kwargs)
+        try:
+            return encode_json(obj).decode('utf-8')
+        except TypeError:
+            # Types orjson doesn't know (e.g. Decimal) fall back to Flask's default hook
+            return super().dumps(obj, **kwargs)
+    
+    def loads(self, s, **kwargs):
+        if orjson is not None and app.config['JSON_ENCODER'] == 'orjson' and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+app.json = FastJSONProvider(app)
+
+def json_bytes_response(body, status=200):
+    """Wrap an already-encoded JSON body in a response"""
+    return app.response_class(body, status=status, mimetype=app.json.mimetype)
+
+class FragmentCache:
+    """Encoded JSON fragments per row, evicted through the change log when a row is written.
+    
+    Each fragment records the (table, row_id) pairs it was built from; syncing against the
+    ChangeLog drops fragments whose rows changed since the last sync.
+    """
+    
+    def __init__(self, max_entries=200000):
+        self.max_entries = max_entries
+        self.version = 0
+        self.epoch = None
+        self._fragments = {}
+        self._keys_by_row = defaultdict(set)
+        self._lock = threading.Lock()
+    
+    def _clear(self):
+        self._fragments.clear()
+        self._keys_by_row.clear()
+    
+    def sync(self, cursor, epoch=None):
+        """Evict fragments for rows written since the last sync and return the data version.
+        
+        epoch lets a cache drop everything when something outside the database changes,
+        e.g. the current date for goal fragments that carry days_remaining.
+        """
+        version = get_data_version(cursor)
+        with self._lock:
+            if epoch != self.epoch:
+                self._clear()
+                self.epoch = epoch
+            if version == self.version:
+                return version
+            
+            if self._fragments:
+                cursor.execute("SELECT compacted_through FROM SyncState WHERE id = 1")
+                state = cursor.fetchone()
+                if self.version < (state[0] if state else 0):
+                    # The log no longer covers our version
+                    self._clear()
+                else:
+                    cursor.execute("""
+                        SELECT DISTINCT table_name, row_id FROM ChangeLog
+                        WHERE change_id > ? AND change_id <= ?
+                    """, (self.version, version))
+                    for table, row_id in cursor.fetchall():
+                        if table in LOOKUP_TABLES:
+                            # Renames are rare; not worth tracking which rows they touch
+                            self._clear()
+                            break
+                        for key in self._keys_by_row.pop((table, row_id), ()):
+                            self._fragments.pop(key, None)
+            self.version = version
+            return version
+    
+    def get(self, key):
+        return self._fragments.get(key)
+    
+    def put(self, key, rows, fragment, version):
+        """Store a fragment built from data read at version; stale reads are dropped"""
+        with self._lock:
+            if version != self.version:
+                return
+            if len(self._fragments) >= self.max_entries:
+                self._clear()
+            self._fragments[key] = fragment
+            for row in rows:
+                self._keys_by_row[row].add(key)
+
+# One cache per (kind, database file): row ids and change logs are per database
+_fragment_caches = {}
+
+def get_fragment_cache(kind, user_id):
+    key = (kind, shard_router.path_for(user_id))
+    cache = _fragment_caches.get(key)
+    if cache is None:
+        cache = _fragment_caches.setdefault(key, FragmentCache())
+    return cache
+
+def get_tbr_list_json(user_id=1):
+    """Encoded TBR list for a user, assembled from cached per-row fragments"""
+    conn = connect_db(user_id)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    
+    try:
+        # Read version and rows in one transaction so fragments match their version
+        cursor.execute("BEGIN")
+        tbr_fragments = get_fragment_cache('tbr', user_id)
+        version = tbr_fragments.sync(cursor)
+        
+        # The snapshot is only usable if it shows the same state this transaction sees
+        snapshot = get_library_snapshot(user_id)
+        if snapshot is not None and snapshot.version == get_user_data_version(cursor, user_id):
+            items = ((snapshot.ints['tbr_id'][i], snapshot.ints['book_id'][i], i)
+                     for i in range(snapshot.size))
+            make_row = snapshot.row
+        else:
+            cursor.execute(TBR_SELECT_SQL + " WHERE t.user_id = ? "
+                           "ORDER BY t.priority DESC, t.date_added DESC", (user_id,))
+            items = ((row['tbr_id'], row['book_id'], row) for row in cursor)
+            make_row = dict
+        
+        parts = []
+        for tbr_id, book_id, source in items:
+            fragment = tbr_fragments.get(tbr_id)
+            if fragment is None:
+                fragment = encode_json(make_row(source))
+                tbr_fragments.put(tbr_id, (('TBRlist', tbr_id), ('Books', book_id)),
+                                  fragment, version)
+            parts.append(fragment)
+        return b'[' + b','.join(parts) + b']'
+    finally:
+        conn.close()
+
+def get_reading_goals_json(user_id=1, status='all', after=None, limit=None):
+    """Encoded goal list for a user, assembled from cached per-goal fragments.
+    
+    With a limit the body is one page: {"goals": [...], "next_cursor": ...}.
+    """
+    conn = connect_db(user_id)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    
+    try:
+        today = datetime.date.today()
+        where, params = goal_page_query(user_id, status, after, limit, today.isoformat())
+        cursor.execute("BEGIN")
+        # days_remaining and pace change daily, so fragments only live for the current date
+        goal_fragments = get_fragment_cache('goal', user_id)
+        version = goal_fragments.sync(cursor, epoch=today)
+        select_goals(cursor, where, params, today.isoformat())
+        
+        parts = []
+        last_goal = None
+        for row in cursor:
+            fragment = goal_fragments.get(row['goal_id'])
+            if fragment is None:
+                fragment = encode_json(dict(row))
+                goal_fragments.put(row['goal_id'],
+                                   (('ReadingGoals', row['goal_id']), ('Books', row['target_book_id'])),
+                                   fragment, version)
+            parts.append(fragment)
+            last_goal = row
+        body = b'[' + b','.join(parts) + b']'
+        if limit is None:
+            return body
+        
+        next_cursor = goal_page_cursor(last_goal, len(parts), limit)
+        return b'{"goals":' + body + b',"next_cursor":' + encode_json(next_cursor) + b'}'
+    finally:
+        conn.close()
+
+# ================ Response Compression ================
+
+# Streaming compressors: (compress, flush what's buffered so far, finish the stream)
+
+def _gzip_stream():
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    return (compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH),
+            compressor.flush)
+
+def _brotli_stream():
+    compressor = brotli.Compressor(quality=5)
+    return compressor.process, compressor.flush, compressor.finish
+
+def _zstd_stream():
+    compressor = zstandard.ZstdCompressor(level=3).compressobj()
+    return (compressor.compress, lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush)
+
+@functools.lru_cache(maxsize=None)
+def load_compressors():
+    """Content-Encoding -> (one-shot compress, streaming compressor factory), in preference
+    order; imports the optional compression libraries on first use"""
+    global brotli, zstandard
+    compressors = {}
+    try:
+        import zstandard
+        compressors['zstd'] = (lambda body: zstandard.ZstdCompressor(level=3).compress(body),
+                               _zstd_stream)
+    except ImportError:
+        pass
+    try:
+        import brotli
+        compressors['br'] = (lambda body: brotli.compress(body, quality=5), _brotli_stream)
+    except ImportError:
+        pass
+    compressors['gzip'] = (lambda body: gzip.compress(body, compresslevel=6), _gzip_stream)
+    return compressors
+
+class CompressedBodyCache:
+    """LRU of compressed GET bodies keyed by (user, path, encoding).
+    
+    Entries carry a digest of the uncompressed body and are only reused while it matches,
+    so a changed body (new data, or the export journal's timestamp) is compressed afresh
+    without asking the database whether anything changed.
+    """
+    
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_or_compress(self, key, body, compress):
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == digest:
+                self._entries.move_to_end(key)
+                return entry[1]
+        
+        compressed = compress(body)
+        with self._lock:
+            self._entries[key] = (digest, compressed)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return compressed
+
+compressed_bodies = CompressedBodyCache()
+
+def negotiate_encoding():
+    """Best Content-Encoding we support from the request's Accept-Encoding"""
+    return request.accept_encodings.best_match(list(load_compressors()))
+
+def compress_stream(chunks, encoding):
+    """Compress a streamed (generator) response chunk by chunk, flushing each one so the
+    client gets it as soon as it is produced"""
+    compress, flush, finish = load_compressors()[encoding][1]()
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        data = compress(chunk) + flush()
+        if data:
+            yield data
+    yield finish()
+
+@app.after_request
+def compress_response(response):
+    if (not app.config['COMPRESSION']
+            or response.direct_passthrough
+            or not 200 <= response.status_code < 300
+            or 'Content-Encoding' in response.headers):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    if not encoding:
+        return response
+    
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = encoding
+        return response
+    
+    body = response.get_data()
+    if len(body) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    
+    compress = load_compressors()[encoding][0]
+    if request.method == 'GET':
+        key = (get_current_user_id(), request.full_path, encoding)
+        body = compressed_bodies.get_or_compress(key, body, compress)
+    else:
+        body = compress(body)
+    
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+# ================ Shard Administration ================
+
+def get_users_in_database(cursor):
+    cursor.execute("""
+        SELECT user_id FROM TBRlist
+        UNION SELECT user_id FROM ReadingGoals
+        UNION SELECT user_id FROM UserSettings
+    """)
+    return sorted(row[0] for row in cursor.fetchall() if row[0] is not None)
+
+def get_admin_stats_prepared():
+    """Aggregate library totals across the main database and every shard"""
+    totals = Counter()
+    books_by_status = Counter()
+    databases = []
+    
+    for path in shard_router.database_paths():
+        conn = connect_path(path)
+        cursor = conn.cursor()
+        try:
+            counts = {"users": len(get_users_in_database(cursor))}
+            for key, sql in (("books", "SELECT COUNT(*) FROM Books"),
+                             ("tbr_entries", "SELECT COUNT(*) FROM TBRlist"),
+                             ("goals", "SELECT COUNT(*) FROM ReadingGoals")):
+                cursor.execute(sql)
+                counts[key] = cursor.fetchone()[0]
+            cursor.execute("""
+                SELECT SUM(b.page_count) FROM TBRlist t
+                JOIN Books b ON t.book_id = b.book_id
+                WHERE t.status_id = 1 AND b.page_count IS NOT NULL
+            """)
+            counts["total_pages_read"] = cursor.fetchone()[0] or 0
+            
+            cursor.execute("""
+                SELECT rs.status, COUNT(*) FROM TBRlist t
+                JOIN "Reading Status" rs ON t.status_id = rs.status_id
+                GROUP BY rs.status
+            """)
+            books_by_status.update(dict(cursor.fetchall()))
+        finally:
+            conn.close()
+        
+        totals.update(counts)
+        databases.append({"database": shard_router.database_label(path), **counts})
+    
+    # Archived history is kept outside the databases, once for all of them
+    archived = reading_archive.summary()
+    books_by_status.update(archived['by_status'])
+    totals['total_pages_read'] += archived['pages_read']
+    totals['archived_entries'] = archived['entries']
+    
+    return {**totals, "books_by_status": dict(books_by_status), "databases": databases}
+
+def _get_or_create_id(cursor, table, pk, column, value):
+    cursor.execute(f"SELECT {pk} FROM {table} WHERE {column} = ?", (value,))
+    row = cursor.fetchone()
+    if row:
+        return row[0]
+    cursor.execute(f"INSERT INTO {table} ({column}) VALUES (?)", (value,))
+    return cursor.lastrowid
+
+def move_user_prepared(user_id, target_shard, source_shard=None):
+    """Move a user's books, goals and settings to another shard.
+    
+    Rows get new ids in the target, so tombstones for the old ids are logged there
+    (after raising its change sequence past the source's) and delta-sync clients
+    converge without a full resync. The copy is committed and the user re-pointed
+    before the source rows are deleted, so a crash can leave a stale copy behind
+    but never loses data. The source stays write-locked from the first read until
+    its rows are deleted.
+    """
+    if not shard_router.sharded:
+        raise ValueError("Sharding is not enabled (set TBR_SHARD_DIR, SQLite storage only)")
+    
+    source_shard = source_shard or shard_router.shard_for(user_id)
+    if source_shard == target_shard:
+        return {"moved": False, "user_id": user_id, "shard": target_shard}
+    
+    source = connect_path(shard_router.shard_path(source_shard))
+    target = connect_path(shard_router.shard_path(target_shard))
+    source.row_factory = sqlite3.Row
+    src = source.cursor()
+    dst = target.cursor()
+    
+    try:
+        # Writes routed to the source wait until its rows are gone, instead of
+        # landing after the copy and being deleted with it
+        src.execute("BEGIN IMMEDIATE")
+        # Every book, including ones whose entries were archived (no TBRlist row left)
+        src.execute("""
+            SELECT b.book_id, b.title, b.page_count, b.publication_year, b.rating, b.isbn,
+                   a.name as author, g.genre, g.category
+            FROM Books b
+            JOIN Authors a ON b.author_id = a.author_id
+            JOIN Genres g ON b.genre_id = g.genre_id
+            WHERE b.user_id = ?
+            ORDER BY b.book_id
+        """, (user_id,))
+        books = [dict(row) for row in src.fetchall()]
+        src.execute("""
+            SELECT tbr_id, book_id, status_id, priority, date_added, date_completed
+            FROM TBRlist WHERE user_id = ? ORDER BY tbr_id
+        """, (user_id,))
+        entries = [dict(row) for row in src.fetchall()]
+        src.execute("""
+            SELECT g.*, ge.genre as genre_name, ge.category as genre_category
+            FROM ReadingGoals g
+            LEFT JOIN Genres ge ON g.target_genre_id = ge.genre_id
+            WHERE g.user_id = ?
+        """, (user_id,))
+        goals = [dict(row) for row in src.fetchall()]
+        src.execute("SELECT * FROM UserSettings WHERE user_id = ?", (user_id,))
+        settings = [dict(row) for row in src.fetchall()]
+        source_version = get_data_version(src)
+        
+        # Versions in the target must stay ahead of anything the client saw in the source
+        dst.execute("""
+            UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'ChangeLog'
+        """, (source_version,))
+        if dst.rowcount == 0:
+            dst.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('ChangeLog', ?)",
+                        (source_version,))
+        tombstones = ([('TBRlist', e['tbr_id']) for e in entries]
+                      + [('Books', book['book_id']) for book in books]
+                      + [('ReadingGoals', g['goal_id']) for g in goals])
+        dst.executemany("""
+            INSERT INTO ChangeLog (table_name, row_id, op, changed_at, user_id)
+            VALUES (?, ?, 'delete', datetime('now'), ?)
+        """, [(table, row_id, user_id) for table, row_id in tombstones])
+        
+        book_ids = {}
+        for book in books:
+            author_id = _get_or_create_id(dst, 'Authors', 'author_id', 'name', book['author'])
+            genre_id = get_or_create_genre_id(dst, book['genre'], book['category'])
+            dst.execute("""
+                INSERT INTO Books (title, author_id, genre_id, page_count,
+                                   publication_year, rating, isbn, user_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, (book['title'], author_id, genre_id, book['page_count'],
+                  book['publication_year'], book['rating'], book['isbn'], user_id))
+            book_ids[book['book_id']] = dst.lastrowid
+        dst.executemany("""
+            INSERT INTO TBRlist (user_id, book_id, status_id, priority,
+                                 date_added, date_completed)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(user_id, book_ids[entry['book_id']], entry['status_id'], entry['priority'],
+               entry['date_added'], entry['date_completed']) for entry in entries])
+        
+        for goal in goals:
+            genre_id = None
+            if goal['genre_name'] is not None:
+                genre_id = get_or_create_genre_id(dst, goal['genre_name'],
+                                                  goal['genre_category'])
+            dst.execute("""
+                INSERT INTO ReadingGoals (user_id, goal_type, target_value, target_book_id,
+                                          target_genre_id, start_date, end_date, completed, progress)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (user_id, goal['goal_type'], goal['target_value'],
+                  book_ids.get(goal['target_book_id']), genre_id, goal['start_date'],
+                  goal['end_date'], goal['completed'], goal['progress']))
+        
+        # Settings the user already has in the target are newer than the ones being moved
+        dst.execute("SELECT COUNT(*) FROM UserSettings WHERE user_id = ?", (user_id,))
+        if dst.fetchone()[0]:
+            settings = []
+        for row in settings:
+            row.pop('id', None)
+            columns = [c for c in row if c in load_orm().UserSettings.__table__.columns]
+            dst.execute(f"""
+                INSERT INTO UserSettings ({', '.join(columns)})
+                VALUES ({', '.join('?' for _ in columns)})
+            """, [row[c] for c in columns])
+        target.commit()
+        
+        if source_shard == ShardRouter.MAIN:
+            # ShardMap lives in the database we hold locked, so re-point in this transaction
+            src.execute("INSERT OR REPLACE INTO ShardMap (user_id, shard) VALUES (?, ?)",
+                        (user_id, target_shard))
+        else:
+            shard_router.assign(user_id, target_shard)
+        
+        for table in ('TBRlist', 'ReadingGoals', 'UserSettings', 'Books'):
+            src.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+        src.execute(ORPHAN_AUTHORS_DELETE_SQL)
+        src.execute(ORPHAN_GENRES_DELETE_SQL)
+        source.commit()
+        if source_shard == ShardRouter.MAIN:
+            shard_router.assign(user_id, target_shard)  # tells the other processes
+        
+        _library_snapshots.pop(user_id, None)
+        return {"moved": True, "user_id": user_id, "from": source_shard, "shard": target_shard,
+                "books": len(book_ids), "goals": len(goals)}
+    except Exception as e:
+        target.rollback()
+        source.rollback()
+        print(f"Error moving user {user_id} to shard {target_shard}: {str(e)}")
+        raise e
+    finally:
+        source.close()
+        target.close()
+
+def rebalance_shards(dry_run=True):
+    """Move every user whose shard differs from the default for the current SHARD_COUNT
+    (e.g. after SHARD_COUNT changes, or to drain the main database into shards)"""
+    if not shard_router.sharded:
+        raise ValueError("Sharding is not enabled (set TBR_SHARD_DIR, SQLite storage only)")
+    
+    moves = []
+    for path in shard_router.database_paths():
+        conn = connect_path(path)
+        try:
+            users = get_users_in_database(conn.cursor())
+        finally:
+            conn.close()
+        for user_id in users:
+            if path == shard_router.main_path() and shard_router.assigned_shard(user_id) is None:
+                # Data written before sharding was enabled
+                source = ShardRouter.MAIN
+            elif shard_router.shard_path(shard_router.shard_for(user_id)) == path:
+                source = shard_router.shard_for(user_id)
+            else:
+                # Rows left in a database the user is no longer routed to are stale copies
+                continue
+            target = shard_router.default_shard(user_id)
+            if source != target:
+                moves.append({"user_id": user_id, "from": source, "to": target})
+    
+    if not dry_run:
+        for move in moves:
+            move_user_prepared(move['user_id'], move['to'], move['from'])
+    return {"dry_run": dry_run, "moves": moves}
+
+# ================ Metadata Enrichment ================
+
+# Book columns a provider may fill in; values the user entered are never overwritten
+ENRICHED_FIELDS = ('isbn', 'page_count', 'publication_year')
+
+def normalize_isbn(isbn):
+    """ISBN digits (and check character X) without hyphens or spaces, or None"""
+    digits = re.sub(r'[^0-9X]', '', str(isbn or '').upper())
+    return digits or None
+
+def normalize_lookup(value):
+    """Case- and punctuation-insensitive form of a title or author for matching"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', (value or '').lower()).split())
+
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` operations per second, bursts up to `burst`"""
+    
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def try_acquire(self):
+        """Take a token if one is available; otherwise return seconds until one will be"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+    
+    def acquire(self):
+        """Block until a token is available"""
+        while (wait := self.try_acquire()) > 0:
+            time.sleep(wait)
+
+class LocalCatalogProvider:
+    """Book metadata from a local catalog, so enrichment works offline.
+    
+    The catalog is either a SQLite database with a `catalog` table or a .json, .jsonl or
+    .csv file; records have title and author plus any of isbn, page_count and
+    publication_year. Books are matched by ISBN first, then by title and author.
+    """
+    
+    name = 'catalog'
+    
+    def __init__(self, path):
+        self.path = path
+        self.sqlite = os.path.splitext(path)[1].lower() in ('.db', '.sqlite', '.sqlite3')
+        self._local = threading.local()
+        self._index = None
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['CATALOG_PATH']) if config['CATALOG_PATH'] else None
+    
+    def _connection(self):
+        # Read-only and one per worker thread
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+            conn.row_factory = sqlite3.Row
+            conn.create_function('normalize_isbn', 1, normalize_isbn, deterministic=True)
+            self._local.conn = conn
+        return conn
+    
+    def _file_index(self):
+        """Catalog file records by ('isbn', isbn) and ('title', title, author), loaded once"""
+        with self._lock:
+            if self._index is None:
+                index = {}
+                for record in read_import_file(self.path):
+                    if normalize_isbn(record.get('isbn')):
+                        index.setdefault(('isbn', normalize_isbn(record['isbn'])), record)
+                    index.setdefault(('title', normalize_lookup(record.get('title')),
+                                      normalize_lookup(record.get('author'))), record)
+                self._index = index
+            return self._index
+    
+    def lookup(self, title, author, isbn=None):
+        """Catalog record for a book as a dict of ENRICHED_FIELDS, or None"""
+        isbn = normalize_isbn(isbn)
+        if self.sqlite:
+            conn = self._connection()
+            row = None
+            if isbn:
+                # Stored as-is first (can use an index), then hyphenated/spaced forms
+                row = (conn.execute("SELECT * FROM catalog WHERE isbn = ? LIMIT 1",
+                                    (isbn,)).fetchone()
+                       or conn.execute("SELECT * FROM catalog WHERE normalize_isbn(isbn) = ? "
+                                       "LIMIT 1", (isbn,)).fetchone())
+            if row is None:
+                row = conn.execute("""
+                    SELECT * FROM catalog
+                    WHERE title = ? COLLATE NOCASE AND author = ? COLLATE NOCASE LIMIT 1
+                """, (title.strip(), author.strip())).fetchone()
+            record = dict(row) if row else None
+        else:
+            index = self._file_index()
+            record = index.get(('isbn', isbn)) if isbn else None
+            if record is None:
+                record = index.get(('title', normalize_lookup(title), normalize_lookup(author)))
+        if record is None:
+            return None
+        record = {field: record.get(field) for field in ENRICHED_FIELDS}
+        record['isbn'] = normalize_isbn(record['isbn'])
+        return record
+
+# Provider name (TBR_ENRICHMENT_PROVIDER) -> class with from_config(config) and
+# lookup(title, author, isbn); from_config returns None when the provider isn't set up
+METADATA_PROVIDERS = {
+    'catalog': LocalCatalogProvider,
+}
+
+class MetadataCache:
+    """Provider results in an in-memory LRU backed by a SQLite file, so lookups survive
+    restarts. Misses are stored too (as None), so unknown books aren't looked up again
+    until their entry is older than max_age_days."""
+    
+    def __init__(self, path, max_entries=4096, max_age_days=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = datetime.timedelta(days=max_age_days)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+    
+    def _disk(self):
+        # Called with the lock held; one connection shared by the worker threads
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS metadata_cache (
+                    key TEXT PRIMARY KEY, value TEXT, fetched_at TEXT
+                )
+            """)
+        return self._conn
+    
+    def _remember(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def get(self, key):
+        """(found, value) for a cached lookup"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return True, self._entries[key]
+            row = self._disk().execute(
+                "SELECT value, fetched_at FROM metadata_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return False, None
+            fetched_at = datetime.datetime.fromisoformat(row[1])
+            if datetime.datetime.now(datetime.timezone.utc) - fetched_at > self.max_age:
+                return False, None
+            value = json.loads(row[0])
+            self._remember(key, value)
+            return True, value
+    
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            conn = self._disk()
+            conn.execute("INSERT OR REPLACE INTO metadata_cache (key, value, fetched_at) "
+                         "VALUES (?, ?, ?)",
+                         (key, json.dumps(value),
+                          datetime.datetime.now(datetime.timezone.utc).isoformat()))
+            conn.commit()
+
+class MetadataEnricher:
+    """Fills missing book metadata in the background.
+    
+    Lookups run on a thread pool, go through the cache first and are rate limited
+    before they reach the provider. Only columns that are still NULL get written.
+    """
+    
+    def __init__(self, config):
+        self.config = config
+        self._provider = None
+        self._configured = False
+        self._executor = None
+        self._cache = None
+        self._limiter = None
+        self._lock = threading.Lock()
+    
+    @property
+    def provider(self):
+        with self._lock:
+            if not self._configured:
+                factory = METADATA_PROVIDERS[self.config['ENRICHMENT_PROVIDER']]
+                self._provider = factory.from_config(self.config)
+                self._configured = True
+            return self._provider
+    
+    def set_provider(self, provider):
+        """Use a provider instance directly, e.g. a stand-in catalog; None disables enrichment"""
+        with self._lock:
+            self._provider = provider
+            self._configured = True
+    
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.config['ENRICHMENT_WORKERS'],
+                                                    thread_name_prefix='enrich')
+                self._limiter = TokenBucket(self.config['ENRICHMENT_RATE'])
+            if self._cache is None:
+                self._cache = MetadataCache(self.config['ENRICHMENT_CACHE_PATH'],
+                                            self.config['ENRICHMENT_CACHE_SIZE'],
+                                            self.config['ENRICHMENT_CACHE_DAYS'])
+            return self._executor
+    
+    def submit(self, book_ids, user_id=1):
+        """Queue books for enrichment; returns their futures (empty when disabled)"""
+        if self.provider is None:
+            return []
+        pool = self._pool()
+        return [pool.submit(self.enrich_book, book_id, user_id) for book_id in book_ids]
+    
+    def lookup(self, title, author, isbn=None):
+        """Provider record for a book through the cache and the rate limiter"""
+        provider = self.provider
+        key = (f"{provider.name}:isbn:{isbn}" if isbn else
+               f"{provider.name}:title:{normalize_lookup(title)}|{normalize_lookup(author)}")
+        found, record = self._cache.get(key)
+        if not found:
+            self._limiter.acquire()
+            record = provider.lookup(title, author, isbn)
+            self._cache.put(key, record)
+        return record
+    
+    def enrich_book(self, book_id, user_id=1):
+        """Look up one book and fill its missing fields; returns what was written"""
+        try:
+            conn = connect_db(user_id)
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT b.title, a.name, b.isbn, b.page_count, b.publication_year
+                    FROM Books b
+                    JOIN Authors a ON b.author_id = a.author_id
+                    WHERE b.book_id = ? AND b.user_id = ?
+                """, (book_id, user_id))
+                row = cursor.fetchone()
+                if row is None or None not in row[2:]:
+                    return {}
+                title, author, isbn = row[0], row[1], row[2]
+                current = dict(zip(ENRICHED_FIELDS, row[2:]))
+                
+                record = self.lookup(title, author, isbn)
+                if not record and isbn:
+                    # An ISBN the catalog doesn't know may still match by title and author
+                    record = self.lookup(title, author)
+                updates = {field: value for field, value in (record or {}).items()
+                           if current[field] is None and value is not None}
+                if not updates:
+                    return {}
+                
+                # COALESCE keeps anything the user saved while the lookup was running
+                assignments = ', '.join(f"{field} = COALESCE({field}, ?)" for field in updates)
+                cursor.execute(f"UPDATE Books SET {assignments} WHERE book_id = ? AND user_id = ?",
+                               (*updates.values(), book_id, user_id))
+                conn.commit()
+                return updates
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Error enriching book {book_id}: {str(e)}")
+            raise
+    
+    def missing_book_ids(self, user_id=1, after_book_id=0):
+        """Books of a user (newer than after_book_id) with an ENRICHED_FIELDS column empty"""
+        conn = connect_db(user_id)
+        try:
+            missing = ' OR '.join(f"{field} IS NULL" for field in ENRICHED_FIELDS)
+            rows = conn.execute(f"SELECT book_id FROM Books WHERE user_id = ? AND book_id > ? "
+                                f"AND ({missing})", (user_id, after_book_id)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+metadata_enricher = MetadataEnricher(app.config)
+
+# ================ Similar Books (Vector Index) ================
+
+# Hashed features per book: title words and character trigrams, plus author, genre and
+# category, each with its weight in the vector
+SIMILAR_FEATURE_WEIGHTS = {'word': 1.0, 'trigram': 0.5, 'author': 2.0, 'genre': 1.5,
+                           'category': 1.0}
+
+# Candidate rows scored per matrix product, bounding temporary memory on huge libraries
+SIMILAR_BLOCK_ROWS = 65536
+
+# Requests catch the index up from the change log only this far; bigger gaps (bulk
+# imports) are left to a background sync
+SIMILAR_REQUEST_MAX_CHANGES = 1000
+
+_numpy_checked = False
+
+def load_numpy():
+    """numpy on first use, or None when it isn't installed (pure-Python scoring then)"""
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy as module
+            numpy = module
+        except ImportError:
+            pass
+        _numpy_checked = True
+    return numpy
+
+def book_features(title, author, genre, category):
+    """(token, weight) pairs describing a book"""
+    weights = SIMILAR_FEATURE_WEIGHTS
+    title = normalize_lookup(title)
+    features = [(f"word:{word}", weights['word']) for word in title.split()]
+    padded = f" {title} "
+    features += [(f"tri:{padded[i:i + 3]}", weights['trigram']) for i in range(len(padded) - 2)]
+    for kind, value in (('author', author), ('genre', genre), ('category', category)):
+        if value:
+            features.append((f"{kind}:{normalize_lookup(value)}", weights[kind]))
+    return features
+
+def book_vector(title, author, genre, category, dimensions):
+    """Unit-length signed feature-hashing vector of a book as array('f')"""
+    vector = [0.0] * dimensions
+    for token, weight in book_features(title, author, genre, category):
+        h = zlib.crc32(token.encode('utf-8'))
+        # The high bit picks the sign so colliding features tend to cancel out
+        vector[h % dimensions] += weight if h & 0x80000000 else -weight
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return array('f', [v / norm for v in vector])
+
+SIMILAR_BOOKS_SQL = """
+    SELECT b.book_id, b.user_id, b.title, a.name as author, g.genre, g.category
+    FROM Books b
+    JOIN Authors a ON b.author_id = a.author_id
+    JOIN Genres g ON b.genre_id = g.genre_id
+"""
+
+class SimilarityIndex:
+    """Feature vectors of one database's books in memory-mapped files.
+    
+    <name>.vec holds a float32 row per book, <name>.ids the (book_id, user_id) pair of
+    each row and <name>.json the ChangeLog version the files reflect. Each query first
+    applies the Books, Authors and Genres changes logged since that version, so adds,
+    edits, imports and deletes reach the index row by row instead of through a rebuild.
+    Writers hold an flock on <name>.lock, and every process reloads the files when
+    <name>.json is replaced by another one.
+    """
+    
+    DELETED = -1  # user_id of a row whose book is gone
+    
+    def __init__(self, base, dimensions):
+        self.base = base
+        self.dimensions = dimensions
+        self.version = None
+        self.rows = {}           # book_id -> row number
+        self.ids = array('q')    # book_id, user_id per row
+        self._vectors = None     # mmap of the .vec file
+        self._json_id = None     # (inode, mtime) of the .json file we last read or wrote
+        self._lock = threading.Lock()
+    
+    def _path(self, extension):
+        return f"{self.base}.{extension}"
+    
+    def _stat_json(self):
+        try:
+            stat = os.stat(self._path('json'))
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+    
+    def _changed_on_disk(self):
+        return self._stat_json() != self._json_id
+    
+    @contextlib.contextmanager
+    def _locked_files(self):
+        """Exclusive access to the files across processes (where flock exists)"""
+        os.makedirs(os.path.dirname(self.base), exist_ok=True)
+        with open(self._path('lock'), 'w') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+    
+    def _map(self):
+        if self._vectors is not None:
+            self._vectors.close()
+            self._vectors = None
+        if len(self.ids):
+            with open(self._path('vec'), 'rb') as f:
+                self._vectors = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    
+    def _save_version(self, version):
+        self.version = version
+        temp = self._path('json.tmp')
+        with open(temp, 'w') as f:
+            json.dump({"version": version, "dimensions": self.dimensions}, f)
+        os.replace(temp, self._path('json'))
+        self._json_id = self._stat_json()
+    
+    def _load(self):
+        """Open the files left by an earlier process; False if there are none to use"""
+        json_id = self._stat_json()
+        try:
+            with open(self._path('json')) as f:
+                meta = json.load(f)
+            if meta['dimensions'] != self.dimensions:
+                return False
+            ids = array('q')
+            with open(self._path('ids'), 'rb') as f:
+                ids.frombytes(f.read())
+            # A crash between the two appends can leave one file a row ahead
+            count = min(len(ids) // 2,
+                        os.path.getsize(self._path('vec')) // (4 * self.dimensions))
+        except (OSError, ValueError, KeyError):
+            return False
+        del ids[2 * count:]
+        self.ids = ids
+        self.rows = {}
+        for row in range(count):
+            book_id = ids[2 * row]
+            if book_id in self.rows:
+                ids[2 * self.rows[book_id] + 1] = self.DELETED
+            self.rows[book_id] = row
+        self.version = meta['version']
+        self._json_id = json_id
+        self._map()
+        return True
+    
+    def _rebuild(self, cursor, version):
+        """Write every book's vector to fresh files"""
+        ids = array('q')
+        rows = {}
+        cursor.execute(SIMILAR_BOOKS_SQL)
+        with open(self._path('vec.tmp'), 'wb') as vec:
+            for book_id, user_id, title, author, genre, category in cursor:
+                rows[book_id] = len(ids) // 2
+                ids.extend((book_id, user_id))
+                vec.write(book_vector(title, author, genre, category, self.dimensions).tobytes())
+        with open(self._path('ids.tmp'), 'wb') as f:
+            ids.tofile(f)
+        if self._vectors is not None:
+            self._vectors.close()
+            self._vectors = None
+        os.replace(self._path('vec.tmp'), self._path('vec'))
+        os.replace(self._path('ids.tmp'), self._path('ids'))
+        self.ids, self.rows = ids, rows
+        self._map()
+        self._save_version(version)
+    
+    def _apply(self, books, deleted):
+        """Overwrite or append rows for changed books and mark deleted ones"""
+        row_bytes = 4 * self.dimensions
+        with open(self._path('vec'), 'r+b') as vec, open(self._path('ids'), 'r+b') as ids_file:
+            for book_id, user_id, title, author, genre, category in books:
+                row = self.rows.get(book_id)
+                if row is None:
+                    row = self.rows[book_id] = len(self.ids) // 2
+                    self.ids.extend((book_id, user_id))
+                self.ids[2 * row + 1] = user_id
+                vec.seek(row * row_bytes)
+                vec.write(book_vector(title, author, genre, category, self.dimensions).tobytes())
+                ids_file.seek(row * 16)
+                ids_file.write(array('q', (book_id, user_id)).tobytes())
+            for book_id in deleted:
+                row = self.rows.pop(book_id, None)
+                if row is not None:
+                    self.ids[2 * row + 1] = self.DELETED
+                    ids_file.seek(row * 16)
+                    ids_file.write(array('q', (book_id, self.DELETED)).tobytes())
+        self._map()
+    
+    def rebuild(self, cursor):
+        """Recompute every vector (the CLI and background builds; never a request)"""
+        version = get_data_version(cursor)
+        with self._lock, self._locked_files():
+            self._rebuild(cursor, version)
+    
+    def sync(self, cursor, max_changes=None):
+        """Bring the index up to the database's current data version.
+        
+        Returns False, leaving the index as it is, when that takes a full rebuild or more
+        than max_changes book, author or genre change log entries (None: no limit,
+        rebuild if needed).
+        """
+        version = get_data_version(cursor)
+        with self._lock:
+            if (self.version is not None and self.version >= version
+                    and not self._changed_on_disk()):
+                return True
+            with self._locked_files():
+                # Another process may have moved the files on while we waited
+                if (self.version is None or self._changed_on_disk()) and not self._load():
+                    if max_changes is not None:
+                        return False
+                    self._rebuild(cursor, version)
+                    return True
+                if self.version >= version:
+                    return True
+                return self._catch_up(cursor, version, max_changes)
+    
+    def _catch_up(self, cursor, version, max_changes):
+        """Apply the change log from our version to `version` (files locked)"""
+        cursor.execute("SELECT compacted_through FROM SyncState WHERE id = 1")
+        state = cursor.fetchone()
+        if self.version < (state[0] if state else 0):
+            # The log no longer covers our version
+            if max_changes is not None:
+                return False
+            self._rebuild(cursor, version)
+            return True
+        
+        # Only book, author and genre changes count towards max_changes: goal or
+        # status churn from other users moves the data version but not the index
+        sql = """
+            SELECT table_name, row_id, op FROM ChangeLog
+            WHERE change_id > ? AND change_id <= ?
+            AND table_name IN ('Books', 'Authors', 'Genres')
+        """
+        params = (self.version, version)
+        if max_changes is not None:
+            sql += " ORDER BY change_id LIMIT ?"
+            params += (max_changes + 1,)
+        cursor.execute(sql, params)
+        entries = cursor.fetchall()
+        if max_changes is not None and len(entries) > max_changes:
+            return False
+        changed = {'Books': set(), 'Authors': set(), 'Genres': set()}
+        for table, row_id, op in entries:
+            changed[table].add(row_id)
+        
+        # Renamed authors and genres change the features of all their books
+        for table, column in (('Authors', 'author_id'), ('Genres', 'genre_id')):
+            for chunk in chunked(changed[table]):
+                placeholders = ','.join('?' * len(chunk))
+                cursor.execute(f"SELECT book_id FROM Books WHERE {column} IN ({placeholders})",
+                               chunk)
+                changed['Books'].update(row[0] for row in cursor.fetchall())
+        
+        books = []
+        for chunk in chunked(changed['Books']):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(SIMILAR_BOOKS_SQL + f" WHERE b.book_id IN ({placeholders})", chunk)
+            books += cursor.fetchall()
+        # Changed books that no longer exist were deleted
+        deleted = changed['Books'] - {book[0] for book in books}
+        
+        self._apply(books, deleted)
+        self._save_version(version)
+        return True
+    
+    def similar(self, book_id, user_id, limit=10):
+        """(score, book_id) of the user's books closest to book_id, best first"""
+        with self._lock:
+            row = self.rows.get(book_id)
+            if row is None or self.ids[2 * row + 1] != user_id or limit <= 0:
+                return []
+            np = load_numpy()
+            if np is not None:
+                return self._similar_numpy(np, row, user_id, limit)
+            
+            dimensions = self.dimensions
+            with memoryview(self._vectors) as raw, raw.cast('f') as vectors:
+                # A book only hashes into a few dimensions, so only those need multiplying
+                query = [(d, value) for d, value in
+                         enumerate(vectors[row * dimensions:(row + 1) * dimensions]) if value]
+                ids = self.ids
+                scored = ((sum(vectors[other * dimensions + d] * value for d, value in query),
+                           ids[2 * other])
+                          for other in range(len(ids) // 2)
+                          if ids[2 * other + 1] == user_id and other != row)
+                return heapq.nlargest(limit, scored, key=lambda match: (match[0], -match[1]))
+    
+    def _similar_numpy(self, np, row, user_id, limit):
+        count = len(self.ids) // 2
+        vectors = np.frombuffer(self._vectors, dtype=np.float32,
+                                count=count * self.dimensions).reshape(count, self.dimensions)
+        pairs = np.frombuffer(self.ids, dtype=np.int64).reshape(count, 2)
+        candidates = np.flatnonzero(pairs[:, 1] == user_id)
+        query = np.array(vectors[row])
+        
+        # Keep each block's top `limit`, then pick the overall best among those
+        best_rows, best_scores = [], []
+        dense = len(candidates) * 8 > count
+        for start in range(0, count if dense else len(candidates), SIMILAR_BLOCK_ROWS):
+            if dense:
+                # Most rows are the user's: multiply contiguous slices, no gather copies
+                block = np.arange(start, min(start + SIMILAR_BLOCK_ROWS, count))
+                scores = vectors[start:start + SIMILAR_BLOCK_ROWS] @ query
+                keep = (pairs[start:start + SIMILAR_BLOCK_ROWS, 1] == user_id) & (block != row)
+                block, scores = block[keep], scores[keep]
+            else:
+                block = candidates[start:start + SIMILAR_BLOCK_ROWS]
+                block = block[block != row]
+                scores = vectors[block] @ query
+            if len(scores) > limit:
+                top = np.argpartition(-scores, limit)[:limit]
+                block, scores = block[top], scores[top]
+            best_rows.append(block)
+            best_scores.append(scores)
+        if not best_rows:
+            return []
+        rows = np.concatenate(best_rows)
+        scores = np.concatenate(best_scores)
+        book_ids = pairs[rows, 0]
+        order = np.lexsort((book_ids, -scores))[:limit]
+        return [(float(scores[i]), int(book_ids[i])) for i in order]
+
+_similarity_indexes = {}
+_similarity_lock = threading.Lock()
+_similarity_builds = set()      # database paths with a background sync queued
+_similarity_builder = None
+
+def get_similarity_index(path):
+    """The (lazily loaded) similarity index of one database"""
+    with _similarity_lock:
+        index = _similarity_indexes.get(path)
+        if index is None:
+            name = os.path.splitext(shard_router.database_label(path))[0]
+            index = SimilarityIndex(os.path.join(app.config['SIMILAR_INDEX_DIR'], name),
+                                    app.config['SIMILAR_DIMENSIONS'])
+            _similarity_indexes[path] = index
+        return index
+
+def build_similarity_index(path, rebuild=False):
+    """Catch one database's similar-books index up (rebuilding only if it must), or
+    rebuild it from scratch"""
+    conn = connect_path(path)
+    try:
+        index = get_similarity_index(path)
+        if rebuild:
+            index.rebuild(conn.cursor())
+        else:
+            index.sync(conn.cursor())
+    finally:
+        conn.close()
+
+def schedule_similarity_build(path):
+    """Queue a background sync of a database's index (once, however often asked)"""
+    global _similarity_builder
+    with _similarity_lock:
+        if path in _similarity_builds:
+            return
+        _similarity_builds.add(path)
+        if _similarity_builder is None:
+            _similarity_builder = ThreadPoolExecutor(1, thread_name_prefix='similar-index')
+    
+    def build():
+        try:
+            build_similarity_index(path)
+        except Exception as e:
+            print(f"Error building similar-books index: {str(e)}")
+        finally:
+            with _similarity_lock:
+                _similarity_builds.discard(path)
+    
+    _similarity_builder.submit(build)
+
+def get_similar_books_prepared(book_id, user_id=1, limit=10):
+    """A user's books most like book_id by title, author, genre and category.
+    
+    Returns None while the index is missing or far behind the change log; a background
+    sync is queued instead of building inside the request.
+    """
+    path = shard_router.path_for(user_id)
+    conn = connect_path(path)
+    try:
+        cursor = conn.cursor()
+        index = get_similarity_index(path)
+        if not index.sync(cursor, SIMILAR_REQUEST_MAX_CHANGES):
+            schedule_similarity_build(path)
+            return None
+        matches = index.similar(book_id, user_id, limit)
+        if not matches:
+            return []
+        
+        placeholders = ','.join('?' * len(matches))
+        cursor.execute(SIMILAR_BOOKS_SQL + f" WHERE b.book_id IN ({placeholders})",
+                       [match_id for _, match_id in matches])
+        books = {row[0]: row for row in cursor.fetchall()}
+    finally:
+        conn.close()
+    
+    return [{
+        "book_id": match_id,
+        "title": books[match_id][2],
+        "author": books[match_id][3],
+        "genre": books[match_id][4],
+        "category": books[match_id][5],
+        "score": round(score, 4)
+    } for score, match_id in matches if match_id in books]
+
+# ================ Reading History Archive ================
+
+# Finished entries (Completed, Did Not Finish) are the ones that get archived
+ARCHIVED_STATUSES = (1, 4)
+
+# One file per column; strings are length-prefixed by end offsets into a .dat file
+ARCHIVE_INT_COLUMNS = ('tbr_id', 'book_id', 'user_id', 'status_id', 'priority',
+                       'page_count', 'publication_year', 'rating')
+ARCHIVE_STR_COLUMNS = ('title', 'author', 'genre', 'category', 'status',
+                       'date_added', 'date_completed', 'isbn')
+
+# TBR entries due for archiving, denormalized so the archive stands on its own
+ARCHIVE_SELECT_SQL = """
+    SELECT t.tbr_id, b.book_id, t.user_id, t.status_id, t.priority,
+    b.page_count, b.publication_year, b.rating,
+    b.title, a.name as author, g.genre, g.category, rs.status,
+    t.date_added, t.date_completed, b.isbn
+    FROM TBRlist t
+    JOIN Books b ON t.book_id = b.book_id
+    JOIN Authors a ON b.author_id = a.author_id
+    JOIN Genres g ON b.genre_id = g.genre_id
+    JOIN "Reading Status" rs ON t.status_id = rs.status_id
+    WHERE t.status_id IN (1, 4) AND t.date_completed IS NOT NULL AND t.date_completed < ?
+    AND t.tbr_id > ?
+    ORDER BY t.tbr_id
+    LIMIT ?
+"""
+
+class ReadingArchive:
+    """Append-only columnar store of finished reading history, read through mmap.
+    
+    Every column is its own file: int64 values ('NULL' as INT_NULL) or end offsets into
+    a bytes file. Each append is sorted by user, so a user's rows form one [start, end)
+    range per batch. meta.json is the commit point: it holds the committed row count and
+    per-user summaries (entries by status, pages read, completions per year, row ranges)
+    so neither stats nor exports have to scan other users' rows.
+    """
+    
+    INT_NULL = -2 ** 63
+    
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._meta = None
+        self._meta_mtime = None
+    
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+    
+    @contextlib.contextmanager
+    def _writing(self):
+        """Exclusive access across threads and (where flock exists) processes"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path('archive.lock'), 'w') as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                self._meta_mtime = None  # another process may have written meanwhile
+                # Writers edit a copy; readers only ever see meta that _commit() published
+                yield copy.deepcopy(self.meta())
+    
+    def meta(self):
+        """Committed state, reloaded whenever another process commits"""
+        try:
+            mtime = os.stat(self._path('meta.json')).st_mtime_ns
+        except OSError:
+            return {"rows": 0, "summary": {}, "pending": {}}
+        if mtime != self._meta_mtime:
+            with open(self._path('meta.json')) as f:
+                self._meta = json.load(f)
+            self._meta_mtime = mtime
+        return self._meta
+    
+    def _commit(self, meta):
+        temp = self._path('meta.json.tmp')
+        with open(temp, 'w') as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self._path('meta.json'))
+        self._meta = meta
+        self._meta_mtime = os.stat(self._path('meta.json')).st_mtime_ns
+    
+    def _map(self, stack, filename, format=None):
+        """mmap a column file for the life of stack, as bytes or cast to format"""
+        f = stack.enter_context(open(self._path(filename), 'rb'))
+        if not os.fstat(f.fileno()).st_size:
+            return memoryview(b'').cast(format) if format else b''
+        mapped = stack.enter_context(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        if not format:
+            return mapped
+        # Views are released (LIFO) before the map closes
+        view = stack.enter_context(memoryview(mapped))
+        return stack.enter_context(view.cast(format))
+    
+    def append(self, rows, pending_key=None, pending_ids=()):
+        """Append rows (tuples in ARCHIVE_INT_COLUMNS + ARCHIVE_STR_COLUMNS order).
+        
+        pending_ids are recorded under pending_key in the same commit, so a move can be
+        finished by complete_pending() if the process dies before the source rows go.
+        """
+        with self._writing() as meta:
+            count = meta['rows']
+            columns = ARCHIVE_INT_COLUMNS + ARCHIVE_STR_COLUMNS
+            rows = sorted(rows, key=lambda row: (row[2], row[0]))  # user_id, tbr_id
+            for position, name in enumerate(columns):
+                values = [row[position] for row in rows]
+                if name in ARCHIVE_INT_COLUMNS:
+                    self._append_ints(f"{name}.col", count,
+                                      [self.INT_NULL if v is None else int(v) for v in values])
+                else:
+                    self._append_strs(name, count, values)
+            
+            summary = meta['summary']
+            for position, row in enumerate(rows, count):
+                entry = dict(zip(columns, row))
+                user = summary.setdefault(str(entry['user_id']), {
+                    "by_status": {}, "pages_read": 0, "completed_by_year": {}, "ranges": []})
+                ranges = user['ranges']
+                if ranges and ranges[-1][1] == position:
+                    ranges[-1][1] = position + 1
+                else:
+                    ranges.append([position, position + 1])
+                user['by_status'][entry['status']] = user['by_status'].get(entry['status'], 0) + 1
+                if entry['status_id'] == 1:
+                    user['pages_read'] += entry['page_count'] or 0
+                    year = (entry['date_completed'] or '')[:4]
+                    user['completed_by_year'][year] = user['completed_by_year'].get(year, 0) + 1
+            meta['rows'] = count + len(rows)
+            if pending_key is not None:
+                meta['pending'][pending_key] = list(pending_ids)
+            self._commit(meta)
+    
+    def _append_ints(self, filename, count, values):
+        with open(self._path(filename), 'a+b') as f:
+            # Bytes past the committed row count are leftovers of an interrupted append
+            f.truncate(8 * count)
+            array('q', values).tofile(f)
+            f.flush()
+            os.fsync(f.fileno())
+    
+    def _append_strs(self, name, count, values):
+        end = 0
+        if count:
+            # The committed row's end offset is where the string data ends
+            with open(self._path(f"{name}.off"), 'rb') as f:
+                f.seek(8 * (count - 1))
+                end = array('q', f.read(8))[0]
+        offsets = array('q')
+        with open(self._path(f"{name}.dat"), 'a+b') as f:
+            f.truncate(end)
+            for value in values:
+                # A leading 0 byte marks NULL, 1 a (possibly empty) string
+                encoded = b'\x00' if value is None else b'\x01' + str(value).encode('utf-8')
+                f.write(encoded)
+                end += len(encoded)
+                offsets.append(end)
+            f.flush()
+            os.fsync(f.fileno())
+        self._append_ints(f"{name}.off", count, offsets)
+    
+    def complete_pending(self, pending_key, delete):
+        """Finish an interrupted move: delete(ids) the rows archived under pending_key"""
+        with self._writing() as meta:
+            ids = meta['pending'].pop(pending_key, None)
+            if ids is None:
+                return 0
+            delete(ids)
+            self._commit(meta)
+            return len(ids)
+    
+    def clear_user(self, user_id):
+        """Hide everything archived so far for a user (the files stay append-only)"""
+        if not self.meta()['summary'].get(str(user_id)):
+            return
+        with self._writing() as meta:
+            meta['summary'].pop(str(user_id), None)
+            self._commit(meta)
+    
+    def summary(self, user_id=None):
+        """A user's archived totals, or totals across all users"""
+        summaries = self.meta()['summary']
+        if user_id is not None:
+            return summaries.get(str(user_id))
+        total = {"entries": 0, "by_status": Counter(), "pages_read": 0}
+        for user in summaries.values():
+            total['by_status'].update(user['by_status'])
+            total['pages_read'] += user['pages_read']
+        total['entries'] = sum(total['by_status'].values())
+        total['by_status'] = dict(total['by_status'])
+        return total
+    
+    def iter_rows(self, user_id, status_id=None):
+        """A user's archived entries, newest first, shaped like get_tbr_items_orm() rows"""
+        user = self.meta()['summary'].get(str(user_id))
+        if not user:
+            return
+        with contextlib.ExitStack() as stack:
+            statuses = self._map(stack, 'status_id.col', 'q')
+            matches = [i for start, end in reversed(user['ranges'])
+                       for i in range(end - 1, start - 1, -1)
+                       if status_id is None or statuses[i] == status_id]
+            ints = {name: self._map(stack, f"{name}.col", 'q')
+                    for name in ('tbr_id', 'book_id', 'priority', 'page_count',
+                                 'publication_year', 'rating')}
+            strs = {name: (self._map(stack, f"{name}.off", 'q'), self._map(stack, f"{name}.dat"))
+                    for name in ARCHIVE_STR_COLUMNS}
             
-        if not update_parts:
-            return False  # Nothing to update
+            def text(name, i):
+                ends, data = strs[name]
+                raw = data[ends[i - 1] if i else 0:ends[i]]
+                return None if raw[:1] == b'\x00' else raw[1:].decode('utf-8')
             
-        # Add the goal_id to the parameters
-        params.append(goal_id)
-        
-        cursor.execute(
-            f"UPDATE ReadingGoals SET {', '.join(update_parts)} WHERE goal_id = ?", 
-            params
-        )
-        
-        conn.commit()
-        return True
-        
-    except Exception as e:
-        conn.rollback()
-        print(f"Error updating goal progress with prepared statement: {str(e)}")
-        raise e
-    finally:
-        conn.close()
+            def number(name, i):
+                value = ints[name][i]
+                return None if value == self.INT_NULL else value
+            
+            for i in matches:
+                yield {
+                    "tbr_id": number('tbr_id', i),
+                    "book_id": number('book_id', i),
+                    "title": text('title', i),
+                    "author": text('author', i),
+                    "genre": text('genre', i),
+                    "category": text('category', i),
+                    "status": text('status', i),
+                    "priority": number('priority', i),
+                    "date_added": text('date_added', i),
+                    "date_completed": text('date_completed', i),
+                    "page_count": number('page_count', i),
+                    "publication_year": number('publication_year', i),
+                    "rating": number('rating', i),
+                    "isbn": text('isbn', i)
+                }
 
-def delete_reading_goal_prepared(goal_id):
-    """Delete a reading goal using prepared statements"""
-    conn = sqlite3.connect('tbrlist.db')
+reading_archive = ReadingArchive(app.config['ARCHIVE_DIR'])
+
+def months_ago(months, today=None):
+    """ISO date `months` calendar months before today (day clamped to the month's end)"""
+    today = today or datetime.date.today()
+    month_index = today.year * 12 + today.month - 1 - months
+    year, month = divmod(month_index, 12)
+    month += 1
+    next_month = datetime.date(year + month // 12, month % 12 + 1, 1)
+    last_day = (next_month - datetime.timedelta(days=1)).day
+    return datetime.date(year, month, min(today.day, last_day)).isoformat()
+
+def archive_reading_history_prepared(months=None, db_path=None, batch_size=5000):
+    """Move finished entries older than `months` from one database's TBRlist to the archive.
+    
+    Each batch is appended (and committed) to the archive with its tbr_ids marked pending
+    before the rows are deleted, so a crash can repeat a delete but never lose history.
+    """
+    path = db_path or shard_router.main_path()
+    pending_key = shard_router.database_label(path)
+    cutoff = months_ago(app.config['ARCHIVE_AFTER_MONTHS'] if months is None else months)
+    
+    conn = connect_path(path)
     cursor = conn.cursor()
     
-    try:
-        cursor.execute("DELETE FROM ReadingGoals WHERE goal_id = ?", (goal_id,))
+    def delete(tbr_ids):
+        for chunk in chunked(tbr_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"DELETE FROM TBRlist WHERE tbr_id IN ({placeholders})", chunk)
         conn.commit()
-        return True
-    except Exception as e:
-        conn.rollback()
-        print(f"Error deleting reading goal with prepared statement: {str(e)}")
-        raise e
+    
+    try:
+        archived = 0
+        reading_archive.complete_pending(pending_key, delete)
+        last_id = 0
+        while True:
+            cursor.execute(ARCHIVE_SELECT_SQL, (cutoff, last_id, batch_size))
+            rows = [tuple(row) for row in cursor.fetchall()]
+            conn.commit()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            if shard_router.sharded:
+                # Leftovers of users who moved to another shard aren't theirs to see anymore
+                rows = [row for row in rows if shard_router.path_for(row[2]) == path]
+                if not rows:
+                    continue
+            tbr_ids = [row[0] for row in rows]
+            reading_archive.append(rows, pending_key, tbr_ids)
+            reading_archive.complete_pending(pending_key, delete)
+            archived += len(rows)
+        return {"archived": archived, "cutoff": cutoff}
     finally:
         conn.close()
 
+def add_archived_stats(stats, user_id):
+    """Fold a user's archived history into /api/stats figures computed from TBRlist"""
+    archived = reading_archive.summary(user_id)
+    if not archived:
+        return stats
+    by_status = Counter(stats['books_by_status'])
+    by_status.update(archived['by_status'])
+    stats['books_by_status'] = dict(by_status)
+    stats['completed_this_year'] += archived['completed_by_year'].get(
+        str(datetime.datetime.now().year), 0)
+    stats['total_pages_read'] += archived['pages_read']
+    return stats
+
+def get_export_status_counts(user_id=1):
+    """Entries per status for the journal export, live and archived"""
+    counts = Counter(dict(get_status_counts_orm(user_id)))
+    counts.update((reading_archive.summary(user_id) or {}).get('by_status', {}))
+    return list(counts.items())
+
+def iter_export_books(user_id=1, batch_size=500):
+    """Live TBR entries with archived history merged in after them, status by status"""
+    ranks = dict(get_session(user_id).execute(
+        orm.select(orm.ReadingStatus.status, orm.ReadingStatus.status_id)).all())
+    archived = itertools.chain.from_iterable(
+        reading_archive.iter_rows(user_id, status_id) for status_id in ARCHIVED_STATUSES)
+    return heapq.merge(iter_tbr_items_orm(user_id, batch_size), archived,
+                       key=lambda book: ranks.get(book['status'], 0))
+
+# ================ Rate Limiting and Request Coalescing ================
+
+def parse_rate_limits(spec):
+    """'/api/stats=120/60,...' -> {route: (requests, seconds)}"""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        route, _, limit = item.partition('=')
+        requests, _, seconds = limit.partition('/')
+        limits[route.strip()] = (int(requests), float(seconds or 1))
+    return limits
+
+class RateLimiter:
+    """A TokenBucket per (route, client), kept in an LRU so idle clients get dropped"""
+    
+    def __init__(self, config):
+        self.config = config
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @functools.cached_property
+    def limits(self):
+        return parse_rate_limits(self.config['RATE_LIMITS'])
+    
+    def check(self, route, client):
+        """Seconds until the client may call route again, 0 if this call is allowed"""
+        limit = self.limits.get(route)
+        if limit is None:
+            return 0
+        key = (route, client)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                requests, seconds = limit
+                bucket = self._buckets[key] = TokenBucket(requests / seconds, requests)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.config['RATE_LIMIT_CLIENTS']:
+                self._buckets.popitem(last=False)
+        return bucket.try_acquire()
+
+rate_limiter = RateLimiter(app.config)
+
+@app.before_request
+def enforce_rate_limits():
+    if request.url_rule is None:
+        return None
+    wait = rate_limiter.check(request.url_rule.rule, request.remote_addr)
+    if wait:
+        response = jsonify({"error": "Rate limit exceeded", "retry_after": round(wait, 1)})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(math.ceil(wait))
+        return response
+    return None
+
+class SingleFlight:
+    """Concurrent calls with the same key run once; everyone waiting gets that result"""
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+    
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+        if not leader:
+            call['done'].wait()
+            if 'error' in call:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn()
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+request_flights = SingleFlight()
+
+def coalesce_gets(view):
+    """Share one run of an expensive GET view among identical concurrent requests.
+    
+    Identical means same path, query string and user. The leader's response is frozen
+    to (body, status, headers) before after_request hooks, and every request (the leader
+    included) gets its own copy so compression and headers apply per request.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not app.config['COALESCE_REQUESTS'] or request.method != 'GET':
+            return view(*args, **kwargs)
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+               get_current_user_id())
+        
+        def run():
+            response = app.make_response(view(*args, **kwargs))
+            return response.get_data(), response.status_code, list(response.headers.items())
+        
+        body, status, headers = request_flights.do(key, run)
+        return app.response_class(body, status=status, headers=headers)
+    return wrapper
+
+# Last backup per database: (backup file, created at)
+_recent_backups = {}
+_backup_locks = {}
+_backup_locks_lock = threading.Lock()
+
+def backup_database_debounced(path):
+    """Back up a database unless a recent backup can be handed out instead.
+    
+    The previous backup is reused while it is younger than BACKUP_DEBOUNCE_SECONDS; not
+    every table is in the ChangeLog, so "nothing changed since" can't be told reliably.
+    Concurrent requests for the same database wait for one backup rather than each
+    writing a copy. Returns (file, reused).
+    """
+    with _backup_locks_lock:
+        lock = _backup_locks.setdefault(path, threading.Lock())
+    with lock:
+        recent = _recent_backups.get(path)
+        if recent is not None and os.path.exists(recent[0]):
+            backup_file, created_at = recent
+            if time.monotonic() - created_at < app.config['BACKUP_DEBOUNCE_SECONDS']:
+                return backup_file, True
+        
+        # Create a timestamp for the backup file
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        
+        # Server databases are dumped in pg_dump's custom (compressed) format
+        backup_file = f"tbrlist_backup_{timestamp}.{'dump' if shard_router.postgres else 'db'}"
+        backup_database(path, backup_file)
+        _recent_backups[path] = (backup_file, time.monotonic())
+        return backup_file, False
+
 # ================ API Routes ================
 
+def parse_user_id(value):
+    """Positive integer user id, or None if the value is not one"""
+    try:
+        user_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    return user_id if user_id > 0 else None
+
+@app.before_request
+def load_current_user_id():
+    """Resolve the request's user once; a malformed id is rejected, not defaulted"""
+    value = request.headers.get('X-User-Id', request.args.get('user_id'))
+    if value is None:
+        g.user_id = 1
+        return None
+    g.user_id = parse_user_id(value)
+    if g.user_id is None:
+        return jsonify({"error": f"Invalid user id: {value!r}"}), 400
+    return None
+
+def get_current_user_id():
+    """User for this request, from the X-User-Id header or user_id query arg (default 1)"""
+    return g.get('user_id') or 1
+
+def admin_only(view):
+    """Reject the request unless it carries the configured ADMIN_TOKEN"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = app.config['ADMIN_TOKEN']
+        if not token:
+            return jsonify({"error": "Admin endpoints are disabled (set TBR_ADMIN_TOKEN "
+                                     "or use the tbrlist CLI)"}), 403
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), token):
+            return jsonify({"error": "Admin token required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/api/book', methods=['POST'])
 def api_add_book():
     try:
@@ -520,6 +3917,7 @@ def api_add_book():
         print(f"Received book data: {data}")
         
         # Using ORM for adding books
+        user_id = get_current_user_id()
         book_id = add_book_orm(
             title=data['title'],
             author_name=data['author_name'],
@@ -528,28 +3926,107 @@ def api_add_book():
             page_count=data.get('page_count'),
             publication_year=data.get('publication_year'),
             priority=data.get('priority', 5),
-            status_id=data.get('status_id', 3)
+            status_id=data.get('status_id', 3),
+            user_id=user_id,
+            isbn=data.get('isbn')
         )
         
+        # Missing metadata is looked up in the background; the response doesn't wait
+        metadata_enricher.submit([book_id], user_id)
+        
         return jsonify({"success": True, "book_id": book_id})
     except Exception as e:
         print(f"Error in API: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/import', methods=['POST'])
+def api_import_books():
+    try:
+        data = request.json
+        # Using set-based prepared statements for bulk loads
+        # Missing metadata of the new books is looked up in the background
+        imported = import_books_prepared(data.get('books', []), get_current_user_id(),
+                                         enrich=True)
+        return jsonify({"success": True, "imported": imported})
+    except Exception as e:
+        print(f"Error importing books: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/tbr', methods=['GET'])
 def api_get_tbr():
     try:
-        # Using prepared statements for complex join query
-        books = get_tbr_list_prepared()
-        return jsonify(books)
+        # Using prepared statements for complex join query, encoded from cached fragments
+        return json_bytes_response(get_tbr_list_json(get_current_user_id()))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/tbr/changes', methods=['GET'])
+def api_get_tbr_changes():
+    try:
+        since = request.args.get('since', 0, type=int)
+        # Using prepared statements for change log lookups
+        changes = get_changes_since_prepared(since, get_current_user_id())
+        return jsonify(changes)
+    except Exception as e:
+        print(f"Error retrieving changes: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/tbr/changes/compact', methods=['POST'])
+@admin_only
+def api_compact_changes():
+    try:
+        data = request.get_json(silent=True) or {}
+        totals = Counter()
+        for path in shard_router.database_paths():
+            totals.update(compact_change_log_prepared(data.get('retention_days', 30), path))
+        return jsonify({"success": True, **totals})
+    except Exception as e:
+        print(f"Error compacting change log: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/archive', methods=['POST'])
+@admin_only
+def api_archive_history():
+    try:
+        data = request.get_json(silent=True) or {}
+        totals = Counter()
+        for path in shard_router.database_paths():
+            result = archive_reading_history_prepared(data.get('months'), path)
+            totals['archived'] += result['archived']
+        return jsonify({"success": True, "cutoff": result['cutoff'], **totals})
+    except Exception as e:
+        print(f"Error archiving reading history: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/snapshot', methods=['GET'])
+def api_get_snapshot_info():
+    try:
+        snapshot = get_library_snapshot(get_current_user_id())
+        if snapshot is None:
+            return jsonify({"enabled": False})
+        
+        # Measure against what the dict-per-row path would hold for the same data
+        snapshot_bytes = snapshot.nbytes()
+        dict_bytes = dict_rows_nbytes(snapshot.rows())
+        per_book = max(snapshot.size, 1)
+        return jsonify({
+            "enabled": True,
+            "version": snapshot.version,
+            "books": snapshot.size,
+            "snapshot_bytes": snapshot_bytes,
+            "dict_rows_bytes": dict_bytes,
+            "snapshot_bytes_per_book": round(snapshot_bytes / per_book, 1),
+            "dict_rows_bytes_per_book": round(dict_bytes / per_book, 1)
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/authors', methods=['GET'])
 def api_get_authors():
     try:
-        # Using ORM for simple query
-        authors = get_authors_orm()
+        # Using ORM; ?include=books adds each author's books via one selectin query
+        authors = get_authors_orm(get_current_user_id(),
+                                  include_books=request.args.get('include') == 'books')
         return jsonify(authors)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -558,7 +4035,7 @@ def api_get_authors():
 def api_get_genres():
     try:
         # Using ORM for simple query
-        genres = get_genres_orm()
+        genres = get_genres_orm(get_current_user_id())
         return jsonify(genres)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -577,7 +4054,7 @@ def api_update_rating():
     try:
         data = request.json
         # Using ORM for update
-        success = update_rating_orm(data['tbr_id'], data['rating'])
+        success = update_rating_orm(data['tbr_id'], data['rating'], get_current_user_id())
         return jsonify({"success": success})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -587,7 +4064,7 @@ def api_update_status():
     try:
         data = request.json
         # Using ORM for update
-        success = update_status_orm(data['tbr_id'], data['status_id'])
+        success = update_status_orm(data['tbr_id'], data['status_id'], get_current_user_id())
         return jsonify({"success": success})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -595,14 +4072,8 @@ def api_update_status():
 @app.route('/api/clear_tbr', methods=['DELETE'])
 def api_clear_tbr():
     try:
-        # Using raw SQL since this is a batch operation
-        with db.engine.connect() as connection:
-            connection.execute(text("DELETE FROM TBRlist"))
-            connection.execute(text("DELETE FROM Books"))
-            connection.execute(text("DELETE FROM Authors"))
-            connection.execute(text("DELETE FROM Genres"))
-            connection.commit()
-            
+        # Using Core statements since this is a batch operation on either backend
+        clear_tbr_core(get_current_user_id())
         return jsonify({"success": True, "message": "TBR list cleared successfully."})
     except Exception as e:
         print(f"Error clearing TBR list: {str(e)}")
@@ -612,12 +4083,26 @@ def api_clear_tbr():
 def api_delete_book(book_id):
     try:
         # Using prepared statements for complex delete
-        success = delete_book_prepared(book_id)
+        success = delete_book_prepared(book_id, get_current_user_id())
         return jsonify({"success": success, "message": f"Book with ID {book_id} deleted successfully."})
     except Exception as e:
         print(f"Error deleting book: {str(e)}")
         return jsonify({"error": str(e)}), 500
     
+@app.route('/api/book/<int:book_id>/similar', methods=['GET'])
+def api_get_similar_books(book_id):
+    try:
+        limit = request.args.get('limit', default=10, type=int)
+        # Using the memory-mapped vector index, caught up with the change log first
+        similar = get_similar_books_prepared(book_id, get_current_user_id(), limit)
+        if similar is None:
+            return jsonify({"error": "The similar-books index is being built, try again "
+                                     "shortly (or run 'flask tbrlist similar-index')"}), 503
+        return jsonify(similar)
+    except Exception as e:
+        print(f"Error finding similar books: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/book/<int:book_id>', methods=['PUT'])
 def api_update_book(book_id):
     try:
@@ -631,7 +4116,8 @@ def api_update_book(book_id):
             category=data.get('category'),
             page_count=data.get('page_count'),
             publication_year=data.get('publication_year'),
-            priority=data.get('priority')
+            priority=data.get('priority'),
+            user_id=get_current_user_id()
         )
         
         return jsonify({"success": success, "message": f"Book with ID {book_id} updated successfully."})
@@ -643,7 +4129,7 @@ def api_update_book(book_id):
 def api_get_settings():
     try:
         # Using ORM for simple query
-        settings = get_user_settings_orm()
+        settings = get_user_settings_orm(get_current_user_id())
         return jsonify(settings)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -653,58 +4139,65 @@ def api_update_settings():
     try:
         data = request.json
         # Using ORM for update
-        success = update_user_settings_orm(data)
+        success = update_user_settings_orm(data, get_current_user_id())
         return jsonify({"success": success})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def format_export(status_counts, books):
+    """Yield the reading journal text chunk by chunk.
+    
+    books must arrive grouped by status in the order of status_counts, as
+    iter_tbr_items_orm() returns them, so nothing has to be held in memory.
+    """
+    yield "MY READING JOURNAL\n"
+    yield "=================\n\n"
+    yield f"Exported on: {datetime.datetime.now().strftime('%B %d, %Y at %I:%M %p')}\n\n"
+    
+    counts = dict(status_counts)
+    current = None
+    for book in books:
+        # Each status section starts with its header
+        if book['status'] != current:
+            if current is not None:
+                yield "\n"
+            current = book['status']
+            yield f"== {current.upper()} BOOKS ({counts.get(current, 0)}) ==\n\n"
+        
+        lines = [f"Title: {book['title']}\n",
+                 f"Author: {book['author']}\n",
+                 f"Genre: {book['genre']}"]
+        if book['category']:
+            lines.append(f" ({book['category']})")
+        lines.append("\n")
+        
+        if book['page_count']:
+            lines.append(f"Pages: {book['page_count']}\n")
+        if book['publication_year']:
+            lines.append(f"Published: {book['publication_year']}\n")
+        if book['rating']:
+            lines.append(f"Rating: {book['rating']}/5\n")
+        
+        lines.append(f"Priority: {book['priority']}/10\n")
+        lines.append(f"Added: {book['date_added']}\n")
+        
+        if book['date_completed']:
+            lines.append(f"Completed: {book['date_completed']}\n")
+        
+        lines.append("\n")
+        yield ''.join(lines)
+    
+    if current is not None:
+        yield "\n"
+
 @app.route('/api/export', methods=['GET'])
+@coalesce_gets
 def api_export_data():
     try:
-        # Get all book data using prepared statements (complex join)
-        books = get_tbr_list_prepared()
-        
-        # Create a formatted text output
-        formatted_output = "MY READING JOURNAL\n"
-        formatted_output += "=================\n\n"
-        formatted_output += f"Exported on: {datetime.datetime.now().strftime('%B %d, %Y at %I:%M %p')}\n\n"
-        
-        # Group books by status
-        books_by_status = {}
-        for book in books:
-            status = book['status']
-            if status not in books_by_status:
-                books_by_status[status] = []
-            books_by_status[status].append(book)
-        
-        # Format each status section
-        for status, status_books in books_by_status.items():
-            formatted_output += f"== {status.upper()} BOOKS ({len(status_books)}) ==\n\n"
-            
-            for book in status_books:
-                formatted_output += f"Title: {book['title']}\n"
-                formatted_output += f"Author: {book['author']}\n"
-                formatted_output += f"Genre: {book['genre']}"
-                if book['category']:
-                    formatted_output += f" ({book['category']})"
-                formatted_output += "\n"
-                
-                if book['page_count']:
-                    formatted_output += f"Pages: {book['page_count']}\n"
-                if book['publication_year']:
-                    formatted_output += f"Published: {book['publication_year']}\n"
-                if book['rating']:
-                    formatted_output += f"Rating: {book['rating']}/5\n"
-                
-                formatted_output += f"Priority: {book['priority']}/10\n"
-                formatted_output += f"Added: {book['date_added']}\n"
-                
-                if book['date_completed']:
-                    formatted_output += f"Completed: {book['date_completed']}\n"
-                
-                formatted_output += "\n"
-            
-            formatted_output += "\n"
+        # Stream book data through the ORM with every relationship joined up front
+        user_id = get_current_user_id()
+        formatted_output = ''.join(format_export(get_export_status_counts(user_id),
+                                                 iter_export_books(user_id)))
         
         return jsonify({
             "success": True, 
@@ -728,10 +4221,13 @@ def api_create_goal():
             target_book_id=data.get('target_book_id'),
             target_genre_id=data.get('target_genre_id'),
             start_date=data.get('start_date'),
-            end_date=data.get('end_date')
+            end_date=data.get('end_date'),
+            user_id=get_current_user_id()
         )
         
         return jsonify({"success": True, "goal_id": goal_id})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         print(f"Error creating reading goal: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -739,9 +4235,14 @@ def api_create_goal():
 @app.route('/api/goals', methods=['GET'])
 def api_get_goals():
     try:
-        # Using prepared statements for complex goal query
-        goals = get_reading_goals_prepared()
-        return jsonify(goals)
+        # ?status=active|expired filters and ?limit=&after= pages by end date
+        status, after, limit = parse_goal_page_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        # Using prepared statements for complex goal query, encoded from cached fragments
+        return json_bytes_response(get_reading_goals_json(
+            get_current_user_id(), status=status, after=after, limit=limit))
     except Exception as e:
         print(f"Error retrieving reading goals: {str(e)}")
         return jsonify({"error": str(e)}), 500
@@ -755,7 +4256,8 @@ def api_update_goal_progress(goal_id):
         success = update_goal_progress_prepared(
             goal_id=goal_id,
             progress=data.get('progress'),
-            completed=data.get('completed')
+            completed=data.get('completed'),
+            user_id=get_current_user_id()
         )
         
         return jsonify({"success": success})
@@ -767,99 +4269,69 @@ def api_update_goal_progress(goal_id):
 def api_delete_goal(goal_id):
     try:
         # Using prepared statements for goal deletion
-        success = delete_reading_goal_prepared(goal_id)
+        success = delete_reading_goal_prepared(goal_id, get_current_user_id())
         return jsonify({"success": success, "message": f"Goal with ID {goal_id} deleted successfully."})
     except Exception as e:
         print(f"Error deleting goal: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/stats', methods=['GET'])
+@coalesce_gets
 def api_get_stats():
     try:
-        conn = sqlite3.connect('tbrlist.db')
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        user_id = get_current_user_id()
+        snapshot = get_library_snapshot(user_id)
+        # Book-level snapshot figures only cover books still on the list, so users with
+        # archived history get the SQL figures
+        if snapshot is not None and not reading_archive.summary(user_id):
+            return jsonify(snapshot.stats())
         
-        stats = {}
-        
-        # Total books count
-        cursor.execute("SELECT COUNT(*) as total FROM Books")
-        stats['total_books'] = cursor.fetchone()[0]
-        
-        # Books by status
-        cursor.execute("""
-            SELECT rs.status, COUNT(*) as count 
-            FROM TBRlist t
-            JOIN [Reading Status] rs ON t.status_id = rs.status_id
-            GROUP BY rs.status
-        """)
-        stats['books_by_status'] = {row['status']: row['count'] for row in cursor.fetchall()}
-        
-        # Books by genre
-        cursor.execute("""
-            SELECT g.genre, COUNT(*) as count 
-            FROM Books b
-            JOIN Genres g ON b.genre_id = g.genre_id
-            GROUP BY g.genre
-            ORDER BY count DESC
-            LIMIT 5
-        """)
-        stats['top_genres'] = {row['genre']: row['count'] for row in cursor.fetchall()}
-        
-        # Average rating
-        cursor.execute("""
-            SELECT AVG(rating) as avg_rating 
-            FROM Books 
-            WHERE rating IS NOT NULL
-        """)
-        stats['average_rating'] = round(cursor.fetchone()[0] or 0, 1)
-        
-        # Reading progress
-        cursor.execute("""
-            SELECT COUNT(*) as completed_this_year
-            FROM TBRlist
-            WHERE date_completed LIKE ? AND status_id = 1
-        """, (f"{datetime.datetime.now().year}%",))
-        stats['completed_this_year'] = cursor.fetchone()[0]
-        
-        # Pages read (for books with page counts)
-        cursor.execute("""
-            SELECT SUM(b.page_count) as pages_read
-            FROM TBRlist t
-            JOIN Books b ON t.book_id = b.book_id
-            WHERE t.status_id = 1 AND b.page_count IS NOT NULL
-        """)
-        stats['total_pages_read'] = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        return jsonify(stats)
+        return jsonify(get_stats_prepared(user_id))
     except Exception as e:
         print(f"Error getting stats: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+def postgres_prefix_query(query):
+    """tsquery matching titles with every word of the query as a word prefix"""
+    words = re.findall(r'\w+', query.lower())
+    return ' & '.join(f"{word}:*" for word in words)
+
 @app.route('/api/search', methods=['GET'])
 def api_search_books():
     try:
         query = request.args.get('q', '')
         if not query or len(query) < 2:
             return jsonify([])
+        
+        user_id = get_current_user_id()
+        snapshot = get_library_snapshot(user_id)
+        if snapshot is not None:
+            return jsonify(snapshot.search(query))
             
-        conn = sqlite3.connect('tbrlist.db')
+        conn = connect_db(user_id)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
         search_param = f"%{query}%"
-        cursor.execute("""
+        title_query = postgres_prefix_query(query)
+        if get_dialect(conn) == 'postgresql' and title_query:
+            # Title words match by prefix through the full-text GIN index
+            title_match = "to_tsvector('simple', b.title) @@ to_tsquery('simple', ?)"
+            title_param = title_query
+        else:
+            title_match = "b.title LIKE ?"
+            title_param = search_param
+        cursor.execute(f"""
             SELECT t.tbr_id, b.book_id, b.title, a.name as author, g.genre, rs.status
             FROM TBRlist t
             JOIN Books b ON t.book_id = b.book_id
             JOIN Authors a ON b.author_id = a.author_id
             JOIN Genres g ON b.genre_id = g.genre_id
-            JOIN [Reading Status] rs ON t.status_id = rs.status_id
-            WHERE b.title LIKE ? OR a.name LIKE ? OR g.genre LIKE ?
+            JOIN "Reading Status" rs ON t.status_id = rs.status_id
+            WHERE t.user_id = ? AND ({title_match} OR a.name LIKE ? OR g.genre LIKE ?)
             ORDER BY t.priority DESC
             LIMIT 10
-        """, (search_param, search_param, search_param))
+        """, (user_id, title_param, search_param, search_param))
         
         results = [dict(row) for row in cursor.fetchall()]
         conn.close()
@@ -869,36 +4341,87 @@ def api_search_books():
         print(f"Error searching books: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
-@app.route('/api/backup', methods=['GET'])
-def api_backup_database():
+def backup_database(path, backup_file, pages=-1, progress=None):
+    """Copy a database to backup_file: SQLite's online backup, or pg_dump on PostgreSQL.
+    
+    SQLite copies pages at a time (all by default), calling progress(status, remaining,
+    total) after each step so long backups can report where they are.
+    """
+    if shard_router.postgres:
+        subprocess.run([app.config['PG_DUMP'], '--format=custom', '--file', backup_file,
+                        '--dbname', path], check=True, capture_output=True)
+        return
+    
+    conn_source = connect_path(path)
+    conn_dest = sqlite3.connect(backup_file)
     try:
-        # Create a timestamp for the backup file
-        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = f"tbrlist_backup_{timestamp}.db"
-        
-        # Create a copy of the database file
-        conn_source = sqlite3.connect('tbrlist.db')
-        conn_dest = sqlite3.connect(backup_file)
-        
-        conn_source.backup(conn_dest)
-        
+        conn_source.backup(conn_dest, pages=pages, progress=progress)
+    finally:
         conn_source.close()
         conn_dest.close()
+
+@app.route('/api/backup', methods=['GET'])
+def api_backup_database():
+    try:
+        # Create (or reuse a recent) copy of the database file holding this user's data
+        backup_file, reused = backup_database_debounced(
+            shard_router.path_for(get_current_user_id()))
         
         # Return the backup filename to the client
         return jsonify({
             "success": True,
             "backup_file": backup_file,
-            "message": f"Database backup created successfully: {backup_file}"
+            "reused": reused,
+            "message": (f"Recent database backup reused: {backup_file}" if reused else
+                        f"Database backup created successfully: {backup_file}")
         })
     except Exception as e:
         print(f"Error creating database backup: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/admin/stats', methods=['GET'])
+@admin_only
+def api_get_admin_stats():
+    try:
+        # Using prepared statements against every database file
+        return jsonify(get_admin_stats_prepared())
+    except Exception as e:
+        print(f"Error getting admin stats: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/shards/move', methods=['POST'])
+@admin_only
+def api_move_user_shard():
+    try:
+        data = request.json
+        result = move_user_prepared(data['user_id'], data['shard'], data.get('source_shard'))
+        return jsonify({"success": True, **result})
+    except Exception as e:
+        print(f"Error moving user between shards: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/shards/rebalance', methods=['POST'])
+@admin_only
+def api_rebalance_shards():
+    try:
+        data = request.get_json(silent=True) or {}
+        result = rebalance_shards(dry_run=data.get('dry_run', True))
+        return jsonify({"success": True, **result})
+    except Exception as e:
+        print(f"Error rebalancing shards: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/recommendations', methods=['GET'])
+@coalesce_gets
 def api_get_recommendations():
     try:
-        conn = sqlite3.connect('tbrlist.db')
+        user_id = get_current_user_id()
+        snapshot = get_library_snapshot(user_id)
+        # The snapshot only holds live entries; archived ratings still count from Books
+        if snapshot is not None and not reading_archive.summary(user_id):
+            return jsonify(snapshot.recommendations())
+        
+        conn = connect_db(user_id)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
@@ -907,12 +4430,12 @@ def api_get_recommendations():
             SELECT g.genre, AVG(b.rating) as avg_rating, COUNT(*) as count
             FROM Books b
             JOIN Genres g ON b.genre_id = g.genre_id
-            WHERE b.rating IS NOT NULL AND b.rating > 3
+            WHERE b.user_id = ? AND b.rating IS NOT NULL AND b.rating > 3
             GROUP BY g.genre
-            HAVING count > 1
+            HAVING COUNT(*) > 1
             ORDER BY avg_rating DESC
             LIMIT 3
-        """)
+        """, (user_id,))
         favorite_genres = [row['genre'] for row in cursor.fetchall()]
         
         # Get the user's favorite authors (based on highest rated books)
@@ -920,12 +4443,12 @@ def api_get_recommendations():
             SELECT a.name, AVG(b.rating) as avg_rating, COUNT(*) as count
             FROM Books b
             JOIN Authors a ON b.author_id = a.author_id
-            WHERE b.rating IS NOT NULL AND b.rating > 3
+            WHERE b.user_id = ? AND b.rating IS NOT NULL AND b.rating > 3
             GROUP BY a.name
-            HAVING count > 1
+            HAVING COUNT(*) > 1
             ORDER BY avg_rating DESC
             LIMIT 3
-        """)
+        """, (user_id,))
         favorite_authors = [row['name'] for row in cursor.fetchall()]
         
         # Get books in user's favorite genres that they haven't read yet
@@ -939,11 +4462,11 @@ def api_get_recommendations():
                 JOIN Authors a ON b.author_id = a.author_id
                 JOIN Genres g ON b.genre_id = g.genre_id
                 JOIN TBRlist t ON b.book_id = t.book_id
-                WHERE g.genre IN ({placeholders})
+                WHERE t.user_id = ? AND g.genre IN ({placeholders})
                 AND t.status_id = 3  -- "To Read" status
                 ORDER BY t.priority DESC
                 LIMIT 5
-            """, favorite_genres)
+            """, [user_id, *favorite_genres])
             genre_recommendations = [dict(row) for row in cursor.fetchall()]
         
         # Get books by user's favorite authors that they haven't read yet
@@ -957,11 +4480,11 @@ def api_get_recommendations():
                 JOIN Authors a ON b.author_id = a.author_id
                 JOIN Genres g ON b.genre_id = g.genre_id
                 JOIN TBRlist t ON b.book_id = t.book_id
-                WHERE a.name IN ({placeholders})
+                WHERE t.user_id = ? AND a.name IN ({placeholders})
                 AND t.status_id = 3  -- "To Read" status
                 ORDER BY t.priority DESC
                 LIMIT 5
-            """, favorite_authors)
+            """, [user_id, *favorite_authors])
             author_recommendations = [dict(row) for row in cursor.fetchall()]
         
         conn.close()
@@ -978,35 +4501,442 @@ def api_get_recommendations():
 
 # ================ Database Initialization ================
 
-def initialize_database():
-    """Initialize the database with tables and default data if needed"""
-    with app.app_context():
-        # Create all tables
-        db.create_all()
-        
-        # Check if default reading statuses exist
-        status_count = ReadingStatus.query.count()
+# Columns added to tables created before multi-user support
+USER_COLUMNS = ('TBRlist', 'Books', 'UserSettings', 'ReadingGoals', 'ChangeLog')
+
+# Per-user access paths lead with user_id so a user's queries never scan other users' rows
+USER_SCOPED_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_tbrlist_user_priority_date "
+    "ON TBRlist(user_id, priority DESC, date_added DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_tbrlist_user_status ON TBRlist(user_id, status_id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_user_genre ON Books(user_id, genre_id)",
+    "CREATE INDEX IF NOT EXISTS idx_books_user_author ON Books(user_id, author_id)",
+    # goal_id breaks end_date ties for keyset pagination (SQLite appends it implicitly)
+    "DROP INDEX IF EXISTS idx_goals_user_end_date",
+    "CREATE INDEX IF NOT EXISTS idx_goals_user_end_date_goal "
+    "ON ReadingGoals(user_id, end_date, goal_id)",
+    # One settings row per user: drop duplicates older code could create, then enforce it
+    "DELETE FROM UserSettings WHERE id NOT IN (SELECT MIN(id) FROM UserSettings GROUP BY user_id)",
+    "DROP INDEX IF EXISTS idx_settings_user",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_settings_user ON UserSettings(user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_changelog_user_change ON ChangeLog(user_id, change_id)",
+]
+
+# Backend fast paths that only exist on PostgreSQL
+POSTGRES_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_books_title_fts "
+    "ON \"Books\" USING GIN (to_tsvector('simple', title))",
+]
+
+# Columns added after a table was first released: (table, column, type)
+ADDED_COLUMNS = (
+    ('Books', 'isbn', 'VARCHAR(20)'),
+)
+
+def user_schema_migrations(cursor):
+    """Build the DDL that adds user_id and newer columns to older tables and creates the
+    per-user indexes"""
+    statements = []
+    for table in USER_COLUMNS:
+        cursor.execute(f"PRAGMA table_info({table})")
+        if 'user_id' not in [row[1] for row in cursor.fetchall()]:
+            # Everything written before multi-user support belongs to the default user
+            default = 'NULL' if table == 'ChangeLog' else '1'
+            statements.append(f"ALTER TABLE {table} ADD COLUMN user_id INTEGER DEFAULT {default}")
+    for table, column, column_type in ADDED_COLUMNS:
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in [row[1] for row in cursor.fetchall()]:
+            statements.append(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    return statements + USER_SCOPED_INDEXES
+
+DEFAULT_STATUSES = ("Completed", "Currently Reading", "To Read", "Did Not Finish")
+
+# Hashed as source, so warm starts compare fingerprints without importing SQLAlchemy
+MODELS_PATH = os.path.join(base_dir, 'models.py')
+
+@functools.lru_cache(maxsize=None)
+def schema_fingerprint(dialect):
+    """Hash of everything initialize_schema sets up; unchanged means nothing to do"""
+    with open(MODELS_PATH, 'rb') as f:
+        parts = [hashlib.sha256(f.read()).hexdigest()]
+    parts += USER_SCOPED_INDEXES + POSTGRES_INDEXES + change_tracking_triggers(dialect)
+    parts += [SYNC_STATE_INSERT_SQL, *DEFAULT_STATUSES]
+    return hashlib.sha256('\n'.join(parts).encode()).hexdigest()
+
+def read_schema_info(path):
+    """SchemaInfo entries as a dict (empty for a new or pre-fingerprint database)"""
+    conn = connect_path(path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT key, value FROM SchemaInfo")
+        return dict(cursor.fetchall())
+    except database_errors():
+        return {}
+    finally:
+        conn.close()
+
+def write_schema_info(path, **entries):
+    conn = connect_path(path)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"DELETE FROM SchemaInfo WHERE key IN ({', '.join('?' for _ in entries)})",
+                       list(entries))
+        cursor.executemany("INSERT INTO SchemaInfo (key, value) VALUES (?, ?)",
+                           list(entries.items()))
+        conn.commit()
+    finally:
+        conn.close()
+
+def initialize_schema(path):
+    """Create tables, migrations, change tracking and default statuses in one database.
+    
+    Skipped (one SELECT, without importing SQLAlchemy) when the stored schema fingerprint
+    matches this code's, so warm starts don't pay for create_all, migrations and trigger
+    DDL. Returns whether the schema was (re)built.
+    """
+    dialect = 'postgresql' if shard_router.postgres else 'sqlite'
+    info = read_schema_info(path)
+    fingerprint = schema_fingerprint(dialect)
+    rebuilt = info.get('fingerprint') != fingerprint
+    
+    if rebuilt:
+        build_schema(shard_router.engine_for_path(path), dialect)
+        write_schema_info(path, fingerprint=fingerprint)
+    
+    # Compact the change log at boot (at most once per interval) so it never grows without bound
+    now = datetime.datetime.now(datetime.timezone.utc)
+    compacted_at = info.get('compacted_at')
+    interval = datetime.timedelta(hours=app.config['COMPACT_INTERVAL_HOURS'])
+    if rebuilt or not compacted_at or now - datetime.datetime.fromisoformat(compacted_at) >= interval:
+        compact_change_log_prepared(db_path=path)
+        write_schema_info(path, compacted_at=now.isoformat())
+    return rebuilt
+
+def build_schema(engine, dialect):
+    # Create all tables
+    orm.Base.metadata.create_all(engine)
+    
+    # Add user_id to tables from older databases, then the per-user indexes
+    with engine.connect() as connection:
+        if dialect == 'postgresql':
+            # PostgreSQL databases start out with user_id, so only newer columns are missing
+            statements = [translate_sql_postgres(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS "
+                                                 f"{column} {column_type}")
+                          for table, column, column_type in ADDED_COLUMNS]
+            statements += [translate_sql_postgres(sql) for sql in USER_SCOPED_INDEXES]
+            statements += POSTGRES_INDEXES
+        else:
+            statements = user_schema_migrations(connection.connection.cursor())
+        for statement in statements:
+            connection.execute(orm.text(statement))
+        connection.commit()
+    
+    # Install change tracking triggers for delta sync
+    with engine.connect() as connection:
+        for statement in change_tracking_triggers(dialect):
+            connection.execute(orm.text(statement))
+        connection.execute(orm.text(translate_sql_postgres(SYNC_STATE_INSERT_SQL)
+                                if dialect == 'postgresql' else SYNC_STATE_INSERT_SQL))
+        connection.commit()
+    
+    # Check if default reading statuses exist
+    with orm.sessionmaker(bind=engine)() as session:
+        status_count = session.query(orm.ReadingStatus).count()
         if status_count == 0:
             # Add default reading statuses
-            statuses = [
-                ReadingStatus(status="Completed"),
-                ReadingStatus(status="Currently Reading"),
-                ReadingStatus(status="To Read"),
-                ReadingStatus(status="Did Not Finish")
-            ]
-            db.session.add_all(statuses)
-            db.session.commit()
-            print("Default reading statuses added")
-        
-        # Check if user settings exist
-        settings = UserSettings.query.first()
+            session.add_all([orm.ReadingStatus(status=status) for status in DEFAULT_STATUSES])
+            session.commit()
+            print(f"Default reading statuses added to {engine.url.database}")
+
+def initialize_main_database():
+    path = shard_router.main_path()
+    # Sharded, user 1 lives on a shard; settings are created there on first use
+    if not initialize_schema(path) or shard_router.sharded:
+        return
+    
+    # Check if the default user's settings exist
+    with orm.sessionmaker(bind=shard_router.engine_for_path(path))() as session:
+        settings = session.query(orm.UserSettings).filter_by(user_id=1).first()
         if not settings:
             # Add default user settings
-            default_settings = UserSettings()
-            db.session.add(default_settings)
-            db.session.commit()
+            upsert_user_settings(session, 1)
+            session.commit()
             print("Default user settings added")
 
+def initialize_database():
+    """Initialize the database with tables and default data if needed.
+    
+    Optional at startup: the first connection to a database initializes it anyway.
+    """
+    shard_router.ensure_schema(shard_router.main_path())
+
+# Child process for startup-benchmark: import the app, then bring a database file up to date
+STARTUP_PROBE = """
+import sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.shard_router.ensure_schema(sys.argv[1])
+print(imported - start, time.perf_counter() - imported)
+"""
+
+def parse_importtime(stderr, top=10):
+    """Slowest direct imports of app.py from `python -X importtime` output as (module, seconds)"""
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        # Nested imports are indented two spaces per level under the module that pulled them in
+        if cumulative.strip().isdigit() and name.startswith('   ') and not name.startswith('     '):
+            modules.append((name.strip(), int(cumulative) / 1e6))
+    return sorted(modules, key=lambda m: -m[1])[:top]
+
+@app.cli.command('startup-benchmark')
+@click.option('--runs', default=5, help='Cold interpreter starts to time per phase.')
+@click.option('--top', default=10, help='Slowest top-level imports to list.')
+def startup_benchmark_command(runs, top):
+    """Time app import plus schema initialization (new vs. up-to-date database) in fresh interpreters."""
+    import statistics
+    import tempfile
+    
+    env = {k: v for k, v in os.environ.items() if k not in ('TBR_DATABASE_URL', 'TBR_SHARD_DIR')}
+    timings = defaultdict(list)
+    slowest = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for run in range(runs):
+            path = os.path.join(tmp, f"bench_{run}.db")
+            # First start finds an empty file (full schema build), the second an up-to-date one
+            for phase in ('cold', 'warm'):
+                result = subprocess.run(
+                    [sys.executable, '-X', 'importtime', '-c', STARTUP_PROBE, path],
+                    cwd=base_dir, env=env, capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise click.ClickException(result.stderr.strip().splitlines()[-1])
+                import_seconds, init_seconds = map(float, result.stdout.split()[-2:])
+                timings['import'].append(import_seconds)
+                timings[f'init ({phase})'].append(init_seconds)
+                if phase == 'warm' and not slowest:
+                    # An up-to-date start, which is what every start after the first looks like
+                    slowest = parse_importtime(result.stderr, top)
+    
+    for phase, values in timings.items():
+        click.echo(f"{phase:12} median {statistics.median(values) * 1000:7.1f} ms"
+                   f"   min {min(values) * 1000:7.1f} ms")
+    click.echo("slowest imports (cumulative):")
+    for name, seconds in slowest:
+        click.echo(f"  {seconds * 1000:7.1f} ms  {name}")
+
+# ================ Command-Line Administration ================
+
+# Offline bulk operations: `flask --app app tbrlist <command>` works on the databases
+# directly, so long jobs never run inside (or time out) a web request
+tbrlist_cli = AppGroup('tbrlist', help='Bulk and maintenance operations on the TBR databases.')
+app.cli.add_command(tbrlist_cli)
+
+# Statements per maintenance operation and dialect; PostgreSQL runs them in autocommit
+MAINTENANCE_SQL = {
+    'vacuum': {'sqlite': ('VACUUM',), 'postgresql': ('VACUUM',)},
+    'analyze': {'sqlite': ('ANALYZE',), 'postgresql': ('ANALYZE',)},
+    'optimize': {'sqlite': ('PRAGMA optimize',), 'postgresql': ('VACUUM (ANALYZE)',)},
+    'reindex': {'sqlite': ('REINDEX',),
+                'postgresql': tuple(f'REINDEX TABLE {table}'
+                                    for table in QUOTED_TABLES + ('"Reading Status"',))},
+}
+
+# Numeric book fields, converted from the strings csv hands back
+IMPORT_INTEGER_FIELDS = ('page_count', 'publication_year', 'rating', 'priority', 'status_id')
+
+def run_maintenance(path, operation):
+    """Run a MAINTENANCE_SQL operation against one database"""
+    conn = connect_path(path)
+    dialect = get_dialect(conn)
+    try:
+        if dialect == 'postgresql':
+            # VACUUM refuses to run inside a transaction block
+            conn.raw.autocommit = True
+        for statement in MAINTENANCE_SQL[operation][dialect]:
+            conn.execute(statement)
+    finally:
+        if dialect == 'postgresql':
+            conn.raw.autocommit = False
+        conn.close()
+
+def read_import_file(path):
+    """Yield books from a .json ([...] or {"books": [...]}), .jsonl or .csv file.
+    
+    JSON Lines and CSV are read a row at a time, so any size of file can be imported.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline='', encoding='utf-8') as f:
+        if extension in ('.jsonl', '.ndjson'):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        elif extension == '.csv':
+            for row in csv.DictReader(f):
+                book = {key: value or None for key, value in row.items()}
+                for key in IMPORT_INTEGER_FIELDS:
+                    if book.get(key) is not None:
+                        book[key] = int(book[key])
+                yield book
+        else:
+            data = json.load(f)
+            yield from data.get('books', []) if isinstance(data, dict) else data
+
+@tbrlist_cli.command('clear')
+@click.option('--user-id', default=1, help='User whose TBR list to clear.')
+@click.confirmation_option(prompt='Delete this user\'s TBR list and books?')
+def clear_command(user_id):
+    """Delete a user's TBR list and books."""
+    clear_tbr_core(user_id)
+    click.echo(f"Cleared TBR list of user {user_id}")
+
+@tbrlist_cli.command('backup')
+@click.option('--output-dir', default='.', type=click.Path(file_okay=False),
+              help='Directory to write backups to.')
+@click.option('--pages', default=1024, help='SQLite pages copied per step (-1 for all at once).')
+def backup_command(output_dir, pages):
+    """Back up the main database and every shard."""
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    extension = 'dump' if shard_router.postgres else 'db'
+    for path in shard_router.database_paths():
+        label = os.path.splitext(shard_router.database_label(path))[0]
+        backup_file = os.path.join(output_dir, f"tbrlist_backup_{timestamp}_{label}.{extension}")
+        
+        def progress(status, remaining, total):
+            click.echo(f"\r  {label}: {total - remaining}/{total} pages", nl=False, err=True)
+        
+        backup_database(path, backup_file, pages, progress)
+        click.echo(f"\r{label}: {backup_file}" + ' ' * 20, err=True)
+
+@tbrlist_cli.command('export')
+@click.option('--user-id', default=1, help='User whose reading journal to export.')
+@click.option('--output', '-o', type=click.File('w', encoding='utf-8'), default='-',
+              help='File to write (default stdout).')
+@click.option('--batch-size', default=500, help='Rows fetched per query round trip.')
+def export_command(user_id, output, batch_size):
+    """Stream a user's reading journal as text."""
+    status_counts = get_export_status_counts(user_id)
+    total = sum(count for _, count in status_counts)
+    with click.progressbar(iter_export_books(user_id, batch_size), length=total,
+                           label='Exporting', file=sys.stderr) as books:
+        for chunk in format_export(status_counts, books):
+            output.write(chunk)
+
+@tbrlist_cli.command('import')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user-id', default=1, help='User whose TBR list receives the books.')
+@click.option('--batch-size', default=1000, help='Books loaded per transaction.')
+def import_command(path, user_id, batch_size):
+    """Import books from a .json, .jsonl or .csv file in batches."""
+    books = read_import_file(path)
+    imported = 0
+    while batch := list(itertools.islice(books, batch_size)):
+        imported += import_books_prepared(batch, user_id)
+        click.echo(f"\rImported {imported} books", nl=False, err=True)
+    click.echo(f"\rImported {imported} books", err=True)
+
+@tbrlist_cli.command('stats')
+@click.option('--user-id', type=int, default=None,
+              help='User to report on (default: totals across all databases).')
+def stats_command(user_id):
+    """Print library statistics as JSON."""
+    stats = get_admin_stats_prepared() if user_id is None else get_stats_prepared(user_id)
+    click.echo(json.dumps(stats, indent=2, sort_keys=True))
+
+@tbrlist_cli.command('compact')
+@click.option('--retention-days', default=30,
+              help='Drop change log entries older than this many days.')
+def compact_command(retention_days):
+    """Drop superseded and expired change log entries in every database."""
+    paths = shard_router.database_paths()
+    for number, path in enumerate(paths, 1):
+        result = compact_change_log_prepared(retention_days, path)
+        click.echo(f"[{number}/{len(paths)}] {shard_router.database_label(path)}: "
+                   f"removed {result['superseded_removed']} superseded and "
+                   f"{result['expired_removed']} expired entries", err=True)
+
+@tbrlist_cli.command('archive')
+@click.option('--months', type=int, default=None,
+              help='Archive finished entries completed more than this many months ago '
+                   '(default ARCHIVE_AFTER_MONTHS).')
+@click.option('--batch-size', default=5000, help='Entries moved per archive commit.')
+def archive_command(months, batch_size):
+    """Move old Completed/DNF entries from TBRlist into the columnar archive."""
+    paths = shard_router.database_paths()
+    for number, path in enumerate(paths, 1):
+        result = archive_reading_history_prepared(months, path, batch_size)
+        click.echo(f"[{number}/{len(paths)}] {shard_router.database_label(path)}: "
+                   f"archived {result['archived']} entries completed before {result['cutoff']}",
+                   err=True)
+
+@tbrlist_cli.command('move-user')
+@click.argument('user_id', type=int)
+@click.argument('shard')
+@click.option('--source-shard', default=None,
+              help='Shard to move from (default: where the user is routed now).')
+def move_user_command(user_id, shard, source_shard):
+    """Move a user's books, goals and settings to SHARD (e.g. shard_003 or main)."""
+    try:
+        result = move_user_prepared(user_id, shard, source_shard)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(json.dumps(result, indent=2, sort_keys=True))
+
+@tbrlist_cli.command('rebalance')
+@click.option('--dry-run/--apply', default=True, help='Only list the moves (default).')
+def rebalance_command(dry_run):
+    """Move users whose shard differs from the default for SHARD_COUNT."""
+    try:
+        result = rebalance_shards(dry_run=dry_run)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(json.dumps(result, indent=2, sort_keys=True))
+
+@tbrlist_cli.command('similar-index')
+def similar_index_command():
+    """Rebuild the similar-books index of every database."""
+    paths = shard_router.database_paths()
+    for number, path in enumerate(paths, 1):
+        started = time.perf_counter()
+        build_similarity_index(path, rebuild=True)
+        click.echo(f"[{number}/{len(paths)}] {shard_router.database_label(path)}: "
+                   f"{len(get_similarity_index(path).rows)} books indexed in "
+                   f"{time.perf_counter() - started:.2f}s", err=True)
+
+@tbrlist_cli.command('enrich')
+@click.option('--user-id', default=1, help='User whose books to enrich.')
+def enrich_command(user_id):
+    """Fill missing ISBNs, page counts and publication years from the metadata provider."""
+    if metadata_enricher.provider is None:
+        raise click.ClickException("No metadata provider configured (set TBR_CATALOG_PATH)")
+    futures = metadata_enricher.submit(metadata_enricher.missing_book_ids(user_id), user_id)
+    enriched = 0
+    with click.progressbar(as_completed(futures), length=len(futures),
+                           label='Enriching', file=sys.stderr) as done:
+        for future in done:
+            enriched += bool(future.result())
+    click.echo(f"Enriched {enriched} of {len(futures)} books", err=True)
+
+def maintenance_command(operation, help_text):
+    @tbrlist_cli.command(operation, help=help_text)
+    def command():
+        paths = shard_router.database_paths()
+        for number, path in enumerate(paths, 1):
+            label = shard_router.database_label(path)
+            click.echo(f"[{number}/{len(paths)}] {operation} {label}", err=True)
+            started = time.perf_counter()
+            run_maintenance(path, operation)
+            click.echo(f"  done in {time.perf_counter() - started:.2f}s", err=True)
+    return command
+
+maintenance_command('vacuum', 'Rebuild every database file to reclaim free space.')
+maintenance_command('analyze', 'Refresh the query planner statistics of every database.')
+maintenance_command('optimize', 'Run the lightweight planner/statistics maintenance on every database.')
+maintenance_command('reindex', 'Rebuild the indexes of every database.')
+
 # ================ Main Application ================
 
 if __name__ == '__main__':
@@ -0,0 +1,126 @@
+"""SQLAlchemy models for the TBR list, plus the SQLAlchemy API app.py uses.
+
+Importing SQLAlchemy takes longer than everything else at startup, so app.py only
+imports this module through load_orm(), the first time a query goes through the ORM.
+"""
+from sqlalchemy import (Column, ForeignKey, Index, Integer, String, create_engine, delete,
+                        event, func, insert, select, text, update)
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import (DeclarativeBase, backref, configure_mappers, joinedload, raiseload,
+                            relationship, scoped_session, selectinload, sessionmaker)
+
+class Base(DeclarativeBase):
+    pass
+
+# Relationships never load lazily: each query states its loading strategy up front,
+# so walking an unloaded relationship raises instead of issuing one query per row
+
+class Author(Base):
+    __tablename__ = 'Authors'
+    author_id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(255), nullable=False)
+    books = relationship('Book', backref=backref('author', lazy='raise_on_sql'),
+                         lazy='raise_on_sql')
+
+class Genre(Base):
+    __tablename__ = 'Genres'
+    genre_id = Column(Integer, primary_key=True, autoincrement=True)
+    genre = Column(String(100), nullable=False)
+    category = Column(String(100))
+    books = relationship('Book', backref=backref('genre_rel', lazy='raise_on_sql'),
+                         lazy='raise_on_sql')
+
+class ReadingStatus(Base):
+    __tablename__ = 'Reading Status'
+    status_id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String(50), nullable=False)
+    tbr_items = relationship('TBRList', backref=backref('status', lazy='raise_on_sql'),
+                             lazy='raise_on_sql')
+
+class Book(Base):
+    __tablename__ = 'Books'
+    book_id = Column(Integer, primary_key=True, autoincrement=True)
+    title = Column(String(255), nullable=False)
+    author_id = Column(Integer, ForeignKey('Authors.author_id'), nullable=False)
+    genre_id = Column(Integer, ForeignKey('Genres.genre_id'), nullable=False)
+    page_count = Column(Integer)
+    publication_year = Column(Integer)
+    rating = Column(Integer)
+    isbn = Column(String(20))  # filled in by metadata enrichment when not given
+    user_id = Column(Integer, default=1, nullable=False)
+    tbr_items = relationship('TBRList', backref=backref('book', lazy='raise_on_sql'),
+                             lazy='raise_on_sql', cascade="all, delete-orphan")
+
+class TBRList(Base):
+    __tablename__ = 'TBRlist'
+    tbr_id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, default=1, nullable=False)
+    book_id = Column(Integer, ForeignKey('Books.book_id'), nullable=False)
+    status_id = Column(Integer, ForeignKey('Reading Status.status_id'), nullable=False)
+    priority = Column(Integer, default=5)
+    date_added = Column(String(20))
+    date_completed = Column(String(20))
+
+class UserSettings(Base):
+    __tablename__ = 'UserSettings'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, default=1, nullable=False)
+    theme = Column(String(20), default='light')
+    card_layout = Column(String(20), default='grid')
+    show_priority = Column(Integer, default=1)  # SQLite boolean as integer
+    default_sort = Column(String(20), default='priority')
+    notifications = Column(Integer, default=1)
+    auto_backup = Column(Integer, default=0)
+
+class ReadingGoal(Base):
+    __tablename__ = 'ReadingGoals'
+    goal_id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, default=1)
+    goal_type = Column(String(50), nullable=False)
+    target_value = Column(Integer)
+    target_book_id = Column(Integer, ForeignKey('Books.book_id'))
+    target_genre_id = Column(Integer, ForeignKey('Genres.genre_id'))
+    start_date = Column(String(20), nullable=False)
+    end_date = Column(String(20), nullable=False)
+    completed = Column(Integer, default=0)
+    progress = Column(Integer, default=0)
+
+class ChangeLog(Base):
+    __tablename__ = 'ChangeLog'
+    # AUTOINCREMENT so change ids (our data versions) are never reused after compaction
+    __table_args__ = (
+        Index('idx_changelog_table_row', 'table_name', 'row_id'),
+        {'sqlite_autoincrement': True},
+    )
+    change_id = Column(Integer, primary_key=True, autoincrement=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    op = Column(String(10), nullable=False)  # 'upsert' or 'delete' (tombstone)
+    changed_at = Column(String(20))
+    user_id = Column(Integer)  # NULL for shared lookup rows (authors, genres)
+
+class UserDataVersion(Base):
+    __tablename__ = 'UserDataVersion'
+    # Latest change id touching each user's rows; user 0 tracks shared lookup rows
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    version = Column(Integer, nullable=False, default=0)
+
+class ShardMap(Base):
+    __tablename__ = 'ShardMap'
+    # Only used in the main database: which shard file holds each user's data
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    shard = Column(String(100), nullable=False)
+
+class SyncState(Base):
+    __tablename__ = 'SyncState'
+    id = Column(Integer, primary_key=True)
+    compacted_through = Column(Integer, default=0)  # change log entries <= this were compacted away
+
+class SchemaInfo(Base):
+    __tablename__ = 'SchemaInfo'
+    # Startup bookkeeping: 'fingerprint' of the installed schema, 'compacted_at' of the last boot compaction
+    key = Column(String(50), primary_key=True)
+    value = Column(String(255))
@@ -0,0 +1,423 @@
+"""Endpoint tests against SQLite and, when TBR_TEST_DATABASE_URL is set, PostgreSQL.
+
+The PostgreSQL URL must point at a throwaway database: its public schema is dropped
+and recreated before the tests run. pg_dump is taken from TBR_PG_DUMP (default PATH).
+"""
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, 'app.py')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)  # app.py imports models.py on first ORM use
+TEST_DATABASE_URL = os.environ.get('TBR_TEST_DATABASE_URL')
+
+requires_postgres = pytest.mark.skipif(
+    not TEST_DATABASE_URL, reason='set TBR_TEST_DATABASE_URL to run against PostgreSQL')
+
+MODES = ['sqlite', pytest.param('postgresql', marks=requires_postgres)]
+
+def reset_postgres(url):
+    psycopg = pytest.importorskip('psycopg')
+    with psycopg.connect(url, autocommit=True) as conn:
+        conn.execute("DROP SCHEMA public CASCADE")
+        conn.execute("CREATE SCHEMA public")
+
+def load_app(mode, directory):
+    """A fresh copy of app.py configured for one storage mode, with its files in directory"""
+    env = {
+        'TBR_DATABASE_PATH': str(directory / 'tbrlist.db'),
+        'TBR_ARCHIVE_DIR': str(directory / 'archive'),
+        'TBR_SIMILAR_INDEX_DIR': str(directory / 'similar_index'),
+        'TBR_ENRICHMENT_CACHE_PATH': str(directory / 'enrichment_cache.db'),
+        'TBR_RATE_LIMITS': '',
+        'TBR_BACKUP_DEBOUNCE_SECONDS': '0',
+    }
+    if mode == 'postgresql':
+        reset_postgres(TEST_DATABASE_URL)
+        env['TBR_DATABASE_URL'] = TEST_DATABASE_URL
+    saved = {key: os.environ.get(key) for key in [*env, 'TBR_DATABASE_URL']}
+    os.environ.pop('TBR_DATABASE_URL', None)
+    os.environ.update(env)
+    try:
+        # app.py reads its configuration at import time, so each mode gets its own copy
+        spec = importlib.util.spec_from_file_location(f"tbr_app_{mode}", APP_PATH)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[spec.name] = module
+        spec.loader.exec_module(module)
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+    module.initialize_database()
+    return module
+
+@pytest.fixture(scope='module', params=MODES)
+def tbr(request, tmp_path_factory):
+    return load_app(request.param, tmp_path_factory.mktemp(request.param))
+
+@pytest.fixture
+def postgres(tbr):
+    if not tbr.shard_router.postgres:
+        pytest.skip('PostgreSQL only')
+    return tbr
+
+@pytest.fixture
+def client(tbr, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # backups are written to the working directory
+    return tbr.app.test_client()
+
+def headers(user_id):
+    return {'X-User-Id': str(user_id)}
+
+def add_book(client, user_id, title, **book):
+    book = {'title': title, 'author_name': 'Ursula K. Le Guin', 'genre': 'Fantasy', **book}
+    response = client.post('/api/book', json=book, headers=headers(user_id))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()['book_id']
+
+def tbr_items(client, user_id):
+    response = client.get('/api/tbr', headers=headers(user_id))
+    assert response.status_code == 200, response.get_json()
+    return response.get_json()
+
+def test_translate_sql_postgres(tbr):
+    translate = tbr.translate_sql_postgres
+    assert translate("BEGIN") == "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"
+    assert translate("SELECT * FROM Books WHERE title LIKE ? AND user_id = ?") == \
+        'SELECT * FROM "Books" WHERE title ILIKE %s AND user_id = %s'
+    assert translate("INSERT OR IGNORE INTO Authors (name) VALUES (?)") == \
+        'INSERT INTO "Authors" (name) VALUES (%s) ON CONFLICT DO NOTHING RETURNING author_id'
+    assert translate("INSERT INTO TBRlist (user_id) VALUES (?)") == \
+        'INSERT INTO "TBRlist" (user_id) VALUES (%s) RETURNING tbr_id'
+    assert translate("SELECT '100%' FROM \"Reading Status\"") == \
+        'SELECT \'100%%\' FROM "Reading Status"'
+
+def test_book_lifecycle(client):
+    book_id = add_book(client, 11, 'A Wizard of Earthsea', page_count=183)
+    add_book(client, 12, 'Someone Else\'s Book')
+
+    items = tbr_items(client, 11)
+    assert [(item['book_id'], item['title'], item['status']) for item in items] == \
+        [(book_id, 'A Wizard of Earthsea', 'To Read')]
+    tbr_id = items[0]['tbr_id']
+
+    assert client.put('/api/status', json={'tbr_id': tbr_id, 'status_id': 1},
+                      headers=headers(11)).status_code == 200
+    assert client.put('/api/rating', json={'tbr_id': tbr_id, 'rating': 5},
+                      headers=headers(11)).status_code == 200
+
+    stats = client.get('/api/stats', headers=headers(11)).get_json()
+    assert stats['total_books'] == 1
+    assert stats['total_pages_read'] == 183
+    assert stats['average_rating'] == 5
+
+    export = client.get('/api/export', headers=headers(11)).get_json()
+    assert 'Title: A Wizard of Earthsea' in export['data']
+    assert 'Someone Else' not in export['data']
+
+    assert client.delete(f'/api/book/{book_id}', headers=headers(11)).status_code == 200
+    assert tbr_items(client, 11) == []
+    assert len(tbr_items(client, 12)) == 1
+
+def test_change_log_triggers(tbr, client):
+    book_id = add_book(client, 21, 'The Dispossessed')
+    version = client.get('/api/tbr/changes?since=0', headers=headers(21)).get_json()['version']
+
+    # Written behind the app's back: only the database trigger can record this change
+    conn = tbr.connect_db(21)
+    try:
+        conn.cursor().execute("UPDATE Books SET title = ? WHERE book_id = ?",
+                              ('The Dispossessed: An Ambiguous Utopia', book_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+    changes = client.get(f'/api/tbr/changes?since={version}', headers=headers(21)).get_json()
+    assert changes['version'] > version
+    assert [item['title'] for item in changes['tbr']] == ['The Dispossessed: An Ambiguous Utopia']
+
+    other = client.get(f'/api/tbr/changes?since={version}', headers=headers(22)).get_json()
+    assert other['tbr'] == []
+
+def test_change_log_trigger_is_plpgsql(postgres):
+    conn = postgres.connect_db(1)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT count(*) FROM pg_trigger t
+            JOIN pg_proc p ON t.tgfoid = p.oid
+            JOIN pg_language l ON p.prolang = l.oid
+            WHERE NOT t.tgisinternal AND l.lanname = 'plpgsql'
+        """)
+        assert cursor.fetchone()[0] > 0
+    finally:
+        conn.close()
+
+def test_import(client):
+    books = [
+        {'title': 'Kindred', 'author_name': 'Octavia E. Butler', 'genre': 'Science Fiction',
+         'page_count': 264, 'status_id': 1, 'date_completed': '2024-02-01'},
+        {'title': 'Kindred', 'author_name': 'Octavia E. Butler', 'genre': 'Science Fiction'},
+        {'title': 'Parable of the Sower', 'author_name': 'Octavia E. Butler',
+         'genre': 'Science Fiction', 'category': 'Fiction', 'priority': 9,
+         'isbn': '978-1-53871-219-9'},
+    ]
+    response = client.post('/api/import', json={'books': books}, headers=headers(31))
+    assert response.get_json() == {'success': True, 'imported': 3}
+
+    items = tbr_items(client, 31)
+    assert sorted((item['title'], item['status'], item['priority']) for item in items) == [
+        ('Kindred', 'Completed', 5), ('Kindred', 'To Read', 5),
+        ('Parable of the Sower', 'To Read', 9)]
+    # Duplicates within one import stay separate books
+    assert len({item['book_id'] for item in items}) == 3
+    assert {item['isbn'] for item in items} == {None, '9781538712199'}
+
+def test_search(client):
+    add_book(client, 41, 'The Left Hand of Darkness')
+    add_book(client, 41, 'The Lathe of Heaven', genre='Science Fiction')
+
+    def search(query):
+        response = client.get('/api/search', query_string={'q': query}, headers=headers(41))
+        assert response.status_code == 200, response.get_json()
+        return sorted(book['title'] for book in response.get_json())
+
+    assert search('left hand') == ['The Left Hand of Darkness']
+    assert search('Lath') == ['The Lathe of Heaven']
+    assert search('science') == ['The Lathe of Heaven']
+    assert search('Le Guin') == ['The Lathe of Heaven', 'The Left Hand of Darkness']
+
+def test_search_uses_full_text_index(postgres, client):
+    add_book(client, 42, 'The Word for World Is Forest')
+    response = client.get('/api/search', query_string={'q': 'wor fore'}, headers=headers(42))
+    assert [book['title'] for book in response.get_json()] == ['The Word for World Is Forest']
+
+    conn = postgres.connect_db(42)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE tablename = 'Books'")
+        assert any('to_tsvector' in row[0] and 'gin' in row[0].lower()
+                   for row in cursor.fetchall())
+    finally:
+        conn.close()
+
+def test_backup(tbr, client, tmp_path):
+    add_book(client, 51, 'Always Coming Home')
+    response = client.get('/api/backup', headers=headers(51))
+    assert response.status_code == 200, response.get_json()
+    backup_file = tmp_path / response.get_json()['backup_file']
+    with open(backup_file, 'rb') as f:
+        magic = f.read(16)
+    if tbr.shard_router.postgres:
+        assert backup_file.suffix == '.dump'
+        assert magic.startswith(b'PGDMP')  # pg_dump's custom format
+    else:
+        assert backup_file.suffix == '.db'
+        assert magic == b'SQLite format 3\x00'
+
+def test_goal_targets_own_books_only(tbr, client):
+    book_id = add_book(client, 61, 'The Tombs of Atuan')
+    response = client.post('/api/goal', json={'goal_type': 'book', 'target_book_id': book_id},
+                           headers=headers(62))
+    assert response.status_code == 400
+
+    response = client.post('/api/goal', json={'goal_type': 'book', 'target_book_id': book_id},
+                           headers=headers(61))
+    assert response.status_code == 200, response.get_json()
+    goals = client.get('/api/goals', headers=headers(61)).get_json()
+    assert [goal['book_title'] for goal in goals] == ['The Tombs of Atuan']
+    assert client.get('/api/goals', headers=headers(62)).get_json() == []
+
+    # A stray goal left from before the check must not block the owner's delete
+    conn = tbr.connect_db(62)
+    try:
+        conn.cursor().execute("INSERT INTO ReadingGoals (user_id, goal_type, target_book_id, "
+                              "start_date, end_date) VALUES (?, 'book', ?, '2024-01-01', "
+                              "'2024-12-31')", (62, book_id))
+        conn.commit()
+    finally:
+        conn.close()
+    assert client.get('/api/goals', headers=headers(62)).get_json()[0]['book_title'] is None
+
+    assert client.delete(f'/api/book/{book_id}', headers=headers(61)).status_code == 200
+    goals = client.get('/api/goals', headers=headers(61)).get_json()
+    assert [(goal['target_book_id'], goal['book_title']) for goal in goals] == [(None, None)]
+
+def test_change_ids_are_taken_in_commit_order(postgres, client):
+    psycopg = pytest.importorskip('psycopg')
+    add_book(client, 71, 'Planet of Exile', author_name='Shared Author 71')
+    version = client.get('/api/tbr/changes?since=0', headers=headers(71)).get_json()['version']
+
+    with psycopg.connect(TEST_DATABASE_URL) as first, \
+            psycopg.connect(TEST_DATABASE_URL) as second:
+        # An in-place author edit takes a change id every user's delta reads include
+        first.execute('UPDATE "Authors" SET name = name WHERE name = %s', ('Shared Author 71',))
+        second.execute("SET lock_timeout = '200ms'")
+        # A later change for the user must wait rather than commit a larger id first
+        with pytest.raises(psycopg.errors.LockNotAvailable):
+            second.execute('UPDATE "Books" SET rating = 3 WHERE user_id = 71')
+        second.rollback()
+        first.commit()
+
+    changes = client.get(f'/api/tbr/changes?since={version}', headers=headers(71)).get_json()
+    assert [item['title'] for item in changes['tbr']] == ['Planet of Exile']
+
+def test_goal_paging(client):
+    for end_date in ('2031-01-01', '2032-01-01', '2033-01-01'):
+        response = client.post('/api/goal', json={'goal_type': 'books_count', 'target_value': 3,
+                                                   'end_date': end_date}, headers=headers(81))
+        assert response.status_code == 200, response.get_json()
+
+    page = client.get('/api/goals?limit=2', headers=headers(81)).get_json()
+    assert [goal['end_date'] for goal in page['goals']] == ['2031-01-01', '2032-01-01']
+    page = client.get('/api/goals', query_string={'limit': 2, 'after': page['next_cursor']},
+                      headers=headers(81)).get_json()
+    assert [goal['end_date'] for goal in page['goals']] == ['2033-01-01']
+    assert page['next_cursor'] is None
+
+    for query in ('status=bogus', 'after=xyz', 'after=2031-01-01:x', 'limit=-1', 'limit=0',
+                  'limit=ten'):
+        response = client.get(f'/api/goals?{query}', headers=headers(81))
+        assert response.status_code == 400, query
+
+def test_no_n_plus_one_queries(tbr, client, monkeypatch):
+    user_id = 91
+    count = tbr.app.config['QUERY_REPEAT_LIMIT'] + 3
+    books = [{'title': f'Book {i}', 'author_name': f'Author {i}', 'genre': f'Genre {i}',
+              'page_count': 100 + i, 'status_id': 1 if i % 2 else 3,
+              'date_completed': '2024-03-01' if i % 2 else None}
+             for i in range(count)]
+    response = client.post('/api/import', json={'books': books}, headers=headers(user_id))
+    assert response.get_json() == {'success': True, 'imported': count}
+    for item in tbr_items(client, user_id):
+        response = client.post('/api/goal', json={'goal_type': 'book',
+                                                   'target_book_id': item['book_id']},
+                               headers=headers(user_id))
+        assert response.status_code == 200, response.get_json()
+
+    assert client.get('/api/admin/stats', headers=headers(user_id)).status_code == 403
+    monkeypatch.setitem(tbr.app.config, 'ADMIN_TOKEN', 'secret')
+    response = client.get('/api/admin/stats',
+                          headers={**headers(user_id), 'X-Admin-Token': 'wrong'})
+    assert response.status_code == 403
+
+    results = tbr.audit_query_counts(user_id)
+    assert results
+    for result in results:
+        assert result['status'] == 200, result
+        assert result['repeated'] == {}, result
+
+    # One query per book is exactly what strict mode exists to catch
+    def lazy_genres(user_id=1):
+        conn = tbr.connect_db(user_id)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT book_id FROM Books WHERE user_id = ?", (user_id,))
+            genres = []
+            for (book_id,) in cursor.fetchall():
+                cursor.execute("SELECT g.genre_id, g.genre FROM Books b "
+                               "JOIN Genres g ON b.genre_id = g.genre_id WHERE b.book_id = ?",
+                               (book_id,))
+                genre_id, genre = cursor.fetchone()
+                genres.append({'genre_id': genre_id, 'genre': genre})
+            return genres
+        finally:
+            conn.close()
+
+    monkeypatch.setattr(tbr, 'get_genres_orm', lazy_genres)
+    monkeypatch.setitem(tbr.app.config, 'QUERY_STRICT', True)
+    response = client.get('/api/genres', headers=headers(user_id))
+    assert response.status_code == 500
+    assert response.get_json()['error'] == 'N+1 query pattern'
+    monkeypatch.setitem(tbr.app.config, 'QUERY_STRICT', False)
+    assert client.get('/api/genres', headers=headers(user_id)).status_code == 200
+
+def test_archive_publishes_meta_on_commit(tbr, monkeypatch, tmp_path):
+    archive = tbr.ReadingArchive(str(tmp_path / 'archive'))
+
+    def row(tbr_id, user_id):
+        return (tbr_id, tbr_id, user_id, 1, 5, 300, 2001, 4,
+                'Title', 'Author', 'Genre', None, 'Read', '2020-01-01', '2020-02-01', None)
+
+    archive.append([row(1, 5)])
+    before = archive.summary(5)
+    assert before['by_status'] == {'Read': 1}
+
+    def fail(meta):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(archive, '_commit', fail)
+    with pytest.raises(OSError):
+        archive.append([row(2, 5), row(3, 6)])
+    assert archive.meta()['rows'] == 1
+    assert archive.summary(5) == before and archive.summary(6) is None
+    monkeypatch.undo()
+
+    archive.append([row(4, 6)])
+    assert archive.summary()['entries'] == 2
+    assert [r['tbr_id'] for r in archive.iter_rows(6)] == [4]
+
+def test_similar_books_ignore_unrelated_changes(tbr, client, monkeypatch):
+    book_id = add_book(client, 101, 'The Left Hand of Darkness', genre='Science Fiction')
+    add_book(client, 101, 'The Dispossessed', genre='Science Fiction')
+    path = tbr.shard_router.path_for(101)
+    conn = tbr.connect_path(path)
+    try:
+        assert tbr.get_similarity_index(path).sync(conn.cursor())
+    finally:
+        conn.close()
+
+    monkeypatch.setattr(tbr, 'SIMILAR_REQUEST_MAX_CHANGES', 3)
+    tbr_id = tbr_items(client, 101)[0]['tbr_id']
+    for status_id in (1, 3, 1, 3, 1):
+        assert client.put('/api/status', json={'tbr_id': tbr_id, 'status_id': status_id},
+                          headers=headers(101)).status_code == 200
+    response = client.get(f'/api/book/{book_id}/similar', headers=headers(101))
+    assert response.status_code == 200
+    assert [book['title'] for book in response.get_json()] == ['The Dispossessed']
+
+    for i in range(4):
+        add_book(client, 101, f'Another Book {i}')
+    response = client.get(f'/api/book/{book_id}/similar', headers=headers(101))
+    assert response.status_code == 503
+
+def test_one_settings_row_per_user(tbr, client):
+    assert client.get('/api/settings', headers=headers(111)).get_json()['theme'] == 'light'
+    assert client.put('/api/settings', json={'theme': 'dark'},
+                      headers=headers(111)).status_code == 200
+    assert client.put('/api/settings', json={'cardLayout': 'list'},
+                      headers=headers(112)).status_code == 200
+    settings = client.get('/api/settings', headers=headers(111)).get_json()
+    assert (settings['theme'], settings['card_layout']) == ('dark', 'grid')
+    settings = client.get('/api/settings', headers=headers(112)).get_json()
+    assert (settings['theme'], settings['card_layout']) == ('light', 'list')
+
+    insert = "INSERT INTO UserSettings (user_id, theme) VALUES (?, 'light')"
+    conn = tbr.connect_db(111)
+    try:
+        with pytest.raises(tbr.database_errors()):
+            conn.cursor().execute(insert, (111,))
+        conn.rollback()
+
+        # Databases from before the unique index lose their duplicates on upgrade
+        cursor = conn.cursor()
+        cursor.execute("DROP INDEX idx_settings_user")
+        cursor.execute(insert, (111,))
+        cursor.execute("DELETE FROM SchemaInfo WHERE key = 'fingerprint'")
+        conn.commit()
+    finally:
+        conn.close()
+    assert tbr.initialize_schema(tbr.shard_router.path_for(111))
+    conn = tbr.connect_db(111)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT theme FROM UserSettings WHERE user_id = ?", (111,))
+        assert cursor.fetchall() == [('dark',)]
+    finally:
+        conn.close()